@@ -0,0 +1,87 @@
+"""
+Order-confirmation throughput against a local SMTP sink, before vs after the
+delivery queue.
+
+before: a new SMTP connection and login per recipient, three recipients one
+        after another on a shared 3-thread pool (the old _send_sync path).
+after:  services.email.send_order_confirmation with the queue and its
+        persistent, authenticated connections.
+
+Each order is three messages. `--orders` confirmations are fired at once, as
+in an order rush, and the clock stops when the sink has all of them. Run
+from apps/api:
+
+    python benchmarks/bench_email.py --orders 500
+"""
+import argparse
+import asyncio
+import os
+import smtplib
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("SMTP_SERVER", "127.0.0.1")
+os.environ.setdefault("SMTP_SSL", "false")
+os.environ.setdefault("SMTP_PASSWORD", "sink")
+
+from benchmarks.smtp_sink import SMTPSink
+from services import email as email_service
+
+HTML = "<p>Order confirmed</p>" * 50
+
+async def wait_for(sink: SMTPSink, count: int):
+    while len(sink.messages) < count:
+        await asyncio.sleep(0.005)
+
+async def run_before(sink: SMTPSink, orders: int):
+    executor = ThreadPoolExecutor(max_workers=3)
+
+    def send_sync(to_email, subject):
+        message = email_service._render(email_service.OutgoingEmail(to_email, subject, HTML))
+        with smtplib.SMTP("127.0.0.1", sink.port) as server:
+            server.login("user", "sink")
+            server.sendmail("noreply@example.com", to_email, message)
+
+    async def confirm(i):
+        loop = asyncio.get_running_loop()
+        for to_email in (f"customer{i}@example.com", "owner@example.com", "copy@example.com"):
+            await loop.run_in_executor(executor, send_sync, to_email, f"Order {i}")
+
+    await asyncio.gather(*(confirm(i) for i in range(orders)))
+    await wait_for(sink, orders * 3)
+    executor.shutdown()
+
+async def run_after(sink: SMTPSink, orders: int):
+    email_service.SMTP_PORT = sink.port
+    email_service.start_email_workers()
+    await asyncio.gather(*(
+        email_service.send_order_confirmation(f"customer{i}@example.com", f"ORD-{i:08d}", 49900)
+        for i in range(orders)
+    ))
+    await wait_for(sink, orders * 3)
+    stats = email_service.get_email_stats()
+    await email_service.stop_email_workers()
+    return stats
+
+async def measure(name: str, runner, orders: int):
+    sink = await SMTPSink().start()
+    start = time.perf_counter()
+    result = await runner(sink, orders)
+    elapsed = time.perf_counter() - start
+    await sink.stop()
+    print(f"{name:<7} {orders * 3 / elapsed:>9.0f} msg/s  {elapsed:>7.2f}s  {sink.connections:>5} connections")
+    return result
+
+async def main(orders: int):
+    print(f"{orders} orders, {orders * 3} messages")
+    await measure("before", run_before, orders)
+    stats = await measure("after", run_after, orders)
+    print(f"after: max queue depth {stats['max_queue_depth']}, retried {stats['retried']}, failed {stats['failed']}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=500)
+    args = parser.parse_args()
+    asyncio.run(main(args.orders))
@@ -0,0 +1,156 @@
+"""
+Per-request middleware overhead, before vs after the pure-ASGI rewrite.
+
+before: the old stack - three BaseHTTPMiddleware subclasses (sanitizer with
+        six re.sub passes, chaos reading os.getenv per request, headers).
+after:  middleware.install_middleware(app) with CHAOS_MODE off.
+bare:   the same app with no middleware, as the baseline.
+
+Requests are driven straight through the ASGI interface (no HTTP client), so
+the difference between each stack and "bare" is the middleware cost. The
+access log is enabled but routed to a NullHandler. Run from apps/api:
+
+    python benchmarks/bench_middleware.py --requests 5000
+"""
+import argparse
+import asyncio
+import hashlib
+import logging
+import os
+import random
+import re
+import statistics
+import sys
+import time
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import FastAPI
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import Response
+
+import middleware
+from middleware import install_middleware, match_cache_policy, make_etag, etag_matches
+
+logging.getLogger("api").handlers = [logging.NullHandler()]
+logging.getLogger("api").propagate = False
+
+# --- The stack as it was before the rewrite ---
+
+OLD_SENSITIVE_PATTERNS = [
+    (r'(email=)([^&]+)', r'\1[REDACTED]'),
+    (r'(password=)([^&]+)', r'\1[REDACTED]'),
+    (r'(token=)([^&]+)', r'\1[REDACTED]'),
+    (r'(phone=)([^&]+)', r'\1[REDACTED]'),
+    (r'(card_number=)([^&]+)', r'\1[REDACTED]'),
+    (r'(cvc=)([^&]+)', r'\1[REDACTED]'),
+]
+
+class OldLogSanitizerMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request, call_next):
+        sanitized_query = request.url.query
+        for pattern, replacement in OLD_SENSITIVE_PATTERNS:
+            sanitized_query = re.sub(pattern, replacement, sanitized_query, flags=re.IGNORECASE)
+        middleware.logger.info(f"{request.method} {request.url.path}?{sanitized_query}")
+        return await call_next(request)
+
+class OldChaosMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request, call_next):
+        if os.getenv("CHAOS_MODE", "false").lower() == "true":
+            if random.random() < 0.1:
+                return Response("Chaos Monkey Strike!", status_code=500)
+            await asyncio.sleep(0.5)
+        return await call_next(request)
+
+class OldHeaderMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request, call_next):
+        cache_control, etag_source = match_cache_policy(request.method, request.url.path)
+        url = f"{request.url.path}?{request.url.query}"
+        etag = middleware._body_etags.get(url) if etag_source == "body" else None
+        if etag and etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+        response = await call_next(request)
+        if etag_source == "body" and etag is None and response.status_code == 200:
+            body = b"".join([chunk async for chunk in response.body_iterator])
+            etag = middleware._body_etags[url] = make_etag("body", hashlib.sha1(body).hexdigest())
+            response = Response(content=body, status_code=200, headers=dict(response.headers), media_type=response.media_type)
+        if etag and response.status_code == 200:
+            response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = cache_control
+        return response
+
+def build_app(stack: str) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/api/v1/orders/{order_id}")
+    async def order(order_id: int):
+        return {"id": order_id, "status": "PAID"}
+
+    if stack == "before":
+        app.add_middleware(OldLogSanitizerMiddleware)
+        app.add_middleware(OldChaosMiddleware)
+        app.add_middleware(OldHeaderMiddleware)
+    elif stack == "after":
+        install_middleware(app)
+    return app
+
+def make_scope(path: str, query: bytes) -> dict:
+    return {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "GET", "scheme": "http", "path": path, "raw_path": path.encode(),
+        "query_string": query, "root_path": "",
+        "headers": [(b"host", b"bench"), (b"accept", b"application/json")],
+        "client": ("127.0.0.1", 50000), "server": ("bench", 80),
+    }
+
+async def call(app, scope: dict) -> int:
+    status = 0
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app(scope, receive, send)
+    return status
+
+async def measure(app, requests: int) -> List[float]:
+    scope = make_scope("/api/v1/orders/42", b"email=jane%40example.com&token=abc123&page=2")
+    for _ in range(min(500, requests)):
+        await call(app, dict(scope))  # warm up
+    timings = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        status = await call(app, dict(scope))
+        timings.append((time.perf_counter() - start) * 1_000_000)
+        assert status == 200
+    return timings
+
+async def main(requests: int):
+    os.environ["CHAOS_MODE"] = "false"
+    results = {}
+    for stack in ("bare", "before", "after"):
+        timings = sorted(await measure(build_app(stack), requests))
+        results[stack] = {
+            "mean": statistics.mean(timings),
+            "p50": timings[len(timings) // 2],
+            "p99": timings[int(len(timings) * 0.99) - 1],
+        }
+
+    print(f"Requests per stack: {requests}")
+    for stack, r in results.items():
+        overhead = r["mean"] - results["bare"]["mean"]
+        print(f"  {stack:<7} mean={r['mean']:.1f}us p50={r['p50']:.1f}us p99={r['p99']:.1f}us overhead={overhead:.1f}us")
+    before = results["before"]["mean"] - results["bare"]["mean"]
+    after = results["after"]["mean"] - results["bare"]["mean"]
+    print(f"  middleware overhead per request: {before:.1f}us -> {after:.1f}us")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests))
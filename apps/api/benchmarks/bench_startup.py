@@ -0,0 +1,106 @@
+"""
+Worker boot time: importing main.py, lifespan startup, and the first request.
+
+before: the boot as it used to be - stripe, reportlab, smtplib and aiohttp
+        imported with main.py, create_all on every boot and a product scan
+        to decide whether to seed.
+after:  bootstrap.ensure_schema (one query when the schema is current) and
+        heavy modules loaded on first use.
+
+Each boot is a fresh interpreter (`--child`), so import caches don't carry
+over, against a SQLite file: "cold" is an empty database (tables created and
+inventory.csv seeded), "warm" is the database a previous boot left behind,
+which is what every restart and scale-out worker sees. The numbers come from
+bootstrap.startup_stats, the same figures /api/v1/health/startup reports per
+worker. Run from apps/api:
+
+    python benchmarks/bench_startup.py --boots 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+STARTED_AT = time.perf_counter()
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PHASES = ["import_seconds", "startup_seconds", "first_request_seconds"]
+
+# --- One boot (child process) ---
+
+async def _legacy_ensure_schema(engine, session_factory, seed_file=None):
+    from sqlalchemy.future import select
+    from database import Base
+    import bootstrap
+    import models
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with session_factory() as session:
+        existing = (await session.execute(select(models.Product))).scalars().first()
+    if not existing:
+        await bootstrap.seed_products(session_factory, seed_file or bootstrap.SEED_FILE)
+    return "legacy"
+
+def boot(legacy: bool) -> dict:
+    sys.path.insert(0, API_DIR)
+    if legacy:
+        # Imported at module load before
+        import stripe, smtplib, aiohttp, email.mime.multipart # noqa: F401
+        import services.receipt_layout # noqa: F401
+    import main
+    import bootstrap
+    import httpx
+
+    main.bootstrap.record_startup("import", started_at=STARTED_AT)
+    if legacy:
+        bootstrap.ensure_schema = _legacy_ensure_schema
+
+    async def run():
+        async with main.app.router.lifespan_context(main.app):
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                response = await client.get("/api/v1/health")
+                assert response.status_code == 200
+            return dict(bootstrap.startup_stats)
+
+    return asyncio.run(run())
+
+# --- Driver ---
+
+def run_boot(database_url: str, legacy: bool) -> dict:
+    env = {**os.environ, "DATABASE_URL": database_url, "SMTP_PASSWORD": "", "REDIS_URL": ""}
+    args = [sys.executable, os.path.abspath(__file__), "--child"] + (["--legacy"] if legacy else [])
+    result = subprocess.run(args, cwd=API_DIR, env=env, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def summarize(label: str, boots: list):
+    cells = []
+    for phase in PHASES:
+        values = [b[phase] for b in boots]
+        cells.append(f"{phase.replace('_seconds', '')} {statistics.median(values) * 1000:7.1f} ms")
+    print(f"{label:<12} " + "  ".join(cells))
+
+def main(args):
+    for label, legacy in (("before", True), ("after", False)):
+        with tempfile.TemporaryDirectory() as tmp:
+            database_url = f"sqlite+aiosqlite:///{os.path.join(tmp, 'bench.db')}"
+            cold = [run_boot(database_url, legacy)]
+            warm = [run_boot(database_url, legacy) for _ in range(args.boots)]
+        summarize(f"{label} cold", cold)
+        summarize(f"{label} warm", warm)
+    print("(times since main.py started importing; medians of", args.boots, "warm boots)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--boots", type=int, default=5)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--legacy", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        print(json.dumps(boot(args.legacy)))
+    else:
+        main(args)
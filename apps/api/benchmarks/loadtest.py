@@ -0,0 +1,396 @@
+"""
+Hermetic load test: boots the API (one uvicorn worker) against local
+stand-ins and drives a mix of storefront traffic at it over HTTP.
+
+Stand-ins, all started here and torn down afterwards:
+- database: a fresh SQLite file (default), or --database URL for a local
+  Postgres you don't mind filling with test orders
+- Redis: fakeredis inside the API process (default), --redis URL for a real
+  one, or --redis none to run without
+- Stripe: benchmarks/stub_payments.py (PAYMENTS_API_BASE), and webhooks
+  signed with a test STRIPE_WEBHOOK_SECRET
+- SMTP: benchmarks/smtp_sink.py
+
+Each virtual user loops over scenarios picked by weight (--mix):
+  browse    GET /products, then one product
+  search    GET /products/search with a term and a facet
+  cart      POST /cart/validate
+  checkout  POST /payments/create-intent with a fresh Idempotency-Key
+  webhook   payment_intent.succeeded for an earlier checkout (1 in 10 is a
+            redelivery of the same event)
+
+Throughput and p50/p95/p99 per route go to a JSON report (--out). Compare
+against an earlier run with --compare. Run from apps/api:
+
+    python benchmarks/loadtest.py --users 20 --duration 30 --out loadtest.json
+    python benchmarks/loadtest.py --compare loadtest-previous.json
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import math
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict, deque
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, API_DIR)
+
+WEBHOOK_SECRET = "whsec_loadtest"
+DEFAULT_MIX = "browse=50,search=20,cart=10,checkout=12,webhook=8"
+SEARCH_TERMS = ["inverter", "window", "quiet", "btu", "wifi", "split", "portable", "energy"]
+# Shelf stock set before the run, so checkouts don't sell out mid-test
+LOADTEST_STOCK = 10_000_000
+
+# --- The API under test (child process) ---
+
+def serve(port: int, fake_redis: bool):
+    if fake_redis:
+        import fakeredis
+        import redis.asyncio
+        redis.asyncio.from_url = fakeredis.FakeAsyncRedis.from_url
+    import uvicorn
+    import main
+    uvicorn.run(main.app, host="127.0.0.1", port=port, log_level="warning", access_log=False)
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+# --- Measurements ---
+
+def percentile(ordered: List[float], q: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return 0.0
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.recording = False
+
+    def record(self, route: str, status: str, seconds: float):
+        if self.recording:
+            self.latencies[route].append(seconds * 1000)
+            self.statuses[route][status] += 1
+
+    def report(self, duration: float) -> dict:
+        routes = {}
+        for route in sorted(self.latencies):
+            ordered = sorted(self.latencies[route])
+            statuses = dict(sorted(self.statuses[route].items()))
+            errors = sum(n for status, n in statuses.items() if not status.startswith(("2", "3")))
+            routes[route] = {
+                "requests": len(ordered),
+                "errors": errors,
+                "statuses": statuses,
+                "throughput_rps": round(len(ordered) / duration, 2),
+                "latency_ms": {
+                    "p50": round(percentile(ordered, 50), 2),
+                    "p95": round(percentile(ordered, 95), 2),
+                    "p99": round(percentile(ordered, 99), 2),
+                    "max": round(ordered[-1], 2),
+                    "mean": round(sum(ordered) / len(ordered), 2),
+                },
+            }
+        total = sum(r["requests"] for r in routes.values())
+        return {
+            "summary": {
+                "requests": total,
+                "errors": sum(r["errors"] for r in routes.values()),
+                "duration_s": round(duration, 2),
+                "throughput_rps": round(total / duration, 2),
+            },
+            "routes": routes,
+        }
+
+# --- Traffic ---
+
+def sign_webhook(payload: str, secret: str = WEBHOOK_SECRET) -> str:
+    """A Stripe-Signature header for `payload` (the scheme stripe.Webhook verifies)."""
+    timestamp = int(time.time())
+    digest = hmac.new(secret.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={digest}"
+
+class Traffic:
+    def __init__(self, client, recorder: Recorder, catalog: List[dict], seed: int):
+        self.client = client
+        self.recorder = recorder
+        self.catalog = catalog
+        self.seed = seed
+        self.paid_intents = deque(maxlen=1000) # (intent id, event id, email) sent already
+        self.unpaid_intents = deque()
+
+    async def request(self, route: str, method: str, url: str, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+            status = str(response.status_code)
+        except Exception as e:
+            response, status = None, type(e).__name__
+        self.recorder.record(route, status, time.perf_counter() - start)
+        return response
+
+    def cart_items(self, rng: random.Random) -> List[dict]:
+        products = rng.sample(self.catalog, k=min(len(self.catalog), rng.randint(1, 3)))
+        return [
+            {"product_id": p["id"], "category": p["category"], "name": p["name"], "quantity": rng.randint(1, 2)}
+            for p in products
+        ]
+
+    async def browse(self, rng: random.Random):
+        await self.request("GET /api/v1/products", "GET", "/api/v1/products")
+        product = rng.choice(self.catalog)
+        await self.request("GET /api/v1/products/{product_id}", "GET", f"/api/v1/products/{product['id']}")
+
+    async def search(self, rng: random.Random):
+        params = {"q": rng.choice(SEARCH_TERMS)}
+        if rng.random() < 0.5:
+            params["category"] = rng.choice(self.catalog)["category"]
+        await self.request("GET /api/v1/products/search", "GET", "/api/v1/products/search", params=params)
+
+    async def cart(self, rng: random.Random):
+        await self.request("POST /api/v1/cart/validate", "POST", "/api/v1/cart/validate", json={
+            "items": self.cart_items(rng),
+            "customer_email": f"shopper{rng.randint(1, 10_000)}@example.com",
+        })
+
+    async def checkout(self, rng: random.Random):
+        items = self.cart_items(rng)
+        prices = {p["id"]: p["price"] for p in self.catalog}
+        email = f"shopper{rng.randint(1, 10_000)}@example.com"
+        response = await self.request(
+            "POST /api/v1/payments/create-intent", "POST", "/api/v1/payments/create-intent",
+            json={
+                "items": items,
+                "client_total_cents": sum(prices[i["product_id"]] * 100 * i["quantity"] for i in items),
+                "customer_email": email,
+            },
+            headers={"Idempotency-Key": str(uuid.uuid4())},
+        )
+        if response is not None and response.status_code == 200:
+            self.unpaid_intents.append((response.json()["id"], email))
+
+    async def webhook(self, rng: random.Random):
+        if self.paid_intents and rng.random() < 0.1:
+            intent_id, event_id, email = rng.choice(self.paid_intents) # Redelivery
+        elif self.unpaid_intents:
+            intent_id, email = self.unpaid_intents.popleft()
+            event_id = f"evt_{uuid.uuid4().hex}"
+            self.paid_intents.append((intent_id, event_id, email))
+        else:
+            return await self.checkout(rng)
+        payload = json.dumps({
+            "id": event_id,
+            "object": "event",
+            "type": "payment_intent.succeeded",
+            "data": {"object": {"id": intent_id, "object": "payment_intent", "amount_received": 0, "receipt_email": email}},
+        })
+        await self.request("POST /api/webhooks/stripe", "POST", "/api/webhooks/stripe", content=payload, headers={
+            "Stripe-Signature": sign_webhook(payload), "Content-Type": "application/json",
+        })
+
+    async def user(self, number: int, mix: Dict[str, int], deadline: float, think: float):
+        rng = random.Random(self.seed * 1000 + number)
+        scenarios, weights = list(mix), list(mix.values())
+        while time.monotonic() < deadline:
+            await getattr(self, rng.choices(scenarios, weights)[0])(rng)
+            if think:
+                await asyncio.sleep(rng.expovariate(1 / think))
+
+# --- Run ---
+
+def parse_mix(mix: str) -> Dict[str, int]:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in ("browse", "search", "cart", "checkout", "webhook"):
+            raise SystemExit(f"Unknown scenario in --mix: {name!r}")
+        weights[name.strip()] = int(weight or 1)
+    return weights
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=API_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def wait_until_up(client, server: subprocess.Popen, log_path: str, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            break
+        try:
+            if (await client.get("/api/v1/health")).status_code == 200:
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.2)
+    with open(log_path, encoding="utf-8", errors="replace") as f:
+        tail = f.readlines()[-30:]
+    raise SystemExit("API did not come up:\n" + "".join(tail))
+
+async def run(args) -> dict:
+    import httpx
+    from benchmarks.smtp_sink import SMTPSink
+    from benchmarks.stub_payments import StubPayments
+
+    mix = parse_mix(args.mix)
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    sink = await SMTPSink().start()
+    stub = await StubPayments(latency=args.payments_latency).start()
+    port = free_port()
+    env = {
+        **os.environ,
+        "DATABASE_URL": args.database or f"sqlite+aiosqlite:///{os.path.join(workdir, 'loadtest.db')}",
+        "DATABASE_READ_URL": "",
+        "REDIS_URL": "" if args.redis == "none" else ("redis://loadtest" if args.redis == "fake" else args.redis),
+        "PAYMENTS_API_BASE": stub.base_url,
+        "STRIPE_SECRET_KEY": "sk_test_loadtest",
+        "STRIPE_WEBHOOK_SECRET": WEBHOOK_SECRET,
+        "SMTP_SERVER": "127.0.0.1",
+        "SMTP_PORT": str(sink.port),
+        "SMTP_SSL": "false",
+        "SMTP_PASSWORD": "",
+        "CHAOS_MODE": "false",
+    }
+    log_path = os.path.join(workdir, "api.log")
+    command = [sys.executable, os.path.abspath(__file__), "--serve", "--port", str(port)]
+    if args.redis == "fake":
+        command.append("--fake-redis")
+    with open(log_path, "w") as log:
+        server = subprocess.Popen(command, cwd=API_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+    limits = httpx.Limits(max_connections=args.users, max_keepalive_connections=args.users)
+    recorder = Recorder()
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=30) as client:
+            await wait_until_up(client, server, log_path)
+            catalog = (await client.get("/api/v1/products")).json()
+            stock = "".join(json.dumps({"id": p["id"], "stock": LOADTEST_STOCK}) + "\n" for p in catalog)
+            await client.post("/api/v1/admin/products/import?format=ndjson", content=stock)
+
+            traffic = Traffic(client, recorder, catalog, args.seed)
+            if args.warmup:
+                deadline = time.monotonic() + args.warmup
+                await asyncio.gather(*(traffic.user(n, mix, deadline, args.think) for n in range(args.users)))
+            recorder.recording = True
+            started = time.monotonic()
+            deadline = started + args.duration
+            await asyncio.gather(*(traffic.user(n, mix, deadline, args.think) for n in range(args.users)))
+            duration = time.monotonic() - started
+            recorder.recording = False
+
+            await asyncio.sleep(args.settle) # Let queued webhooks and email drain
+            backend = {}
+            for name in ("webhooks", "email", "payments", "cache", "db", "startup"):
+                response = await client.get(f"/api/v1/health/{name}")
+                backend[name] = response.json() if response.status_code == 200 else {"status": response.status_code}
+    finally:
+        server.terminate()
+        try:
+            await asyncio.to_thread(server.wait, 30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        await asyncio.sleep(0.2) # The sink sees the API's SMTP connections close
+        await stub.stop()
+        await sink.stop()
+
+    report = recorder.report(duration)
+    backend["standins"] = {"smtp_messages": len(sink.messages), "smtp_connections": sink.connections, "payment_requests": stub.requests}
+    return {
+        "meta": {
+            "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": {
+                "users": args.users, "duration_s": args.duration, "warmup_s": args.warmup, "think_s": args.think,
+                "mix": mix, "seed": args.seed, "payments_latency_s": args.payments_latency,
+                "database": "sqlite" if not args.database else args.database.split(":", 1)[0],
+                "redis": args.redis if args.redis in ("fake", "none") else "url",
+            },
+            "api_log": log_path,
+        },
+        **report,
+        "backend": backend,
+    }
+
+def print_report(report: dict):
+    print(f"{'route':<40} {'req':>7} {'err':>5} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for route, r in report["routes"].items():
+        l = r["latency_ms"]
+        print(f"{route:<40} {r['requests']:>7} {r['errors']:>5} {r['throughput_rps']:>8.1f} {l['p50']:>8.1f} {l['p95']:>8.1f} {l['p99']:>8.1f}")
+    s = report["summary"]
+    print(f"{'total':<40} {s['requests']:>7} {s['errors']:>5} {s['throughput_rps']:>8.1f}   (latencies in ms)")
+
+def print_comparison(baseline: dict, report: dict):
+    print(f"\nvs {baseline['meta'].get('git_commit') or 'baseline'} ({baseline['meta'].get('started_at')}):")
+    print(f"{'route':<40} {'rps':>21} {'p95 ms':>21} {'p99 ms':>21}")
+    for route, r in report["routes"].items():
+        old = baseline["routes"].get(route)
+        if old is None:
+            print(f"{route:<40} (new)")
+            continue
+
+        def change(old_value, new_value):
+            delta = (new_value - old_value) / old_value * 100 if old_value else 0.0
+            return f"{old_value:>7.1f}->{new_value:<7.1f}{delta:+4.0f}%"
+        print(
+            f"{route:<40} {change(old['throughput_rps'], r['throughput_rps'])}"
+            f" {change(old['latency_ms']['p95'], r['latency_ms']['p95'])}"
+            f" {change(old['latency_ms']['p99'], r['latency_ms']['p99'])}"
+        )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5, help="unmeasured seconds first")
+    parser.add_argument("--think", type=float, default=0, help="mean pause between scenarios (s)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"scenario weights (default {DEFAULT_MIX})")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--database", help="database URL instead of a fresh SQLite file")
+    parser.add_argument("--redis", default="fake", help="fake, none, or a Redis URL")
+    parser.add_argument("--payments-latency", type=float, default=0.05, help="stub payments API delay (s)")
+    parser.add_argument("--settle", type=float, default=2, help="seconds to let queues drain before reading stats")
+    parser.add_argument("--out", default="loadtest.json", help="JSON report path")
+    parser.add_argument("--compare", help="earlier JSON report to diff against")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--fake-redis", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.port, args.fake_redis)
+        return
+
+    report = asyncio.run(run(args))
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+        f.write("\n")
+    print_report(report)
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(json.load(f), report)
+    print(f"\nReport: {args.out}  (API log: {report['meta']['api_log']})")
+
+if __name__ == "__main__":
+    main()
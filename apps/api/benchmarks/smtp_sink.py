@@ -0,0 +1,108 @@
+"""
+A local SMTP sink: accepts (and discards) mail, counting connections and
+messages. Speaks just enough SMTP for smtplib: EHLO/HELO, AUTH PLAIN (any
+credentials), MAIL, RCPT, DATA, RSET, NOOP, QUIT. No TLS, so point the API
+at it with SMTP_SSL=false. Run from apps/api:
+
+    python benchmarks/smtp_sink.py --port 2525
+
+Recipients containing "reject" get a 550, and `disconnect_every=N` drops the
+connection after every N-th message, for exercising retries.
+"""
+import argparse
+import asyncio
+import time
+
+class SMTPSink:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, disconnect_every: int = 0):
+        self.host = host
+        self.port = port
+        self.disconnect_every = disconnect_every
+        self.connections = 0
+        self.messages = []
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+
+        async def reply(line: str):
+            writer.write(f"{line}\r\n".encode("ascii"))
+            await writer.drain()
+
+        await reply("220 sink ESMTP")
+        recipients = []
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.decode("utf-8", "replace").strip()
+                verb = command[:4].upper()
+                if verb == "EHLO":
+                    await reply("250-sink")
+                    await reply("250 AUTH PLAIN")
+                elif verb == "HELO":
+                    await reply("250 sink")
+                elif verb == "AUTH":
+                    await reply("235 Authentication successful")
+                elif verb == "MAIL":
+                    recipients = []
+                    await reply("250 OK")
+                elif verb == "RCPT":
+                    if "reject" in command.lower():
+                        await reply("550 No such user")
+                    else:
+                        recipients.append(command.split(":", 1)[1].strip().strip("<>"))
+                        await reply("250 OK")
+                elif verb == "DATA":
+                    await reply("354 End data with <CR><LF>.<CR><LF>")
+                    size = 0
+                    while True:
+                        data = await reader.readline()
+                        if not data or data == b".\r\n":
+                            break
+                        size += len(data)
+                    self.messages.append({"to": recipients, "size": size, "at": time.monotonic()})
+                    await reply("250 OK queued")
+                    if self.disconnect_every and len(self.messages) % self.disconnect_every == 0:
+                        break
+                elif verb == "QUIT":
+                    await reply("221 Bye")
+                    break
+                elif verb in ("RSET", "NOOP"):
+                    await reply("250 OK")
+                else:
+                    await reply("502 Command not implemented")
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+async def main(host: str, port: int):
+    sink = await SMTPSink(host, port).start()
+    print(f"SMTP sink on {host}:{sink.port}")
+    last = 0
+    while True:
+        await asyncio.sleep(5)
+        received = len(sink.messages)
+        print(f"{received} messages ({(received - last) / 5:.1f}/s), {sink.connections} connections")
+        last = received
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=2525)
+    args = parser.parse_args()
+    try:
+        asyncio.run(main(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,82 @@
+"""
+A local stand-in for Stripe's PaymentIntents API: POST /v1/payment_intents
+answers like Stripe does, after `latency` seconds, and replays the same
+intent for a repeated Idempotency-Key. Point the API at it with
+PAYMENTS_API_BASE (any STRIPE_SECRET_KEY is accepted). Run from apps/api:
+
+    python benchmarks/stub_payments.py --port 12111 --latency 0.05
+"""
+import argparse
+import asyncio
+import itertools
+from aiohttp import web
+
+class StubPayments:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.05):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.intents = {} # Idempotency-Key -> intent
+        self.requests = 0
+        self._ids = itertools.count(1)
+        self._runner = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/v1/payment_intents", self._create_intent)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+    async def _create_intent(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        form = await request.post()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        key = request.headers.get("Idempotency-Key")
+        if key and key in self.intents:
+            return web.json_response(self.intents[key])
+        try:
+            amount = int(form["amount"])
+        except (KeyError, ValueError):
+            return web.json_response({"error": {"message": "Invalid amount"}}, status=400)
+        number = next(self._ids)
+        intent = {
+            "id": f"pi_stub_{number}",
+            "object": "payment_intent",
+            "client_secret": f"pi_stub_{number}_secret_stub",
+            "amount": amount,
+            "currency": form.get("currency", "usd"),
+            "status": "requires_payment_method",
+        }
+        if key:
+            self.intents[key] = intent
+        return web.json_response(intent)
+
+async def main(host: str, port: int, latency: float):
+    stub = await StubPayments(host, port, latency).start()
+    print(f"Stub payments API on {stub.base_url}")
+    while True:
+        await asyncio.sleep(5)
+        print(f"{stub.requests} requests, {len(stub.intents)} intents")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=12111)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per call")
+    args = parser.parse_args()
+    try:
+        asyncio.run(main(args.host, args.port, args.latency))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,95 @@
+from sqlalchemy import text
+from typing import Optional, Tuple
+import os
+import time
+from starlette.types import ASGIApp, Receive, Scope, Send
+from domain import product_io
+import migrations
+
+# Worker startup. Every worker runs ensure_schema in lifespan; when the
+# database is already at SCHEMA_VERSION and has products, that is one small
+# query, instead of create_all's table checks and a product scan per boot.
+
+# The latest migration in migrations.py
+SCHEMA_VERSION = migrations.LATEST_VERSION
+SEED_FILE = os.path.join(os.path.dirname(__file__), "inventory.csv")
+
+# Seconds since this worker started importing main.py (see record_startup)
+startup_stats = {"import_seconds": None, "startup_seconds": None, "first_request_seconds": None, "schema": None, "seeded": 0}
+
+async def check_schema(engine) -> Optional[Tuple[int, bool]]:
+    """(schema version, whether any product exists), or None before the first setup."""
+    try:
+        async with engine.connect() as conn:
+            row = (await conn.execute(text(
+                "SELECT (SELECT max(version) FROM schema_version), EXISTS (SELECT 1 FROM products)"
+            ))).one()
+    except Exception:
+        return None # No schema_version table yet
+    return row[0], bool(row[1])
+
+async def ensure_schema(engine, session_factory, seed_file: str = SEED_FILE) -> str:
+    """
+    Runs pending migrations when the database is behind SCHEMA_VERSION, then
+    seeds products from `seed_file` if there are none. Returns what it did:
+    "current", "created" (new database) or "upgraded". Deploys normally run
+    migrate.py first, so workers only find the database current.
+    """
+    state = await check_schema(engine)
+    if state is not None and state[0] is not None and state[0] >= SCHEMA_VERSION:
+        status = "current"
+    else:
+        await migrations.run_migrations(engine)
+        status = "created" if state is None else "upgraded"
+        print(f"Schema at version {SCHEMA_VERSION} ({status}).")
+        state = await check_schema(engine)
+
+    if state is None or not state[1]:
+        await seed_products(session_factory, seed_file)
+    return status
+
+async def seed_products(session_factory, seed_file: str):
+    print(f"Database empty. Seeding from {os.path.basename(seed_file)}...")
+    try:
+        stats = await product_io.import_products(
+            session_factory, product_io.csv_records(product_io.file_chunks(seed_file))
+        )
+    except FileNotFoundError:
+        print(f"Warning: {os.path.basename(seed_file)} not found. Skipping seed.")
+        return
+    startup_stats["seeded"] = stats["created"]
+    print(f"Seeded {stats['created']} products.")
+    for error in stats["errors"]:
+        print(f"Warning: {os.path.basename(seed_file)} row {error['row']}: {error['error']}")
+
+# --- Startup timing ---
+
+_started_at: Optional[float] = None
+
+def record_startup(event: str, started_at: Optional[float] = None):
+    """
+    Sets startup_stats["<event>_seconds"]: main.py records "import" (passing
+    the perf_counter() from its first line) and "startup" (end of lifespan
+    startup); FirstRequestTimer records "first_request".
+    """
+    global _started_at
+    if started_at is not None:
+        _started_at = started_at
+    if _started_at is not None:
+        startup_stats[f"{event}_seconds"] = round(time.perf_counter() - _started_at, 4)
+
+class FirstRequestTimer:
+    """Records when this worker finished its first HTTP request, then only passes through."""
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.pending = True
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if not (self.pending and scope["type"] == "http"):
+            await self.app(scope, receive, send)
+            return
+        self.pending = False
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            record_startup("first_request")
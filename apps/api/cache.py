@@ -1,13 +1,140 @@
 import os
 import json
+import inspect
+import hashlib
 import redis.asyncio as redis
+import time
+import asyncio
+from uuid import uuid4
+from contextlib import AsyncExitStack, asynccontextmanager, contextmanager
+from collections import OrderedDict
 from functools import wraps
-from typing import Optional, Any
+from typing import Optional, Any, Awaitable, Callable, Dict, Iterable, Set, Tuple
+from urllib.parse import urlencode
+from fastapi import params
 from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
+from pydantic import TypeAdapter
 
 # Redis Client Singleton
 redis_client: Optional[redis.Redis] = None
 
+# Hit/miss/error counters for cache_response (see get_cache_stats)
+cache_stats: Dict[str, int] = {
+    "hits": 0, "l1_hits": 0, "stale_hits": 0, "misses": 0, "coalesced": 0, "refreshes": 0,
+    "errors": 0, "bypassed": 0,
+}
+
+# Per-namespace generation counters live under this prefix (see invalidate_cache)
+GENERATION_KEY_PREFIX = "cache:gen"
+
+# Invalidations are broadcast here so every worker drops its L1 entries together
+INVALIDATION_CHANNEL = "cache:invalidate"
+
+# Cache namespace of the product catalog; its generation doubles as the catalog version
+CATALOG_NAMESPACE = "products"
+
+# Short Redis lock that lets a single worker recompute an expired key
+LOCK_KEY_PREFIX = "cache:lock"
+LOCK_POLL_INTERVAL = 0.05
+
+# Misses currently being computed in this process, keyed by cache key
+_inflight: Dict[str, asyncio.Future] = {}
+# Keys with a background stale-while-revalidate refresh running in this process
+_refreshing: Set[str] = set()
+_background_tasks: Set[asyncio.Task] = set()
+
+# Namespace generations known to this process. Only trusted while the
+# invalidation listener is subscribed; otherwise generations are read from Redis.
+_generations: Dict[str, int] = {}
+_listener_task: Optional[asyncio.Task] = None
+_listener_ready = False
+
+# Keys longer than this are hashed so free-text search terms can't blow up the keyspace
+MAX_KEY_LENGTH = 200
+
+class LocalCache:
+    """
+    Bounded in-process LRU tier (L1) in front of Redis.
+    Entries carry their own hard expiry; invalidation drops a whole namespace.
+    """
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[Any]:
+        item = self._entries.get(key)
+        if item is None:
+            return None
+        expires_at, entry = item
+        if time.time() >= expires_at:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def set(self, key: str, entry: Any, expires_at: float):
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = (expires_at, entry)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def drop_namespace(self, namespace: str):
+        prefix = f"{namespace}:"
+        for key in [k for k in self._entries if k.startswith(prefix)]:
+            del self._entries[key]
+
+    def clear(self):
+        self._entries.clear()
+
+# L1 tier shared by every cache_response(l1=True) route; 0 disables it
+local_cache = LocalCache(int(os.getenv("CACHE_L1_MAX_ENTRIES", "1024")))
+
+def _apply_invalidation(namespace: str, generation: int):
+    # Imported here: database needs DATABASE_URL, the cache itself doesn't
+    from database import read_from_primary
+
+    if generation >= _generations.get(namespace, 0):
+        _generations[namespace] = generation
+    local_cache.drop_namespace(namespace)
+    # Misses refill the new generation; they must not see a lagging replica
+    read_from_primary()
+
+async def _listen_for_invalidations():
+    """Keep L1 and local generations in step with invalidations from other workers."""
+    global _listener_ready
+    while True:
+        pubsub = redis_client.pubsub()
+        try:
+            await pubsub.subscribe(INVALIDATION_CHANNEL)
+            # Anything published while we were not subscribed is unknown: start clean
+            _generations.clear()
+            local_cache.clear()
+            _listener_ready = True
+            async for message in pubsub.listen():
+                if message.get("type") != "message":
+                    continue
+                namespace, _, generation = message["data"].rpartition(":")
+                _apply_invalidation(namespace, int(generation))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Cache Invalidation Listener Error: {e}")
+        finally:
+            _listener_ready = False
+            _generations.clear()
+            local_cache.clear()
+            try:
+                await pubsub.close()
+            except Exception:
+                pass
+        await asyncio.sleep(1)
+
 async def init_redis():
     """Initialize Redis connection"""
     global redis_client
@@ -20,68 +147,420 @@ async def init_redis():
         except Exception as e:
             print(f"Redis Connection Failed: {e}")
             redis_client = None
+            return
+        start_invalidation_listener()
+
+def start_invalidation_listener():
+    """Subscribe to cross-worker invalidations (called by init_redis)."""
+    global _listener_task
+    if redis_client and _listener_task is None:
+        _listener_task = asyncio.ensure_future(_listen_for_invalidations())
 
 async def close_redis():
     """Close Redis connection"""
-    global redis_client
+    global redis_client, _listener_task
+    if _listener_task:
+        _listener_task.cancel()
+        try:
+            await _listener_task
+        except asyncio.CancelledError:
+            pass
+        _listener_task = None
     if redis_client:
         await redis_client.close()
 
-def cache_response(ttl: int = 60, key_prefix: str = "api"):
+def get_cache_stats() -> dict:
+    """Snapshot of the cache counters plus the hit ratio over all lookups."""
+    served = cache_stats["hits"] + cache_stats["stale_hits"]
+    lookups = served + cache_stats["misses"]
+    return {
+        **cache_stats,
+        "hit_ratio": round(served / lookups, 4) if lookups else 0.0,
+        "l1_entries": len(local_cache),
+    }
+
+def _dependency_of(param: inspect.Parameter) -> Optional[params.Depends]:
+    """The Depends marker of a parameter FastAPI injects, directly or via Annotated."""
+    if isinstance(param.default, params.Depends):
+        return param.default
+    for marker in getattr(param.annotation, "__metadata__", ()):
+        if isinstance(marker, params.Depends):
+            return marker
+    return None
+
+def _is_dependency(param: inspect.Parameter) -> bool:
+    """True for parameters FastAPI injects (Depends/Security)."""
+    return _dependency_of(param) is not None
+
+def _takes_no_arguments(dependency: Callable) -> bool:
+    return all(
+        p.default is not inspect.Parameter.empty
+        or p.kind in (inspect.Parameter.VAR_POSITIONAL, inspect.Parameter.VAR_KEYWORD)
+        for p in inspect.signature(dependency).parameters.values()
+    )
+
+async def _resolve_dependency(dependency: Callable, stack: AsyncExitStack) -> Any:
+    """
+    Re-run a FastAPI dependency outside of a request (e.g. get_db for a
+    background refresh, after the request's own session has been closed).
+    """
+    if inspect.isasyncgenfunction(dependency):
+        return await stack.enter_async_context(asynccontextmanager(dependency)())
+    if inspect.isgeneratorfunction(dependency):
+        return stack.enter_context(contextmanager(dependency)())
+    if inspect.iscoroutinefunction(dependency):
+        return await dependency()
+    return dependency()
+
+def _normalize_value(value: Any) -> Optional[str]:
+    """Canonical string for a query value. None means 'leave it out of the key'."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, (str, int, float)):
+        return str(value)
+    if isinstance(value, (list, tuple, set, frozenset)):
+        parts = [_normalize_value(v) for v in value]
+        parts = sorted(p for p in parts if p is not None)
+        return ",".join(parts) if parts else None
+    # Anything else (sessions, requests, ...) is not part of the cache identity
+    return None
+
+def build_cache_key(key_prefix: str, name: str, values: Dict[str, Any], generation: int = 0) -> str:
+    """
+    Deterministic key from the route name and its normalized query parameters.
+    Parameters are sorted and None/unset values are dropped, so equivalent
+    requests share a key regardless of argument order or defaults.
+    The namespace generation is part of the key, so invalidate_cache can
+    retire every entry at once by bumping it.
+    """
+    pairs = []
+    for param_name in sorted(values):
+        normalized = _normalize_value(values[param_name])
+        if normalized is not None:
+            pairs.append((param_name, normalized))
+
+    query = urlencode(pairs)
+    if len(query) > MAX_KEY_LENGTH:
+        query = "sha1=" + hashlib.sha1(query.encode("utf-8")).hexdigest()
+    return f"{key_prefix}:g{generation}:{name}:{query}"
+
+def _decode_entry(cached: str) -> Tuple[float, bytes]:
+    """Split a stored entry into its soft expiry and the encoded body (never parsed)."""
+    header, _, body = cached.partition("\n")
+    return float(header), body.encode("utf-8")
+
+async def _store(cache_key: str, body: bytes, ttl: int, stale_ttl: int, l1: bool):
+    """
+    Write an entry that is fresh for `ttl` seconds and servable stale for `stale_ttl` more.
+    Stored as '<soft expiry>\n<body>' so a hit never has to decode the body.
+    """
+    try:
+        expires_at = time.time() + ttl
+        if l1:
+            local_cache.set(cache_key, (expires_at, body), expires_at + stale_ttl)
+        await redis_client.setex(cache_key, ttl + stale_ttl, b"%.3f\n" % expires_at + body)
+    except Exception as e:
+        cache_stats["errors"] += 1
+        print(f"Cache SET Error: {e}")
+
+async def _acquire_lock(cache_key: str, lock_ttl: float) -> Optional[str]:
+    """Cross-worker lock for recomputing a key. Returns the token, or None if another worker holds it."""
+    token = uuid4().hex
+    acquired = await redis_client.set(
+        f"{LOCK_KEY_PREFIX}:{cache_key}", token, nx=True, px=int(lock_ttl * 1000)
+    )
+    return token if acquired else None
+
+async def _release_lock(cache_key: str, token: str):
+    lock_key = f"{LOCK_KEY_PREFIX}:{cache_key}"
+    try:
+        if await redis_client.get(lock_key) == token:
+            await redis_client.delete(lock_key)
+    except Exception as e:
+        cache_stats["errors"] += 1
+        print(f"Cache Lock Release Error: {e}")
+
+async def _compute_once(cache_key: str, compute: Callable[[], Awaitable[Any]], lock_ttl: float) -> Any:
+    """
+    Compute a missing key with at most one worker doing the work.
+    The lock holder computes and stores the value; other workers poll for it
+    until the lock would have expired, then give up and compute themselves.
+    """
+    token = None
+    try:
+        token = await _acquire_lock(cache_key, lock_ttl)
+        if token is None:
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + lock_ttl
+            while loop.time() < deadline:
+                await asyncio.sleep(LOCK_POLL_INTERVAL)
+                cached = await redis_client.get(cache_key)
+                if cached:
+                    cache_stats["coalesced"] += 1
+                    return _decode_entry(cached)[1]
+    except Exception as e:
+        cache_stats["errors"] += 1
+        print(f"Cache Lock Error: {e}")
+
+    try:
+        return await compute()
+    finally:
+        if token:
+            await _release_lock(cache_key, token)
+
+async def _single_flight(cache_key: str, compute: Callable[[], Awaitable[Any]], lock_ttl: float) -> Any:
+    """Concurrent misses for the same key in this process share one computation."""
+    task = _inflight.get(cache_key)
+    if task is None:
+        task = asyncio.ensure_future(_compute_once(cache_key, compute, lock_ttl))
+        _inflight[cache_key] = task
+        task.add_done_callback(lambda _: _inflight.pop(cache_key, None))
+        return await task
+
+    cache_stats["coalesced"] += 1
+    try:
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        # The leading request was cancelled (client went away); we were not.
+        if not task.cancelled():
+            raise
+        return await compute()
+
+def _schedule_refresh(
+    cache_key: str,
+    compute: Callable[[], Awaitable[Any]],
+    lock_ttl: float,
+    reload: Optional[Callable[[], Awaitable[None]]] = None,
+):
+    """
+    Refresh a stale key in the background, once per process and once across workers.
+    Workers that lose the lock call `reload` to pick up the winner's value (L1).
+    """
+    if cache_key in _refreshing:
+        return
+    _refreshing.add(cache_key)
+
+    async def refresh():
+        token = None
+        try:
+            token = await _acquire_lock(cache_key, lock_ttl)
+            if token:
+                cache_stats["refreshes"] += 1
+                await compute()
+            elif reload:
+                await reload()
+        except Exception as e:
+            cache_stats["errors"] += 1
+            print(f"Cache Refresh Error: {e}")
+        finally:
+            if token:
+                await _release_lock(cache_key, token)
+            _refreshing.discard(cache_key)
+
+    task = asyncio.ensure_future(refresh())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+def cache_response(
+    ttl: int = 60,
+    key_prefix: str = "api",
+    vary_on: Optional[Iterable[str]] = None,
+    normalize: Optional[Dict[str, Callable[[Any], Any]]] = None,
+    stale_ttl: int = 0,
+    lock_ttl: float = 5.0,
+    l1: bool = False,
+    response_model: Any = None,
+):
     """
     Decorator for caching async functions.
-    Uses 'stale-while-revalidate' logic if desired, or simple TTL.
-    For this implementation: Simple TTL + JSON serialization.
+    Entries are fresh for `ttl` seconds (soft TTL). With `stale_ttl`, they stay
+    servable for that many seconds more (hard TTL = ttl + stale_ttl): a stale
+    hit is returned immediately while one background task recomputes it.
+    Concurrent misses for a key share one computation, in-process via an
+    in-flight future and across workers via a short Redis lock (`lock_ttl`).
+
+    The key is built from the route name and its query parameters only;
+    dependency-injected arguments (DB sessions etc.) are ignored, and are
+    re-resolved for background refreshes since the request's own are closed.
+    With `l1`, entries are also kept in the in-process LocalCache, so hits
+    skip the Redis round trip; invalidate_cache clears it on every worker.
+    With `response_model`, the result is validated and encoded to its final
+    JSON bytes once (pydantic-core's serializer) and every hit is returned
+    as a ready Response, skipping json.loads, response_model validation and
+    re-encoding. Without it, hits return the decoded JSON.
+    - vary_on: restrict the key to these parameter names.
+    - normalize: per-parameter callables applied before keying (e.g. lowercasing
+      a case-insensitive search term).
     """
     def decorator(func):
+        signature = inspect.signature(func)
+        dependencies = {
+            name: _dependency_of(param).dependency
+            for name, param in signature.parameters.items()
+            if _is_dependency(param)
+        }
+        key_params = [name for name in signature.parameters if name not in dependencies]
+        # Background refresh needs to rebuild every dependency on its own
+        can_refresh = stale_ttl > 0 and all(
+            dep is not None and _takes_no_arguments(dep) for dep in dependencies.values()
+        )
+        if vary_on is not None:
+            allowed = set(vary_on)
+            key_params = [name for name in key_params if name in allowed]
+        normalizers = normalize or {}
+        adapter = TypeAdapter(response_model) if response_model is not None else None
+
+        def encode(result: Any) -> bytes:
+            if adapter is not None:
+                return adapter.dump_json(adapter.validate_python(result, from_attributes=True), by_alias=True)
+            return json.dumps(jsonable_encoder(result)).encode("utf-8")
+
+        def render(body: bytes) -> Any:
+            if adapter is not None:
+                return Response(content=body, media_type="application/json")
+            return json.loads(body)
+
+        def make_key(args, kwargs, generation: int = 0) -> str:
+            bound = signature.bind_partial(*args, **kwargs)
+            bound.apply_defaults()
+            values = {}
+            for name in key_params:
+                value = bound.arguments.get(name)
+                if name in normalizers and value is not None:
+                    value = normalizers[name](value)
+                values[name] = value
+            return build_cache_key(key_prefix, func.__name__, values, generation)
+
+        async def compute_and_store(cache_key: str, args, kwargs) -> bytes:
+            body = encode(await func(*args, **kwargs))
+            await _store(cache_key, body, ttl, stale_ttl, l1)
+            return body
+
+        async def reload_l1(cache_key: str):
+            cached = await redis_client.get(cache_key)
+            if cached:
+                expires_at, body = _decode_entry(cached)
+                local_cache.set(cache_key, (expires_at, body), expires_at + stale_ttl)
+
+        async def refresh_detached(cache_key: str, args, kwargs) -> bytes:
+            bound = signature.bind_partial(*args, **kwargs)
+            arguments = {k: v for k, v in bound.arguments.items() if k not in dependencies}
+            async with AsyncExitStack() as stack:
+                for name, dependency in dependencies.items():
+                    arguments[name] = await _resolve_dependency(dependency, stack)
+                return await compute_and_store(cache_key, (), arguments)
+
         @wraps(func)
         async def wrapper(*args, **kwargs):
             if not redis_client:
+                cache_stats["bypassed"] += 1
                 return await func(*args, **kwargs)
 
-            # Generate Cache Key (Simple)
-            # Warning: args/kwargs must be serializable
-            cache_key = f"{key_prefix}:{func.__name__}:{str(args)}:{str(kwargs)}"
+            cache_key = None
 
             # 1. Try to get from cache
             try:
-                cached = await redis_client.get(cache_key)
-                if cached:
-                    return json.loads(cached)
+                generation = await get_generation(key_prefix)
+                cache_key = make_key(args, kwargs, generation)
+                entry = local_cache.get(cache_key) if l1 else None
+                from_l1 = entry is not None
+                if entry is None:
+                    cached = await redis_client.get(cache_key)
+                    if cached:
+                        entry = _decode_entry(cached)
+                        if l1:
+                            local_cache.set(cache_key, entry, entry[0] + stale_ttl)
+                if entry is not None:
+                    expires_at, body = entry
+                    if time.time() < expires_at:
+                        cache_stats["hits"] += 1
+                        cache_stats["l1_hits"] += from_l1
+                        return render(body)
+                    if can_refresh:
+                        cache_stats["stale_hits"] += 1
+                        _schedule_refresh(
+                            cache_key,
+                            lambda: refresh_detached(cache_key, args, kwargs),
+                            lock_ttl,
+                            reload=(lambda: reload_l1(cache_key)) if l1 else None,
+                        )
+                        return render(body)
             except Exception as e:
+                cache_stats["errors"] += 1
                 print(f"Cache GET Error: {e}")
 
-            # 2. Add header to detect missed cache
-            # (Optional, but useful for debugging)
+            cache_stats["misses"] += 1
 
-            # 3. Execute Function (Application Logic)
+            # 2. Execute Function (Application Logic)
             # If this fails, let it bubble up. Do NOT catch it as a cache error.
-            result = await func(*args, **kwargs)
-
-            # 4. Try to set cache
-            try:
-                encoded_result = jsonable_encoder(result)
-                await redis_client.setex(cache_key, ttl, json.dumps(encoded_result))
-            except Exception as e:
-                print(f"Cache SET Error: {e}")
+            if cache_key is None:
+                return await func(*args, **kwargs)
+            body = await _single_flight(
+                cache_key, lambda: compute_and_store(cache_key, args, kwargs), lock_ttl
+            )
+            return render(body)
 
-            return result
+        wrapper.make_cache_key = make_key
         return wrapper
 
     return decorator
 
+async def get_catalog_version() -> Optional[int]:
+    """
+    Version of the product catalog: the 'products' namespace generation, which
+    create/update/delete_product bump through invalidate_cache. Read from memory
+    while the invalidation listener is subscribed. None without Redis, since
+    there is then no version shared by all workers.
+    """
+    if not redis_client:
+        return None
+    try:
+        return await get_generation(CATALOG_NAMESPACE)
+    except Exception as e:
+        cache_stats["errors"] += 1
+        print(f"Catalog Version Error: {e}")
+        return None
+
+def _namespace(key_pattern: str) -> str:
+    """'products', 'products:*' and 'products:' all name the 'products' namespace."""
+    return key_pattern.split(":", 1)[0].rstrip("*")
+
+async def get_generation(namespace: str) -> int:
+    """
+    Current generation of a namespace (0 until it is first invalidated).
+    Served from memory while the invalidation listener is subscribed.
+    """
+    if _listener_ready and namespace in _generations:
+        return _generations[namespace]
+    generation = await redis_client.get(f"{GENERATION_KEY_PREFIX}:{namespace}")
+    generation = int(generation) if generation else 0
+    if _listener_ready:
+        _generations.setdefault(namespace, generation)
+    return generation
+
 async def invalidate_cache(key_pattern: str):
     """
-    Invalidate cache keys matching pattern (e.g. 'products:*')
+    Invalidate every cached entry in a namespace (e.g. 'products').
+    Bumps the namespace generation with a single INCR instead of scanning the
+    keyspace: readers build keys with the new generation and the old entries
+    are never read again, expiring through their own TTL.
+    Legacy 'products:*' patterns are accepted and mapped to their namespace.
+    The new generation is published so every worker drops its L1 entries.
     """
     global redis_client
     if not redis_client:
         return
 
+    namespace = _namespace(key_pattern)
     try:
-        keys = await redis_client.keys(key_pattern)
-        if keys:
-            await redis_client.delete(*keys)
-            print(f"Cache: Invalidated {len(keys)} keys for pattern '{key_pattern}'")
+        generation = await redis_client.incr(f"{GENERATION_KEY_PREFIX}:{namespace}")
+        _apply_invalidation(namespace, generation)
+        await redis_client.publish(INVALIDATION_CHANNEL, f"{namespace}:{generation}")
+        print(f"Cache: Invalidated namespace '{namespace}' (generation {generation})")
     except Exception as e:
+        cache_stats["errors"] += 1
         print(f"Cache Invalidation Error: {e}")
@@ -1,6 +1,12 @@
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy import event
+from starlette.requests import Request
+from collections import Counter
+from contextvars import ContextVar
+from typing import Optional
 import os
+import time
 
 # Connection URL (Must be provided via env vars)
 # DATABASE_URL should be set in .env or Docker environment
@@ -8,7 +14,47 @@ DATABASE_URL = os.environ.get("DATABASE_URL")
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL environment variable is not set.")
 
-engine = create_async_engine(DATABASE_URL, echo=True)
+# Optional read replica for GET routes (see get_read_db); defaults to the primary
+DATABASE_READ_URL = os.environ.get("DATABASE_READ_URL") or DATABASE_URL
+
+def _env_bool(name: str, default: bool) -> bool:
+    return os.getenv(name, str(default)).lower() in ("1", "true", "yes")
+
+def engine_options(url: str) -> dict:
+    """
+    Engine profile from the environment.
+
+    Pools are per worker process: with N uvicorn workers Postgres sees up to
+    N * (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections per engine, which must
+    stay below its max_connections.
+    """
+    options = {
+        "echo": _env_bool("DB_ECHO", False),
+        "pool_pre_ping": _env_bool("DB_POOL_PRE_PING", True),
+    }
+    if url.startswith("sqlite"):
+        return options
+
+    options.update(
+        pool_size=int(os.getenv("DB_POOL_SIZE", "5")),
+        max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", "30")),
+        pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "1800")),
+    )
+    if "+asyncpg" in url:
+        # Prepared statements cached per connection; set 0 behind PgBouncer
+        # in transaction pooling mode.
+        options["connect_args"] = {
+            "prepared_statement_cache_size": int(os.getenv("DB_STATEMENT_CACHE_SIZE", "500")),
+        }
+    return options
+
+engine = create_async_engine(DATABASE_URL, **engine_options(DATABASE_URL))
+
+if DATABASE_READ_URL == DATABASE_URL:
+    read_engine = engine
+else:
+    read_engine = create_async_engine(DATABASE_READ_URL, **engine_options(DATABASE_READ_URL))
 
 AsyncSessionLocal = sessionmaker(
     bind=engine,
@@ -16,9 +62,87 @@ AsyncSessionLocal = sessionmaker(
     expire_on_commit=False
 )
 
+ReadSessionLocal = sessionmaker(
+    bind=read_engine,
+    class_=AsyncSession,
+    expire_on_commit=False
+)
+
 Base = declarative_base()
 
-# Dependency for FastAPI
-async def get_db():
-    async with AsyncSessionLocal() as session:
+# Per-route pool usage. Sessions are opened for every request that declares
+# get_db/get_read_db, but an AsyncSession only checks out a connection on its
+# first query, so cache hits and early returns show up as sessions without
+# checkouts. A session returns its connection on commit and checks out again
+# on the next query, so one session can count several checkouts. Background
+# work (SWR refreshes, sweeper, webhooks) is counted separately.
+session_counts: Counter = Counter()
+checkout_counts: Counter = Counter()
+
+# Pool events don't see the session, so get_db/get_read_db label the task
+_route_label: ContextVar[str] = ContextVar("route_label", default="background")
+
+def route_label(request: Optional[Request]) -> str:
+    if request is None:
+        return "background"
+    route = request.scope.get("route")
+    return f"{request.method} {getattr(route, 'path', request.url.path)}"
+
+def _count_checkout(dbapi_connection, connection_record, connection_proxy):
+    checkout_counts[_route_label.get()] += 1
+
+# Engine-level pool listeners carry over to the pool dispose() recreates
+event.listen(engine.sync_engine, "checkout", _count_checkout)
+if read_engine is not engine:
+    event.listen(read_engine.sync_engine, "checkout", _count_checkout)
+
+def _pool_status(pool) -> dict:
+    status = {"class": type(pool).__name__}
+    for name in ("size", "checkedout", "overflow", "checkedin"):
+        if hasattr(pool, name):
+            status[name] = getattr(pool, name)()
+    return status
+
+def get_pool_stats() -> dict:
+    pools = {"primary": _pool_status(engine.pool)}
+    if read_engine is not engine:
+        pools["replica"] = _pool_status(read_engine.pool)
+    routes = {}
+    for route in sorted(set(session_counts) | set(checkout_counts)):
+        routes[route] = {"sessions": session_counts[route], "checkouts": checkout_counts[route]}
+    return {"pools": pools, "routes": routes}
+
+# Dependency for FastAPI. Request is optional so the dependency can also be
+# re-run outside a request (cache_response background refreshes).
+async def get_db(request: Request = None):
+    label = route_label(request)
+    session_counts[label] += 1
+    _route_label.set(label)
+    async with AsyncSessionLocal(info={"route": label}) as session:
         yield session
+
+# After a cache invalidation the next miss must not cache the replica's
+# pre-write rows under the new generation, so for this long get_read_db reads
+# from the primary. Should exceed the replica's usual lag.
+REPLICA_LAG_SECONDS = float(os.getenv("DB_REPLICA_LAG_SECONDS", "5"))
+_primary_reads_until = 0.0
+
+def read_from_primary():
+    """Route get_read_db to the primary for REPLICA_LAG_SECONDS (see cache._apply_invalidation)."""
+    global _primary_reads_until
+    _primary_reads_until = time.monotonic() + REPLICA_LAG_SECONDS
+
+# Read-only routes. A replica may lag the primary by a moment, so anything
+# that reads back its own write must use get_db.
+async def get_read_db(request: Request = None):
+    label = route_label(request)
+    session_counts[label] += 1
+    _route_label.set(label)
+    session_factory = AsyncSessionLocal if time.monotonic() < _primary_reads_until else ReadSessionLocal
+    async with session_factory(info={"route": label}) as session:
+        yield session
+
+async def dispose_engines():
+    await engine.dispose()
+    if read_engine is not engine:
+        await read_engine.dispose()
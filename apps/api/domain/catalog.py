@@ -1,37 +1,170 @@
 from sqlalchemy.future import select
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import Optional, List
+from sqlalchemy import func, literal_column, or_, and_, false, case, text
+from typing import Optional, List, Union
+import time
 import models
+from .search import ProductSearchIndex
+from .facets import BTU_BANDS, PRICE_BANDS, facet_search
+
+# Text searched by `q` on Postgres. Must stay identical to the expression
+# indexed by the search_indexes migration, or the planner can't use those indexes.
+SEARCH_DOCUMENT_SQL = (
+    "coalesce(name, '') || ' ' || coalesce(key_spec, '') || ' ' || coalesce(performance_specs, '')"
+)
+
+# In-memory search index for non-Postgres databases, rebuilt after catalog
+# writes in this process and at least every SEARCH_INDEX_TTL seconds.
+SEARCH_INDEX_TTL = 60
+_search_index: Optional[ProductSearchIndex] = None
+_search_index_built_at = 0.0
+
+def invalidate_search_index():
+    global _search_index
+    _search_index = None
+
+async def get_search_index(db: AsyncSession) -> ProductSearchIndex:
+    global _search_index, _search_index_built_at
+    if _search_index is None or time.monotonic() - _search_index_built_at > SEARCH_INDEX_TTL:
+        result = await db.execute(
+            select(
+                models.Product.id,
+                models.Product.name,
+                models.Product.key_spec,
+                models.Product.performance_specs,
+            )
+        )
+        _search_index = ProductSearchIndex(row._asdict() for row in result)
+        _search_index_built_at = time.monotonic()
+    return _search_index
+
+# Whether pg_trgm is installed. The search_indexes migration creates it where
+# the database allows; without it search still works, ranked without
+# similarity() and with unindexed substring matches. A missing extension is
+# re-checked every SEARCH_INDEX_TTL seconds.
+_trigram_available: Optional[bool] = None
+_trigram_checked_at = 0.0
+
+async def has_trigram(db: AsyncSession) -> bool:
+    global _trigram_available, _trigram_checked_at
+    if not _trigram_available and time.monotonic() - _trigram_checked_at > SEARCH_INDEX_TTL:
+        result = await db.execute(text("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')"))
+        _trigram_available = bool(result.scalar())
+        _trigram_checked_at = time.monotonic()
+    return _trigram_available
+
+def _postgres_search(query, q: str, trigram: bool = True):
+    """Full-text match or substring match (indexed with pg_trgm), ranked by relevance."""
+    document = literal_column(f"({SEARCH_DOCUMENT_SQL})")
+    vector = func.to_tsvector(literal_column("'simple'"), document)
+    tsquery = func.plainto_tsquery(literal_column("'simple'"), q)
+    if trigram:
+        name_rank = func.similarity(models.Product.name, q)
+    else:
+        name_rank = case((models.Product.name.icontains(q, autoescape=True), 0.5), else_=0)
+    rank = func.ts_rank(vector, tsquery) + name_rank
+    return (
+        query.where(or_(vector.op("@@")(tsquery), document.icontains(q, autoescape=True)))
+        .order_by(rank.desc(), models.Product.id)
+    )
+
+def _band_condition(column, keys: List[str], bands):
+    """SQL for 'column falls in any of these bands'."""
+    conditions = []
+    for key, low, high in bands:
+        if key in keys:
+            bounds = []
+            if low is not None:
+                bounds.append(column >= low)
+            if high is not None:
+                bounds.append(column < high)
+            conditions.append(and_(*bounds))
+    return or_(*conditions) if conditions else false()
+
+def _as_list(value: Union[str, List[str], None]) -> List[str]:
+    if not value:
+        return []
+    return [value] if isinstance(value, str) else list(value)
 
 async def get_products_service(
     db: AsyncSession,
     q: Optional[str] = None,
-    category: Optional[str] = None,
+    category: Union[str, List[str], None] = None,
     min_price: Optional[float] = None,
-    max_price: Optional[float] = None
+    max_price: Optional[float] = None,
+    btu_band: Optional[List[str]] = None,
+    voltage: Optional[List[str]] = None,
+    price_band: Optional[List[str]] = None,
 ):
     """
     Domain logic for retrieving products with filters.
+    With `q`, results are ranked by relevance across name, model number,
+    key_spec and performance_specs instead of ordered by id.
+    category/btu_band/voltage/price_band accept several values (OR'ed).
     """
     query = select(models.Product)
+    ranked_ids = None
 
     if q:
-        query = query.where(models.Product.name.ilike(f"%{q}%"))
-    if category:
-        query = query.where(models.Product.category == category)
+        if db.bind.dialect.name == "postgresql":
+            query = _postgres_search(query, q, await has_trigram(db))
+        else:
+            index = await get_search_index(db)
+            ranked_ids = [product_id for product_id, _ in index.search(q)]
+            if not ranked_ids:
+                return []
+            query = query.where(models.Product.id.in_(ranked_ids))
+    categories = _as_list(category)
+    if categories:
+        query = query.where(models.Product.category.in_(categories))
+    if btu_band:
+        query = query.where(_band_condition(models.Product.btu, btu_band, BTU_BANDS))
+    if voltage:
+        query = query.where(models.Product.voltage.in_(voltage))
+    if price_band:
+        query = query.where(_band_condition(models.Product.price, price_band, PRICE_BANDS))
     if min_price is not None:
         query = query.where(models.Product.price >= min_price)
     if max_price is not None:
         query = query.where(models.Product.price <= max_price)
 
     result = await db.execute(query.order_by(models.Product.id))
-    return result.scalars().all()
+    products = result.scalars().all()
+    if ranked_ids is not None:
+        position = {product_id: i for i, product_id in enumerate(ranked_ids)}
+        products.sort(key=lambda product: position[product.id])
+    return products
+
+async def search_products_service(
+    db: AsyncSession,
+    q: Optional[str] = None,
+    category: Optional[List[str]] = None,
+    btu_band: Optional[List[str]] = None,
+    voltage: Optional[List[str]] = None,
+    price_band: Optional[List[str]] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+):
+    """
+    Products plus facet counts for the storefront sidebar.
+    One query fetches the candidates (search + price range); facet filters
+    and all facet counts are then computed in a single in-memory pass.
+    """
+    candidates = await get_products_service(db, q, None, min_price, max_price)
+    items, facets = facet_search(candidates, {
+        "category": _as_list(category),
+        "btu_band": _as_list(btu_band),
+        "voltage": _as_list(voltage),
+        "price_band": _as_list(price_band),
+    })
+    return {"items": items, "total": len(items), "facets": facets}
 
 async def create_product_service(db: AsyncSession, product_data: dict):
     new_product = models.Product(**product_data)
     db.add(new_product)
     await db.commit()
     await db.refresh(new_product)
+    invalidate_search_index()
     return new_product
 
 async def update_product_service(db: AsyncSession, product_id: int, product_data: dict):
@@ -44,6 +177,7 @@ async def update_product_service(db: AsyncSession, product_id: int, product_data
             setattr(product, key, value)
         await db.commit()
         await db.refresh(product)
+        invalidate_search_index()
 
     return product
 
@@ -55,5 +189,6 @@ async def delete_product_service(db: AsyncSession, product_id: int):
     if product:
         await db.delete(product)
         await db.commit()
+        invalidate_search_index()
         return True
     return False
@@ -0,0 +1,83 @@
+from typing import Callable, Collection, Dict, List, Optional, Tuple
+
+# (key, inclusive lower bound, exclusive upper bound); None = open-ended
+Band = Tuple[str, Optional[int], Optional[int]]
+
+BTU_BANDS: List[Band] = [
+    ("under-8000", None, 8000),
+    ("8000-11999", 8000, 12000),
+    ("12000-17999", 12000, 18000),
+    ("18000-plus", 18000, None),
+]
+
+# Product.price is stored in whole dollars
+PRICE_BANDS: List[Band] = [
+    ("under-500", None, 500),
+    ("500-749", 500, 750),
+    ("750-999", 750, 1000),
+    ("1000-plus", 1000, None),
+]
+
+def band_of(value: Optional[int], bands: List[Band]) -> Optional[str]:
+    if value is None:
+        return None
+    for key, low, high in bands:
+        if (low is None or value >= low) and (high is None or value < high):
+            return key
+    return None
+
+def _get(product, name: str):
+    if isinstance(product, dict):
+        return product.get(name)
+    return getattr(product, name, None)
+
+# Facet name -> how to read a product's value for it
+FACETS: Dict[str, Callable[[object], Optional[str]]] = {
+    "category": lambda p: _get(p, "category"),
+    "btu_band": lambda p: band_of(_get(p, "btu"), BTU_BANDS),
+    "voltage": lambda p: _get(p, "voltage"),
+    "price_band": lambda p: band_of(_get(p, "price"), PRICE_BANDS),
+}
+
+def _empty_counts(products: list) -> Dict[str, Dict[str, int]]:
+    """Every value present in the candidate set starts at 0 (bands in band order)."""
+    counts: Dict[str, Dict[str, int]] = {
+        "btu_band": {key: 0 for key, _, _ in BTU_BANDS},
+        "price_band": {key: 0 for key, _, _ in PRICE_BANDS},
+    }
+    for facet in ("category", "voltage"):
+        values = {FACETS[facet](p) for p in products} - {None}
+        counts[facet] = {value: 0 for value in sorted(values)}
+    return counts
+
+def facet_search(products: list, selected: Dict[str, Collection[str]]) -> Tuple[list, Dict[str, Dict[str, int]]]:
+    """
+    Apply multi-value facet filters and count facet values in a single pass.
+
+    Values within a facet are OR'ed, facets are AND'ed. Counts are
+    disjunctive: a facet's counts ignore that facet's own selection, so the
+    sidebar still shows how many items picking another value would add.
+    A product failing exactly one facet only contributes to that facet.
+    """
+    selected = {facet: set(values) for facet, values in selected.items() if values}
+    counts = _empty_counts(products)
+    matches = []
+
+    for product in products:
+        values = {facet: read(product) for facet, read in FACETS.items()}
+        failed = [facet for facet, allowed in selected.items() if values[facet] not in allowed]
+
+        if not failed:
+            matches.append(product)
+            counted = FACETS
+        elif len(failed) == 1:
+            counted = failed
+        else:
+            continue
+
+        for facet in counted:
+            value = values[facet]
+            if value is not None:
+                counts[facet][value] = counts[facet].get(value, 0) + 1
+
+    return matches, counts
@@ -0,0 +1,168 @@
+from fastapi import HTTPException
+from sqlalchemy.future import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import text, update
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional
+import asyncio
+import json
+import os
+import models
+
+# Stock held by an order is released by the sweeper once its hold expires.
+# Pickup orders (LOCK_STOCK) wait for the customer at the warehouse; card
+# checkouts (AWAIT_PAYMENT) only need to outlive the payment form.
+HOLD_TTLS = {
+    models.OrderStatus.LOCK_STOCK: int(os.getenv("STOCK_LOCK_TTL_SECONDS", str(48 * 3600))),
+    models.OrderStatus.AWAIT_PAYMENT: int(os.getenv("STOCK_PAYMENT_TTL_SECONDS", "1800")),
+}
+HOLD_STATUSES = tuple(HOLD_TTLS)
+SWEEP_INTERVAL = int(os.getenv("STOCK_SWEEP_INTERVAL_SECONDS", "60"))
+
+_sweeper_task: Optional[asyncio.Task] = None
+
+def hold_expiry(status: str, now: Optional[datetime] = None) -> datetime:
+    return (now or datetime.utcnow()) + timedelta(seconds=HOLD_TTLS[status])
+
+def aggregate_lines(items: Iterable) -> Dict[int, int]:
+    """
+    Sum quantities per product, sorted by product id. Every writer locks
+    products in this order, so concurrent checkouts can't deadlock.
+    """
+    lines: Dict[int, int] = {}
+    for item in items:
+        product_id = item["product_id"] if isinstance(item, dict) else item.product_id
+        quantity = item.get("quantity", 1) if isinstance(item, dict) else item.quantity
+        if quantity <= 0:
+            raise HTTPException(status_code=400, detail="Quantity must be at least 1.")
+        lines[product_id] = lines.get(product_id, 0) + quantity
+    return dict(sorted(lines.items()))
+
+def _adjust_stock_sql(dialect: str, lines: Dict[int, int], delta: str, condition: str = ""):
+    """
+    UPDATE products joined to the given lines. The lines are a derived table
+    rather than a leading WITH, because pysqlite only opens a transaction for
+    statements that start with UPDATE. On Postgres the rows are locked in id
+    order first, so overlapping writers queue up instead of deadlocking.
+    """
+    lines_sql = " UNION ALL ".join(
+        f"SELECT CAST(:id{i} AS INTEGER) AS id, CAST(:qty{i} AS INTEGER) AS qty" for i in range(len(lines))
+    )
+    params = {}
+    for i, (product_id, quantity) in enumerate(lines.items()):
+        params[f"id{i}"] = product_id
+        params[f"qty{i}"] = quantity
+
+    source = f"({lines_sql}) AS lines"
+    if dialect == "postgresql":
+        source = f"""({lines_sql}) AS lines
+            JOIN (
+                SELECT products.id FROM products
+                WHERE products.id IN ({", ".join(f":id{i}" for i in range(len(lines)))})
+                ORDER BY products.id FOR UPDATE
+            ) AS locked ON locked.id = lines.id"""
+    sql = f"""
+        UPDATE products SET stock = products.stock {delta} lines.qty
+        FROM {source}
+        WHERE products.id = lines.id {condition}
+        RETURNING products.id, products.price
+    """
+    return text(sql), params
+
+async def reserve_stock(db: AsyncSession, lines: Dict[int, int]) -> Dict[int, int]:
+    """
+    Decrement stock for every line in one statement, or not at all.
+
+    `UPDATE ... SET stock = stock - qty WHERE stock >= qty` re-checks each row
+    after taking its lock, so the last unit can't be sold twice.
+    Returns {product_id: price}. On a shortfall the session's transaction is
+    rolled back and an HTTPException raised; the caller commits on success.
+    """
+    if not lines:
+        return {}
+    stmt, params = _adjust_stock_sql(db.bind.dialect.name, lines, "-", "AND products.stock >= lines.qty")
+    result = await db.execute(stmt, params)
+    prices = {row.id: row.price for row in result}
+    if len(prices) == len(lines):
+        return prices
+
+    await db.rollback()
+    await _raise_shortfall(db, lines)
+
+async def _raise_shortfall(db: AsyncSession, lines: Dict[int, int]):
+    result = await db.execute(
+        select(models.Product.id, models.Product.name, models.Product.stock)
+        .where(models.Product.id.in_(list(lines)))
+    )
+    products = {row.id: row for row in result}
+    for product_id, quantity in lines.items():
+        product = products.get(product_id)
+        if not product:
+            raise HTTPException(status_code=404, detail=f"Product ID {product_id} not found.")
+        if product.stock < quantity:
+            raise HTTPException(status_code=400, detail=f"Insufficient stock for {product.name}. Only {product.stock} left.")
+    # Stock was restocked between the UPDATE and this check
+    raise HTTPException(status_code=409, detail="Stock changed during checkout. Please try again.")
+
+async def release_stock(db: AsyncSession, lines: Dict[int, int]):
+    """Return held units to stock. The caller commits."""
+    if not lines:
+        return
+    stmt, params = _adjust_stock_sql(db.bind.dialect.name, lines, "+")
+    await db.execute(stmt, params)
+
+def order_lines(order) -> Dict[int, int]:
+    return aggregate_lines(json.loads(order.items_json)) if order.items_json else {}
+
+async def release_expired_holds(db: AsyncSession, now: Optional[datetime] = None) -> int:
+    """
+    Cancel orders whose hold has expired and restock their items.
+    The status check in the UPDATE makes this safe to run from every worker,
+    and against a webhook marking the same order PAID.
+    """
+    result = await db.execute(
+        update(models.Order)
+        .where(
+            models.Order.status.in_(HOLD_STATUSES),
+            models.Order.reserved_until < (now or datetime.utcnow()),
+        )
+        .values(status=models.OrderStatus.CANCELLED, reserved_until=None)
+        .returning(models.Order.id, models.Order.items_json)
+        .execution_options(synchronize_session=False)
+    )
+    expired = result.all()
+    lines: Dict[int, int] = {}
+    for order in expired:
+        for product_id, quantity in order_lines(order).items():
+            lines[product_id] = lines.get(product_id, 0) + quantity
+    await release_stock(db, dict(sorted(lines.items())))
+    await db.commit()
+    return len(expired)
+
+async def _sweep_holds(session_factory, interval: float):
+    while True:
+        try:
+            async with session_factory() as session:
+                released = await release_expired_holds(session)
+            if released:
+                print(f"Released stock for {released} expired order holds.")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Stock Sweeper Error: {e}")
+        await asyncio.sleep(interval)
+
+def start_hold_sweeper(session_factory, interval: float = SWEEP_INTERVAL):
+    global _sweeper_task
+    if _sweeper_task is None or _sweeper_task.done():
+        _sweeper_task = asyncio.create_task(_sweep_holds(session_factory, interval))
+
+async def stop_hold_sweeper():
+    global _sweeper_task
+    if _sweeper_task is not None:
+        _sweeper_task.cancel()
+        try:
+            await _sweeper_task
+        except asyncio.CancelledError:
+            pass
+        _sweeper_task = None
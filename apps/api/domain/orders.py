@@ -1,19 +1,120 @@
 from fastapi import HTTPException
-from sqlalchemy.future import select
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import insert, func
+from sqlalchemy.future import select
+from sqlalchemy.dialects import postgresql, sqlite
 import os
+import json
 
 # Assuming models is in the parent directory (apps/api)
 # When run from main.py, sys.path includes apps/api, so 'models' is top-level.
 # But for relative imports within package structure:
 import models
 from .discounts import apply_discount
+from . import inventory
+
+def order_item_rows(order_id: str, items, prices=None) -> list:
+    """One order_items row per cart line. prices: {product_id: unit price}."""
+    return [
+        {
+            "order_id": order_id,
+            "product_id": item.product_id,
+            "name": item.name,
+            "category": item.category,
+            "quantity": item.quantity,
+            "unit_price": prices.get(item.product_id) if prices else None,
+        }
+        for item in items
+    ]
+
+async def insert_order_items(db: AsyncSession, order_id: str, items, prices=None):
+    """All of an order's lines in one multi-row INSERT."""
+    if items:
+        await db.execute(insert(models.OrderItem), order_item_rows(order_id, items, prices))
+
+async def receipt_items_for(db: AsyncSession, orders: list) -> dict:
+    """
+    Receipt lines for several orders in one query: {order_id: [lines]}.
+    Backfilled orders without order_items rows get names and quantities
+    from items_json.
+    """
+    lines = {order.id: [] for order in orders}
+    if not lines:
+        return lines
+    result = await db.execute(
+        select(models.OrderItem.order_id, models.OrderItem.name, models.OrderItem.quantity, models.OrderItem.unit_price)
+        .where(models.OrderItem.order_id.in_(list(lines)))
+        .order_by(models.OrderItem.order_id, models.OrderItem.id)
+    )
+    for row in result:
+        lines[row.order_id].append({"name": row.name, "quantity": row.quantity, "unit_price": row.unit_price})
+    for order in orders:
+        if not lines[order.id] and order.items_json:
+            lines[order.id] = [
+                {"name": item.get("name"), "quantity": item.get("quantity", 1), "unit_price": None}
+                for item in json.loads(order.items_json)
+            ]
+    return lines
+
+async def receipt_items(db: AsyncSession, order) -> list:
+    return (await receipt_items_for(db, [order]))[order.id]
+
+async def persist_order(db: AsyncSession, order: dict, items, prices=None):
+    """
+    Write the order and all its line items: one INSERT for the order and one
+    multi-row INSERT for the items, in the caller's transaction.
+    items_json is still written for existing readers (admin manifest, holds).
+    """
+    order["items_json"] = json.dumps([i.model_dump() for i in items])
+    await db.execute(insert(models.Order).values(**order))
+    await insert_order_items(db, order["id"], items, prices)
+
+# States a checkout retry may return the order's intent from (the state machine);
+# any other means the order has moved on, and the retry gets a 409
+CHECKOUT_RETRY_STATUSES = (models.OrderStatus.AWAIT_PAYMENT, models.OrderStatus.PAID)
+
+async def find_checkout_order(db: AsyncSession, idempotency_key: str):
+    """Status and server total of the order created for this key, or None."""
+    result = await db.execute(
+        select(models.Order.id, models.Order.status, models.Order.total_cents)
+        .where(models.Order.idempotency_key == idempotency_key)
+    )
+    return result.first()
+
+async def upsert_checkout_order(db: AsyncSession, order: dict, items):
+    """
+    Create the checkout order, or get the one already created for its
+    idempotency key, in one INSERT ... ON CONFLICT (idempotency_key)
+    DO UPDATE ... RETURNING. A concurrent duplicate waits on the unique index
+    and then gets the first request's row. An existing order keeps its
+    stripe_pid, or takes this one if it has none.
+    Stock is reserved and items written only when the row is new.
+    Returns (row with id/status/stripe_pid/total_cents, created). The caller commits.
+    """
+    order["items_json"] = json.dumps([i.model_dump() for i in items])
+    dialect_insert = postgresql.insert if db.bind.dialect.name == "postgresql" else sqlite.insert
+    stmt = dialect_insert(models.Order).values(**order)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[models.Order.idempotency_key],
+        set_={
+            "customer_email": func.coalesce(stmt.excluded.customer_email, models.Order.customer_email),
+            "stripe_pid": func.coalesce(models.Order.stripe_pid, stmt.excluded.stripe_pid),
+        },
+    ).returning(models.Order.id, models.Order.status, models.Order.stripe_pid, models.Order.total_cents)
+
+    row = (await db.execute(stmt)).one()
+    created = row.id == order["id"]
+    if created:
+        # Rolls back the INSERT above too if any line is short
+        prices = await inventory.reserve_stock(db, inventory.aggregate_lines(items))
+        await insert_order_items(db, row.id, items, prices)
+    return row, created
 
 async def create_order_service(order_data, db: AsyncSession):
     """
     Domain logic for creating an order.
     - Validates logistics.
-    - Checks stock.
+    - Reserves stock for every line in one round trip (LOCK_STOCK hold).
     - Calculates total with optional discount.
     """
     # 1. Validate "Local Pickup Only"
@@ -21,26 +122,27 @@ async def create_order_service(order_data, db: AsyncSession):
         if item.category == "WINDOW_AC" and order_data.shipping_method != "PICKUP_AIEA":
              raise HTTPException(status_code=400, detail=f"Logistics Error: {item.name} is Pickup Only.")
 
-    # 2. Check Stock & Calculate Total
-    total_amount = 0
-    for item in order_data.items:
-        result = await db.execute(select(models.Product).where(models.Product.id == item.product_id))
-        product = result.scalar_one_or_none()
-
-        if not product:
-            raise HTTPException(status_code=404, detail=f"Product {item.name} not found.")
-
-        if product.stock < item.quantity:
-             raise HTTPException(status_code=400, detail=f"Insufficient stock for {item.name}. Only {product.stock} left.")
-
-        total_amount += product.price * item.quantity
+    # 2. Reserve Stock & Calculate Total
+    lines = inventory.aggregate_lines(order_data.items)
+    prices = await inventory.reserve_stock(db, lines)
+    total_amount = sum(prices[product_id] * quantity for product_id, quantity in lines.items())
 
     # 3. Apply Discount
     final_total = apply_discount(total_amount, order_data.discount_code)
 
-    # 4. Simulate success
+    # 4. Persist the hold; released by the sweeper if never picked up
+    order_id = f"ORD-{os.urandom(4).hex()}"
+    await persist_order(db, {
+        "id": order_id,
+        "status": models.OrderStatus.LOCK_STOCK,
+        "total_cents": final_total * 100,
+        "customer_email": order_data.customer_email,
+        "reserved_until": inventory.hold_expiry(models.OrderStatus.LOCK_STOCK),
+    }, order_data.items, prices)
+    await db.commit()
+
     return {
-        "order_id": f"ORD-{os.urandom(4).hex()}",
+        "order_id": order_id,
         "status": "confirmed",
         "total": final_total,
         "original_total": total_amount,
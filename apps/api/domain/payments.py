@@ -1,8 +1,161 @@
-import stripe
 import os
+import json
+import time
+import asyncio
+from typing import TYPE_CHECKING, Optional
+import cache
+
+# aiohttp is imported with the first payments call, not at startup
+if TYPE_CHECKING:
+    import aiohttp
 
 STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY")
-stripe.api_key = STRIPE_SECRET_KEY
+
+# Point at a local stub server for load tests
+PAYMENTS_API_BASE = os.getenv("PAYMENTS_API_BASE", "https://api.stripe.com").rstrip("/")
+PAYMENTS_TIMEOUT = float(os.getenv("PAYMENTS_TIMEOUT_SECONDS", "10"))
+PAYMENTS_CONNECT_TIMEOUT = float(os.getenv("PAYMENTS_CONNECT_TIMEOUT_SECONDS", "3"))
+# Calls in flight per worker; also the size of the keep-alive pool
+PAYMENTS_MAX_CONCURRENCY = int(os.getenv("PAYMENTS_MAX_CONCURRENCY", "20"))
+# Consecutive provider failures that open the breaker, and how long it stays open
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("PAYMENTS_BREAKER_FAILURES", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("PAYMENTS_BREAKER_RESET_SECONDS", "30"))
+
+# Intents by Idempotency-Key, so client retries skip the DB and Stripe.
+# Stripe keeps idempotency keys for 24h; so do we.
+INTENT_KEY_PREFIX = "intent"
+INTENT_CACHE_TTL = 24 * 3600
+
+class PaymentsError(Exception):
+    """The provider rejected the request (4xx); retrying won't help."""
+    def __init__(self, message: str, status: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+
+class PaymentsUnavailable(PaymentsError):
+    """Provider down, slow or the breaker is open; safe to retry later."""
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and fails fast for
+    `reset_timeout` seconds. Then one trial call is let through (half-open):
+    success closes it, failure opens it again.
+    """
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_running = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def before_call(self) -> bool:
+        """Raises while open. Returns True if this call is the half-open trial."""
+        state = self.state
+        if state == "open" or (state == "half-open" and self._trial_running):
+            raise PaymentsUnavailable("Payment provider circuit is open")
+        if state == "half-open":
+            self._trial_running = True
+            return True
+        return False
+
+    def end_trial(self):
+        """
+        Lets another trial through if this one ended without an outcome
+        (cancelled, or an unexpected error); otherwise a no-op.
+        """
+        self._trial_running = False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_running = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+class PaymentsClient:
+    """
+    Stripe's REST API over one pooled aiohttp session per worker, so a slow
+    provider never blocks the event loop (the stripe SDK call did).
+    """
+    def __init__(self, base_url: str = PAYMENTS_API_BASE, max_concurrency: int = PAYMENTS_MAX_CONCURRENCY):
+        self.base_url = base_url
+        self.max_concurrency = max_concurrency
+        self.breaker = CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_SECONDS)
+        self.stats = {"calls": 0, "failures": 0, "rejected": 0, "fast_failed": 0}
+        self._session: Optional["aiohttp.ClientSession"] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def _get_session(self) -> "aiohttp.ClientSession":
+        if self._session is None or self._session.closed:
+            import aiohttp
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_concurrency, keepalive_timeout=30),
+                timeout=aiohttp.ClientTimeout(total=PAYMENTS_TIMEOUT, connect=PAYMENTS_CONNECT_TIMEOUT),
+                headers={"Authorization": f"Bearer {STRIPE_SECRET_KEY}"},
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+    async def post(self, path: str, data: dict, idempotency_key: Optional[str] = None) -> dict:
+        try:
+            trial = self.breaker.before_call()
+        except PaymentsUnavailable:
+            self.stats["fast_failed"] += 1
+            raise
+        try:
+            return await self._post(path, data, idempotency_key)
+        finally:
+            if trial:
+                self.breaker.end_trial()
+
+    async def _post(self, path: str, data: dict, idempotency_key: Optional[str]) -> dict:
+        import aiohttp
+        session = self._get_session()
+        headers = {"Idempotency-Key": idempotency_key} if idempotency_key else {}
+        self.stats["calls"] += 1
+        try:
+            async with self._semaphore:
+                async with session.post(f"{self.base_url}{path}", data=data, headers=headers) as response:
+                    body = await response.json(content_type=None)
+                    status = response.status
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            self.breaker.record_failure()
+            self.stats["failures"] += 1
+            raise PaymentsUnavailable(f"Payment provider unreachable: {e!r}") from e
+
+        if status >= 500 or status == 429:
+            self.breaker.record_failure()
+            self.stats["failures"] += 1
+            raise PaymentsUnavailable(f"Payment provider returned {status}", status)
+        # A rejected request still means the provider is up
+        self.breaker.record_success()
+        if status >= 400:
+            self.stats["rejected"] += 1
+            message = (body.get("error") or {}).get("message", f"HTTP {status}") if isinstance(body, dict) else f"HTTP {status}"
+            raise PaymentsError(message, status)
+        return body
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "breaker": self.breaker.state, "consecutive_failures": self.breaker.failures}
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+payments_client = PaymentsClient()
 
 async def create_payment_intent_service(amount: int, currency: str = "usd", idempotency_key: str = None):
     """
@@ -13,13 +166,47 @@ async def create_payment_intent_service(amount: int, currency: str = "usd", idem
 
     try:
         # Idempotency is handled natively by Stripe if key is provided
-        intent = stripe.PaymentIntent.create(
-            amount=amount,
-            currency=currency,
-            automatic_payment_methods={"enabled": True},
-            idempotency_key=idempotency_key
+        intent = await payments_client.post(
+            "/v1/payment_intents",
+            {
+                "amount": amount,
+                "currency": currency,
+                "automatic_payment_methods[enabled]": "true",
+            },
+            idempotency_key=idempotency_key,
         )
-        return {"clientSecret": intent.client_secret, "id": intent.id}
+        return {"clientSecret": intent["client_secret"], "id": intent["id"]}
     except Exception as e:
         print(f"Stripe Error: {e}")
         raise e
+
+async def get_cached_intent(idempotency_key: str, amount: int) -> Optional[dict]:
+    """
+    The intent created for this key, if it was for the same amount.
+    A different amount means the cart changed; that goes the slow way.
+    """
+    if not cache.redis_client:
+        return None
+    try:
+        cached = await cache.redis_client.get(f"{INTENT_KEY_PREFIX}:{idempotency_key}")
+    except Exception as e:
+        print(f"Intent Cache Error: {e}")
+        return None
+    if not cached:
+        return None
+    entry = json.loads(cached)
+    if entry.get("amount") != amount:
+        return None
+    return {"clientSecret": entry["clientSecret"], "id": entry["id"]}
+
+async def cache_intent(idempotency_key: str, intent: dict, amount: int):
+    if not cache.redis_client:
+        return
+    try:
+        await cache.redis_client.set(
+            f"{INTENT_KEY_PREFIX}:{idempotency_key}",
+            json.dumps({"clientSecret": intent["clientSecret"], "id": intent["id"], "amount": amount}),
+            ex=INTENT_CACHE_TTL,
+        )
+    except Exception as e:
+        print(f"Intent Cache Error: {e}")
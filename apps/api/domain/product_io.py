@@ -0,0 +1,270 @@
+from sqlalchemy.future import select
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql, sqlite
+from typing import AsyncIterator, List
+import codecs
+import csv
+import io
+import json
+import os
+import models
+from cache import invalidate_cache
+from . import catalog
+
+# Bulk catalog import/export (distributor price and stock feeds, inventory.csv).
+# Everything streams: records are parsed as bytes arrive, written a chunk at a
+# time, and exports are read in keyset pages, so memory doesn't grow with the
+# size of the feed.
+
+# Column order of inventory.csv and of exports
+PRODUCT_FIELDS = [
+    "id", "name", "price", "category", "stock", "image_url", "btu", "voltage",
+    "coverage", "performance_specs", "key_spec", "noise_level", "dehumidification",
+]
+INT_FIELDS = {"id", "price", "stock", "btu"}
+REQUIRED_FIELDS = {"name", "price", "category", "stock"}
+NON_NEGATIVE_FIELDS = {"price", "stock"}
+FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+IMPORT_CHUNK_SIZE = int(os.getenv("PRODUCT_IMPORT_CHUNK_SIZE", "1000"))
+EXPORT_PAGE_SIZE = 1000
+MAX_RECORD_CHARS = 1024 * 1024
+# Row errors listed in the import summary; the rest are only counted
+MAX_REPORTED_ERRORS = 100
+
+class RecordError(ValueError):
+    pass
+
+# --- Reading feeds ---
+
+async def _lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line + "\n"
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+async def csv_records(chunks: AsyncIterator[bytes]) -> AsyncIterator[dict]:
+    """Rows of a CSV with a header line. Quoted fields may contain newlines."""
+    header = None
+    record = ""
+    async for line in _lines(chunks):
+        record += line
+        try:
+            row = next(csv.reader([record], strict=True), None)
+        except csv.Error as e:
+            if "unexpected end of data" in str(e) and len(record) < MAX_RECORD_CHARS:
+                continue # A quoted field runs onto the next line
+            if header is None:
+                raise RecordError(f"Unreadable CSV header: {e}")
+            record = ""
+            yield {"__error__": f"Unreadable CSV row: {e}"}
+            continue
+        record = ""
+        if not row or not any(field.strip() for field in row):
+            continue
+        if header is None:
+            header = [field.strip() for field in row]
+            continue
+        yield dict(zip(header, row))
+    if record.strip():
+        yield {"__error__": "CSV ends inside a quoted field"}
+
+async def ndjson_records(chunks: AsyncIterator[bytes]) -> AsyncIterator[dict]:
+    async for line in _lines(chunks):
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                yield {"__error__": f"Invalid JSON: {e}"}
+
+def records(chunks: AsyncIterator[bytes], fmt: str) -> AsyncIterator[dict]:
+    return ndjson_records(chunks) if fmt == "ndjson" else csv_records(chunks)
+
+async def file_chunks(path: str, size: int = 64 * 1024) -> AsyncIterator[bytes]:
+    with open(path, "rb") as f:
+        while chunk := f.read(size):
+            yield chunk
+
+def parse_product(record: dict) -> dict:
+    """
+    Known columns of one record, typed. Columns the feed leaves out are left
+    alone on existing products; empty CSV cells and nulls clear optional ones.
+    """
+    if not isinstance(record, dict):
+        raise RecordError("Record is not an object")
+    if "__error__" in record:
+        raise RecordError(record["__error__"])
+    product = {}
+    for field in PRODUCT_FIELDS:
+        if field not in record:
+            continue
+        value = record[field]
+        if isinstance(value, str):
+            value = value.strip() or None
+        if value is not None and field in INT_FIELDS:
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                raise RecordError(f"{field} must be an integer, got {value!r}")
+            if field in NON_NEGATIVE_FIELDS and value < 0:
+                raise RecordError(f"{field} must not be negative")
+        elif value is not None:
+            value = str(value)
+        product[field] = value
+    if product.get("id") is None:
+        raise RecordError("id is required")
+    for field in REQUIRED_FIELDS & product.keys():
+        if product[field] is None:
+            raise RecordError(f"{field} cannot be empty")
+    return product
+
+# --- Import ---
+
+async def _write_chunk(db, chunk: dict, stats: dict, dry_run: bool):
+    """
+    Diff a chunk ({id: (row number, product)}) against the stored products
+    and upsert only what changed.
+
+    Only the columns a record supplies are written: checkouts decrement stock
+    between this read and the upsert, and writing back the stock read here
+    would undo them. The rows are locked in id order, like reserve_stock.
+    """
+    result = await db.execute(
+        select(models.Product)
+        .where(models.Product.id.in_(list(chunk)))
+        .order_by(models.Product.id)
+        .with_for_update()
+    )
+    existing = {
+        product.id: {field: getattr(product, field) for field in PRODUCT_FIELDS}
+        for product in result.scalars()
+    }
+
+    changed = []
+    for product_id, (row, product) in chunk.items():
+        current = existing.get(product_id)
+        if current is None:
+            missing = REQUIRED_FIELDS - product.keys()
+            if missing:
+                _record_error(stats, row, f"new product needs {', '.join(sorted(missing))}")
+                continue
+            stats["created"] += 1
+        else:
+            if {**current, **product} == current:
+                stats["unchanged"] += 1
+                continue
+            stats["updated"] += 1
+        changed.append(product)
+
+    if changed and not dry_run:
+        # One statement per column set (usually one per feed)
+        by_columns = {}
+        for product in changed:
+            by_columns.setdefault(tuple(field for field in PRODUCT_FIELDS if field in product), []).append(product)
+        dialect_insert = postgresql.insert if db.bind.dialect.name == "postgresql" else sqlite.insert
+        for columns, products in by_columns.items():
+            stmt = dialect_insert(models.Product)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[models.Product.id],
+                set_={field: stmt.excluded[field] for field in columns if field != "id"},
+            )
+            # executemany: batched by the driver (asyncpg) or SQLAlchemy's
+            # insertmanyvalues, and compiled once instead of per chunk size
+            await db.execute(stmt, products)
+        await db.commit()
+
+def _record_error(stats: dict, row: int, error: str):
+    stats["invalid"] += 1
+    if len(stats["errors"]) < MAX_REPORTED_ERRORS:
+        stats["errors"].append({"row": row, "error": error})
+
+async def import_products(
+    session_factory,
+    feed: AsyncIterator[dict],
+    chunk_size: int = IMPORT_CHUNK_SIZE,
+    dry_run: bool = False,
+) -> dict:
+    """
+    Upsert products from a stream of records, `chunk_size` at a time: each
+    chunk is diffed against the stored rows and only new or changed products
+    are written, as one batched INSERT ... ON CONFLICT DO UPDATE. Invalid
+    rows are skipped and reported. Caches are invalidated once, at the end,
+    if anything changed. Each chunk commits on its own, so an error midway
+    leaves the chunks before it applied; re-running the feed is safe.
+    """
+    stats = {"rows": 0, "created": 0, "updated": 0, "unchanged": 0, "invalid": 0, "errors": [], "dry_run": dry_run}
+    chunk = {}
+
+    async def flush():
+        nonlocal chunk
+        if chunk:
+            async with session_factory() as db:
+                await _write_chunk(db, chunk, stats, dry_run)
+        chunk = {}
+
+    try:
+        async for record in feed:
+            stats["rows"] += 1
+            try:
+                product = parse_product(record)
+            except RecordError as e:
+                _record_error(stats, stats["rows"], str(e))
+                continue
+            if product["id"] in chunk:
+                # The same SKU twice in a chunk: write the first, then the later row wins
+                await flush()
+            chunk[product["id"]] = (stats["rows"], product)
+            if len(chunk) >= chunk_size:
+                await flush()
+        await flush()
+    finally:
+        if not dry_run and stats["created"]:
+            await _sync_id_sequence(session_factory)
+        if not dry_run and (stats["created"] or stats["updated"]):
+            catalog.invalidate_search_index()
+            await invalidate_cache("products")
+    return stats
+
+async def _sync_id_sequence(session_factory):
+    """Imported rows carry their own ids; move the Postgres sequence past them."""
+    async with session_factory() as db:
+        if db.bind.dialect.name != "postgresql":
+            return
+        await db.execute(text(
+            "SELECT setval(pg_get_serial_sequence('products', 'id'), (SELECT max(id) FROM products))"
+        ))
+        await db.commit()
+
+# --- Export ---
+
+async def export_products(session_factory, fmt: str = "csv") -> AsyncIterator[str]:
+    """Every product in id order as CSV (with header) or NDJSON, a page per chunk."""
+    if fmt == "csv":
+        yield ",".join(PRODUCT_FIELDS) + "\n"
+    after = None
+    while True:
+        query = select(models.Product).order_by(models.Product.id).limit(EXPORT_PAGE_SIZE)
+        if after is not None:
+            query = query.where(models.Product.id > after)
+        async with session_factory() as db:
+            page = (await db.execute(query)).scalars().all()
+        if not page:
+            return
+        out = io.StringIO()
+        if fmt == "csv":
+            writer = csv.writer(out, lineterminator="\n")
+            for product in page:
+                writer.writerow(["" if getattr(product, f) is None else getattr(product, f) for f in PRODUCT_FIELDS])
+        else:
+            for product in page:
+                out.write(json.dumps({f: getattr(product, f) for f in PRODUCT_FIELDS}, ensure_ascii=False) + "\n")
+        yield out.getvalue()
+        if len(page) < EXPORT_PAGE_SIZE:
+            return
+        after = page[-1].id
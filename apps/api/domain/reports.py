@@ -0,0 +1,182 @@
+from sqlalchemy.future import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, case, or_, and_
+from collections import deque
+from datetime import datetime
+from typing import AsyncIterator, Optional
+import asyncio
+import zipfile
+import csv
+import io
+import models
+from services import pdf as pdf_service
+from .inventory import HOLD_STATUSES
+from .orders import receipt_items_for
+
+# Orders whose units have left (or are leaving) the shelf for good
+SOLD_STATUSES = (
+    models.OrderStatus.PAID,
+    models.OrderStatus.SHIPPED,
+    models.OrderStatus.DELIVERED,
+)
+
+async def sales_by_product_service(
+    db: AsyncSession,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+):
+    """
+    Units sold, revenue and order count per product, best sellers first.
+    Revenue only counts lines with a checkout price (not backfilled ones).
+    """
+    item = models.OrderItem
+    order = models.Order
+    query = (
+        select(
+            item.product_id,
+            func.max(item.name).label("name"),
+            func.sum(item.quantity).label("units_sold"),
+            func.coalesce(func.sum(item.quantity * item.unit_price), 0).label("revenue"),
+            func.count(func.distinct(item.order_id)).label("orders"),
+        )
+        .join(order, order.id == item.order_id)
+        .where(order.status.in_(SOLD_STATUSES))
+        .group_by(item.product_id)
+        .order_by(func.sum(item.quantity).desc(), item.product_id)
+    )
+    if since is not None:
+        query = query.where(order.created_at >= since)
+    if until is not None:
+        query = query.where(order.created_at < until)
+
+    result = await db.execute(query)
+    return [dict(row._mapping) for row in result]
+
+async def stock_reconciliation_service(db: AsyncSession):
+    """
+    Per product: stock on the shelf, units held by open orders, units sold.
+    `available + held` is what the shelf count should show before pickup.
+    """
+    item = models.OrderItem
+    order = models.Order
+    totals = (
+        select(
+            item.product_id,
+            func.sum(case((order.status.in_(HOLD_STATUSES), item.quantity), else_=0)).label("held"),
+            func.sum(case((order.status.in_(SOLD_STATUSES), item.quantity), else_=0)).label("sold"),
+        )
+        .join(order, order.id == item.order_id)
+        .group_by(item.product_id)
+        .subquery()
+    )
+    query = (
+        select(
+            models.Product.id.label("product_id"),
+            models.Product.name,
+            models.Product.stock.label("available"),
+            func.coalesce(totals.c.held, 0).label("held"),
+            func.coalesce(totals.c.sold, 0).label("sold"),
+        )
+        .outerjoin(totals, totals.c.product_id == models.Product.id)
+        .order_by(models.Product.id)
+    )
+    result = await db.execute(query)
+    return [dict(row._mapping) for row in result]
+
+# --- Receipt export ---
+
+EXPORT_PAGE_SIZE = 200
+# Receipts rendering or waiting to be written at once; with one page of
+# orders this is all the export keeps in memory.
+EXPORT_WINDOW = pdf_service.PDF_WORKERS * 2
+
+class _ZipStream(io.RawIOBase):
+    """Write-only, unseekable target for ZipFile; drain() hands over what was written."""
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+async def _sold_orders(session_factory, since: datetime, until: datetime):
+    """Sold orders created in [since, until) with their receipt lines, a keyset page per session."""
+    order = models.Order
+    after = None
+    while True:
+        query = (
+            select(order)
+            .where(order.status.in_(SOLD_STATUSES), order.created_at >= since, order.created_at < until)
+            .order_by(order.created_at, order.id)
+            .limit(EXPORT_PAGE_SIZE)
+        )
+        if after is not None:
+            query = query.where(or_(
+                order.created_at > after[0],
+                and_(order.created_at == after[0], order.id > after[1]),
+            ))
+        async with session_factory() as db:
+            page = (await db.execute(query)).scalars().all()
+            lines = await receipt_items_for(db, page)
+        for row in page:
+            yield row, lines[row.id]
+        if len(page) < EXPORT_PAGE_SIZE:
+            return
+        after = (page[-1].created_at, page[-1].id)
+
+async def _render(row, items):
+    try:
+        return row, await pdf_service.render_receipt(
+            row.id, items, row.total_cents or 0, row.created_at, row.customer_email or "", cache=False
+        )
+    except Exception as e:
+        print(f"Receipt Export Error ({row.id}): {e}")
+        return row, None
+
+async def receipts_zip(session_factory, since: datetime, until: datetime) -> AsyncIterator[bytes]:
+    """
+    A ZIP of every sold order's receipt in [since, until), oldest first, plus
+    manifest.csv. Yields each receipt's part of the archive as soon as it is
+    rendered; up to EXPORT_WINDOW receipts render in parallel in the pool.
+    A receipt that fails to render is listed in the manifest without a file.
+    """
+    stream = _ZipStream()
+    manifest = io.StringIO()
+    writer = csv.writer(manifest)
+    writer.writerow(["order_id", "date", "customer_email", "status", "total", "file"])
+    pending = deque()
+
+    def add(row, pdf_bytes):
+        filename = f"Receipt_{row.id}.pdf" if pdf_bytes is not None else ""
+        if pdf_bytes is not None:
+            info = zipfile.ZipInfo(filename, date_time=row.created_at.timetuple()[:6])
+            # PDF content is already compressed
+            archive.writestr(info, pdf_bytes, compress_type=zipfile.ZIP_STORED)
+        status = row.status.value if isinstance(row.status, models.OrderStatus) else row.status
+        writer.writerow([row.id, row.created_at.isoformat(), row.customer_email or "", status,
+                         f"{(row.total_cents or 0) / 100:.2f}", filename or "render failed"])
+
+    try:
+        with zipfile.ZipFile(stream, "w") as archive:
+            async for row, items in _sold_orders(session_factory, since, until):
+                pending.append(asyncio.create_task(_render(row, items)))
+                if len(pending) >= EXPORT_WINDOW:
+                    add(*await pending.popleft())
+                    yield stream.drain()
+            while pending:
+                add(*await pending.popleft())
+                yield stream.drain()
+            archive.writestr("manifest.csv", manifest.getvalue(), compress_type=zipfile.ZIP_DEFLATED)
+        yield stream.drain()
+    finally:
+        # Client went away mid-download
+        for task in pending:
+            task.cancel()
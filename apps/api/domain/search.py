@@ -0,0 +1,103 @@
+import heapq
+import re
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Field weights for relevance ranking. Model numbers are the strongest signal:
+# a customer typing "LW1022" wants that unit, not everything mentioning "BTU".
+FIELD_WEIGHTS = {
+    "model": 4.0,
+    "name": 3.0,
+    "key_spec": 1.5,
+    "performance_specs": 1.0,
+}
+
+# A prefix match counts for less than a whole-word match
+PREFIX_FACTOR = 0.5
+
+# Model-number suffixes shorter than this are too ambiguous to index
+MIN_SUFFIX_LENGTH = 3
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_THOUSANDS_RE = re.compile(r"(?<=\d),(?=\d{3})")
+_MODEL_RE = re.compile(r"^(?=.*[a-z])(?=.*\d)[a-z0-9]{5,}$")
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Lowercase alphanumeric tokens; '12,000 BTU' -> ['12000', 'btu']."""
+    if not text:
+        return []
+    return _TOKEN_RE.findall(_THOUSANDS_RE.sub("", text.lower()))
+
+def _field(product, name: str) -> Optional[str]:
+    if isinstance(product, dict):
+        return product.get(name)
+    return getattr(product, name, None)
+
+class ProductSearchIndex:
+    """
+    In-memory inverted index over the catalog, used where Postgres full-text
+    and trigram indexes are not available (SQLite, tests, no-DB runs).
+
+    Indexes name, key_spec and performance_specs, plus every suffix of model
+    numbers so a partial model ("6023") still matches "LW6023IVSM".
+    Every query term must match (like the old ILIKE filter); results are
+    ranked by the summed field weight of the best match for each term.
+    """
+    def __init__(self, products: Iterable):
+        self._postings: Dict[str, Dict[int, float]] = {}
+        for product in products:
+            self._add(product)
+        self._tokens = sorted(self._postings)
+
+    def __len__(self):
+        return len(self._tokens)
+
+    def _post(self, token: str, product_id: int, weight: float):
+        postings = self._postings.setdefault(token, {})
+        if weight > postings.get(product_id, 0.0):
+            postings[product_id] = weight
+
+    def _add(self, product):
+        product_id = _field(product, "id")
+        for field in ("name", "key_spec", "performance_specs"):
+            for token in tokenize(_field(product, field)):
+                self._post(token, product_id, FIELD_WEIGHTS[field])
+                if field == "name" and _MODEL_RE.match(token):
+                    for start in range(1, len(token) - MIN_SUFFIX_LENGTH + 1):
+                        self._post(token[start:], product_id, FIELD_WEIGHTS["model"] * PREFIX_FACTOR)
+                    self._post(token, product_id, FIELD_WEIGHTS["model"])
+
+    def _match(self, term: str) -> Dict[int, float]:
+        """Scores for one query term: exact token matches, then prefix matches."""
+        scores: Dict[int, float] = {}
+        i = bisect_left(self._tokens, term)
+        while i < len(self._tokens) and self._tokens[i].startswith(term):
+            token = self._tokens[i]
+            factor = 1.0 if token == term else PREFIX_FACTOR
+            for product_id, weight in self._postings[token].items():
+                score = weight * factor
+                if score > scores.get(product_id, 0.0):
+                    scores[product_id] = score
+            i += 1
+        return scores
+
+    def search(self, q: str, limit: Optional[int] = None) -> List[Tuple[int, float]]:
+        """Ranked (product_id, score) pairs, best first (ties by id)."""
+        terms = tokenize(q)
+        if not terms:
+            return []
+
+        totals: Optional[Dict[int, float]] = None
+        for term in terms:
+            scores = self._match(term)
+            if totals is None:
+                totals = scores
+            else:
+                totals = {pid: totals[pid] + s for pid, s in scores.items() if pid in totals}
+            if not totals:
+                return []
+
+        order = lambda item: (-item[1], item[0])
+        if limit is not None:
+            return heapq.nsmallest(limit, totals.items(), key=order)
+        return sorted(totals.items(), key=order)
@@ -0,0 +1,208 @@
+from sqlalchemy.future import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import text, update, delete, func, bindparam, DateTime
+from sqlalchemy.dialects import postgresql, sqlite
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, List, Optional
+import asyncio
+import json
+import os
+import random
+import time
+import models
+
+# Webhook inbox: the HTTP handler only verifies and enqueues, a pool of
+# workers drains the webhook_events table. Rows are keyed by event id, so a
+# provider retry of an event we already have is dropped on insert.
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "4"))
+MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "8"))
+BACKOFF_BASE = float(os.getenv("WEBHOOK_BACKOFF_SECONDS", "2"))
+BACKOFF_MAX = 3600.0
+# A worker that dies mid-event loses its lease after this long
+LEASE_SECONDS = int(os.getenv("WEBHOOK_LEASE_SECONDS", "120"))
+POLL_INTERVAL = float(os.getenv("WEBHOOK_POLL_INTERVAL_SECONDS", "1"))
+# DONE rows are kept this long, then purged by an idle worker. Redeliveries
+# are only deduplicated while the row exists, so keep it above the provider's
+# retry window (Stripe: 3 days).
+RETENTION_DAYS = float(os.getenv("WEBHOOK_RETENTION_DAYS", "7"))
+PURGE_INTERVAL = 3600
+PURGE_BATCH = 1000
+# Statuses counted by get_queue_stats; DONE only grows until purged
+QUEUE_STATUSES = (models.WebhookStatus.PENDING, models.WebhookStatus.PROCESSING, models.WebhookStatus.DEAD)
+
+EventHandler = Callable[[dict], Awaitable[None]]
+
+_worker_tasks: List[asyncio.Task] = []
+_wakeup: Optional[asyncio.Event] = None
+_last_purge = 0.0
+
+webhook_stats = {"enqueued": 0, "duplicates": 0, "processed": 0, "retried": 0, "dead": 0}
+
+def backoff_delay(attempts: int) -> float:
+    """Exponential with full jitter: up to BACKOFF_BASE * 2^(attempts-1), capped."""
+    return random.uniform(0, min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX))
+
+async def enqueue_event(db: AsyncSession, event: dict, payload: str) -> bool:
+    """Store a verified event. Returns False if this event id was already received."""
+    dialect_insert = postgresql.insert if db.bind.dialect.name == "postgresql" else sqlite.insert
+    result = await db.execute(
+        dialect_insert(models.WebhookEvent)
+        .values(id=event["id"], type=event.get("type"), payload=payload)
+        .on_conflict_do_nothing(index_elements=[models.WebhookEvent.id])
+    )
+    await db.commit()
+    created = result.rowcount == 1
+    webhook_stats["enqueued" if created else "duplicates"] += 1
+    if created and _wakeup is not None:
+        _wakeup.set()
+    return created
+
+async def claim_next_event(db: AsyncSession, now: Optional[datetime] = None):
+    """
+    Lease the oldest due event in one statement: pending and due, or stuck in
+    PROCESSING past its lease. SKIP LOCKED lets Postgres workers claim
+    different rows concurrently. Returns (id, type, payload, attempts) or None.
+    """
+    now = now or datetime.utcnow()
+    skip_locked = "FOR UPDATE SKIP LOCKED" if db.bind.dialect.name == "postgresql" else ""
+    result = await db.execute(text(f"""
+        UPDATE webhook_events
+        SET status = :processing, locked_until = :lease, attempts = attempts + 1
+        WHERE id = (
+            SELECT id FROM webhook_events
+            WHERE (status = :pending AND next_attempt_at <= :now)
+               OR (status = :processing AND locked_until < :now)
+            ORDER BY next_attempt_at
+            LIMIT 1
+            {skip_locked}
+        )
+        RETURNING id, type, payload, attempts
+    """).bindparams(bindparam("now", type_=DateTime), bindparam("lease", type_=DateTime)), {
+        "processing": models.WebhookStatus.PROCESSING.value,
+        "pending": models.WebhookStatus.PENDING.value,
+        "now": now,
+        "lease": now + timedelta(seconds=LEASE_SECONDS),
+    })
+    row = result.first()
+    await db.commit()
+    return row
+
+async def complete_event(db: AsyncSession, event_id: str):
+    await db.execute(
+        update(models.WebhookEvent)
+        .where(models.WebhookEvent.id == event_id)
+        .values(status=models.WebhookStatus.DONE, locked_until=None, last_error=None, processed_at=datetime.utcnow())
+    )
+    await db.commit()
+    webhook_stats["processed"] += 1
+
+async def fail_event(db: AsyncSession, event_id: str, attempts: int, error: str):
+    """Schedule a retry with backoff, or dead-letter after MAX_ATTEMPTS."""
+    values = {"locked_until": None, "last_error": error[:1000]}
+    if attempts >= MAX_ATTEMPTS:
+        values["status"] = models.WebhookStatus.DEAD
+        webhook_stats["dead"] += 1
+    else:
+        values["status"] = models.WebhookStatus.PENDING
+        values["next_attempt_at"] = datetime.utcnow() + timedelta(seconds=backoff_delay(attempts))
+        webhook_stats["retried"] += 1
+    await db.execute(update(models.WebhookEvent).where(models.WebhookEvent.id == event_id).values(**values))
+    await db.commit()
+
+async def process_next_event(session_factory, handler: EventHandler) -> bool:
+    """Claim and handle one event. Returns False when nothing was due."""
+    async with session_factory() as session:
+        claimed = await claim_next_event(session)
+        if claimed is None:
+            return False
+        try:
+            await handler(json.loads(claimed.payload))
+        except Exception as e:
+            print(f"Webhook Processing Error ({claimed.id}, attempt {claimed.attempts}): {e}")
+            await fail_event(session, claimed.id, claimed.attempts, repr(e))
+        else:
+            await complete_event(session, claimed.id)
+        return True
+
+async def purge_done_events(db: AsyncSession, now: Optional[datetime] = None) -> int:
+    """Delete DONE events older than RETENTION_DAYS, PURGE_BATCH rows per transaction."""
+    cutoff = (now or datetime.utcnow()) - timedelta(days=RETENTION_DAYS)
+    event = models.WebhookEvent
+    expired = (
+        select(event.id)
+        .where(event.status == models.WebhookStatus.DONE, event.processed_at < cutoff)
+        .limit(PURGE_BATCH)
+    )
+    purged = 0
+    while True:
+        result = await db.execute(delete(event).where(event.id.in_(expired)))
+        await db.commit()
+        purged += result.rowcount
+        if result.rowcount < PURGE_BATCH:
+            return purged
+
+async def _work(session_factory, handler: EventHandler):
+    global _last_purge
+    while True:
+        try:
+            if await process_next_event(session_factory, handler):
+                continue
+            if time.monotonic() - _last_purge > PURGE_INTERVAL:
+                _last_purge = time.monotonic()
+                async with session_factory() as session:
+                    purged = await purge_done_events(session)
+                if purged:
+                    print(f"Webhook inbox: purged {purged} processed events")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Webhook Worker Error: {e}")
+        # Idle: wait for an enqueue in this process or poll for other workers'
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=POLL_INTERVAL)
+            _wakeup.clear()
+        except asyncio.TimeoutError:
+            pass
+
+def start_webhook_workers(session_factory, handler: EventHandler, workers: int = WEBHOOK_WORKERS):
+    global _wakeup
+    if _worker_tasks:
+        return
+    _wakeup = asyncio.Event()
+    for _ in range(workers):
+        _worker_tasks.append(asyncio.create_task(_work(session_factory, handler)))
+
+async def stop_webhook_workers():
+    for task in _worker_tasks:
+        task.cancel()
+    await asyncio.gather(*_worker_tasks, return_exceptions=True)
+    _worker_tasks.clear()
+
+async def get_queue_stats(db: AsyncSession) -> dict:
+    """Inbox rows still queued or dead by status (an index range scan), plus this process's counters."""
+    result = await db.execute(
+        select(models.WebhookEvent.status, func.count())
+        .where(models.WebhookEvent.status.in_(QUEUE_STATUSES))
+        .group_by(models.WebhookEvent.status)
+    )
+    return {"queue": {status: count for status, count in result}, "workers": len(_worker_tasks), **webhook_stats}
+
+async def list_dead_events(db: AsyncSession):
+    result = await db.execute(
+        select(models.WebhookEvent)
+        .where(models.WebhookEvent.status == models.WebhookStatus.DEAD)
+        .order_by(models.WebhookEvent.created_at.desc())
+    )
+    return result.scalars().all()
+
+async def requeue_event(db: AsyncSession, event_id: str) -> bool:
+    """Send a dead-lettered event back to the queue with a fresh attempt budget."""
+    result = await db.execute(
+        update(models.WebhookEvent)
+        .where(models.WebhookEvent.id == event_id, models.WebhookEvent.status == models.WebhookStatus.DEAD)
+        .values(status=models.WebhookStatus.PENDING, attempts=0, next_attempt_at=datetime.utcnow())
+    )
+    await db.commit()
+    if result.rowcount and _wakeup is not None:
+        _wakeup.set()
+    return bool(result.rowcount)
@@ -0,0 +1,304 @@
+import os
+import re
+import json
+import time
+import base64
+import hashlib
+import asyncio
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+from uuid import uuid4
+from sqlalchemy import delete, or_, and_
+from sqlalchemy.future import select
+from sqlalchemy.dialects import postgresql, sqlite
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+import cache
+import models
+from database import AsyncSessionLocal
+
+# Response replay for mutating requests that carry an Idempotency-Key header.
+# The first request runs and its 2xx response is stored; retries with the same
+# key get that response back (with Idempotent-Replayed: true) instead of
+# running the route again, and concurrent duplicates wait for the first.
+# Anything else (4xx, 5xx, crashes) is not stored, so a retry runs again.
+
+IDEMPOTENT_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+# Routes with their own idempotency (create-intent) or none wanted (webhooks)
+EXEMPT_PATHS = [
+    re.compile(r"^/api/v1/payments/create-intent$"),
+    re.compile(r"^/api/webhooks/"),
+]
+
+KEY_PREFIX = "idem"
+RECORD_TTL = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", str(24 * 3600)))
+# How long a claimed key waits for its first request before others may retry it
+PENDING_TTL = float(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "30"))
+# Larger (or unsized, streamed) bodies are passed through untouched
+MAX_BODY_BYTES = int(os.getenv("IDEMPOTENCY_MAX_BODY_BYTES", str(1024 * 1024)))
+# Waiting for another worker's first request: poll, backing off to MAX_POLL_INTERVAL
+POLL_INTERVAL = 0.05
+MAX_POLL_INTERVAL = 1.0
+PURGE_INTERVAL = 3600
+
+# Delete a pending claim only if it is still ours: a request that outlived
+# PENDING_TTL must not drop the claim a later request made for the same key
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+# First requests running in this process; duplicates wait on these
+_inflight: Dict[str, asyncio.Event] = {}
+
+def record_key(method: str, path: str, idempotency_key: str) -> str:
+    return hashlib.sha256(f"{method} {path} {idempotency_key}".encode("utf-8")).hexdigest()
+
+def request_fingerprint(method: str, path: str, query: bytes, body: bytes) -> str:
+    digest = hashlib.sha256(f"{method} {path}?".encode("utf-8"))
+    digest.update(query)
+    digest.update(b"\n")
+    digest.update(body)
+    return digest.hexdigest()
+
+class RedisStore:
+    """
+    Records as JSON under idem:{key}; pending ones expire after PENDING_TTL.
+    claim returns a token identifying the claim (None if already taken) for release.
+    """
+    async def get(self, key: str) -> Optional[dict]:
+        cached = await cache.redis_client.get(f"{KEY_PREFIX}:{key}")
+        return json.loads(cached) if cached else None
+
+    async def claim(self, key: str, fingerprint: str) -> Optional[str]:
+        # The pending record itself is the token: it carries a unique claim id
+        pending = json.dumps({"fingerprint": fingerprint, "status": None, "claim": uuid4().hex})
+        claimed = await cache.redis_client.set(
+            f"{KEY_PREFIX}:{key}", pending, nx=True, px=int(PENDING_TTL * 1000)
+        )
+        return pending if claimed else None
+
+    async def complete(self, key: str, fingerprint: str, status: int, headers: list, body: bytes):
+        record = {
+            "fingerprint": fingerprint,
+            "status": status,
+            "headers": headers,
+            "body": base64.b64encode(body).decode("ascii"),
+        }
+        await cache.redis_client.set(f"{KEY_PREFIX}:{key}", json.dumps(record), ex=RECORD_TTL)
+
+    async def release(self, key: str, token: str):
+        await cache.redis_client.eval(RELEASE_SCRIPT, 1, f"{KEY_PREFIX}:{key}", token)
+
+class DatabaseStore:
+    """Same records in the idempotency_keys table, for when Redis is down."""
+    _last_purge = 0.0
+
+    def _expired(self, now: datetime):
+        record = models.IdempotencyRecord
+        return or_(
+            record.created_at < now - timedelta(seconds=RECORD_TTL),
+            and_(record.status_code.is_(None), record.created_at < now - timedelta(seconds=PENDING_TTL)),
+        )
+
+    async def get(self, key: str) -> Optional[dict]:
+        record = models.IdempotencyRecord
+        async with AsyncSessionLocal() as session:
+            row = (await session.execute(
+                select(record).where(record.key == key, ~self._expired(datetime.utcnow()))
+            )).scalar_one_or_none()
+        if row is None:
+            return None
+        return {
+            "fingerprint": row.fingerprint,
+            "status": row.status_code,
+            "headers": json.loads(row.headers) if row.headers else [],
+            "body": base64.b64encode(row.body or b"").decode("ascii"),
+        }
+
+    async def claim(self, key: str, fingerprint: str) -> Optional[datetime]:
+        """The claim's created_at is its token (None if already taken)."""
+        record = models.IdempotencyRecord
+        now = datetime.utcnow()
+        async with AsyncSessionLocal() as session:
+            if time.monotonic() - DatabaseStore._last_purge > PURGE_INTERVAL:
+                DatabaseStore._last_purge = time.monotonic()
+                await session.execute(delete(record).where(self._expired(now)))
+            else:
+                await session.execute(delete(record).where(record.key == key, self._expired(now)))
+            dialect_insert = postgresql.insert if session.bind.dialect.name == "postgresql" else sqlite.insert
+            result = await session.execute(
+                dialect_insert(record)
+                .values(key=key, fingerprint=fingerprint, created_at=now)
+                .on_conflict_do_nothing(index_elements=[record.key])
+            )
+            await session.commit()
+        return now if result.rowcount == 1 else None
+
+    async def complete(self, key: str, fingerprint: str, status: int, headers: list, body: bytes):
+        async with AsyncSessionLocal() as session:
+            row = await session.get(models.IdempotencyRecord, key)
+            if row is not None:
+                row.status_code = status
+                row.headers = json.dumps(headers)
+                row.body = body
+                await session.commit()
+
+    async def release(self, key: str, token: datetime):
+        record = models.IdempotencyRecord
+        async with AsyncSessionLocal() as session:
+            await session.execute(delete(record).where(
+                record.key == key, record.status_code.is_(None), record.created_at == token
+            ))
+            await session.commit()
+
+redis_store = RedisStore()
+database_store = DatabaseStore()
+
+async def _json_response(send: Send, status: int, detail: str):
+    body = json.dumps({"detail": detail}).encode("utf-8")
+    await send({"type": "http.response.start", "status": status, "headers": [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(body)).encode("latin-1")),
+    ]})
+    await send({"type": "http.response.body", "body": body})
+
+async def _replay(send: Send, record: dict):
+    headers = [(name.encode("latin-1"), value.encode("latin-1")) for name, value in record["headers"]]
+    headers.append((b"idempotent-replayed", b"true"))
+    await send({"type": "http.response.start", "status": record["status"], "headers": headers})
+    await send({"type": "http.response.body", "body": base64.b64decode(record["body"])})
+
+def _body_receive(body: bytes, receive: Receive) -> Receive:
+    """Hands the already-read body to the app, then defers to the server."""
+    body_sent = False
+
+    async def replay_receive() -> Message:
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return await receive()
+
+    return replay_receive
+
+class IdempotencyMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["method"] not in IDEMPOTENT_METHODS:
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        idempotency_key = headers.get("idempotency-key")
+        content_length = headers.get("content-length")
+        if (
+            not idempotency_key
+            or any(pattern.match(scope["path"]) for pattern in EXEMPT_PATHS)
+            or not (content_length or "").isdigit()
+            or int(content_length) > MAX_BODY_BYTES
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        body = await self._read_body(receive)
+        key = record_key(scope["method"], scope["path"], idempotency_key)
+        fingerprint = request_fingerprint(scope["method"], scope["path"], scope["query_string"], body)
+
+        # Redis first, then the database; with neither (NO-DB mode, database
+        # down) the request runs unprotected rather than failing
+        stores = [redis_store, database_store] if cache.redis_client else [database_store]
+        for store in stores:
+            try:
+                outcome, record = await self._claim_or_wait(store, key, fingerprint)
+                break
+            except Exception as e:
+                fallback = "using database" if store is redis_store else "passing through"
+                print(f"Idempotency {type(store).__name__} Error, {fallback}: {e}")
+        else:
+            await self.app(scope, _body_receive(body, receive), send)
+            return
+
+        if outcome == "replay":
+            await _replay(send, record)
+        elif outcome == "mismatch":
+            await _json_response(send, 422, "Idempotency-Key was already used for a different request.")
+        elif outcome == "busy":
+            await _json_response(send, 409, "A request with this Idempotency-Key is still in progress.")
+        else:
+            await self._run_first(scope, receive, send, body, store, key, fingerprint, claim=record)
+
+    async def _read_body(self, receive: Receive) -> bytes:
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] != "http.request":
+                break
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                break
+        return b"".join(chunks)
+
+    async def _claim_or_wait(self, store, key: str, fingerprint: str):
+        """(outcome, record): the stored record for "replay", the claim token for "claimed"."""
+        deadline = time.monotonic() + PENDING_TTL
+        poll_interval = POLL_INTERVAL
+        while True:
+            claim = await store.claim(key, fingerprint)
+            if claim is not None:
+                return "claimed", claim
+            record = await store.get(key)
+            if record is not None:
+                if record["fingerprint"] != fingerprint:
+                    return "mismatch", None
+                if record["status"] is not None:
+                    return "replay", record
+            if time.monotonic() > deadline:
+                return "busy", None
+            # Wake as soon as a first request in this process finishes;
+            # otherwise poll for one running in another worker.
+            event = _inflight.get(key)
+            if event is not None:
+                try:
+                    await asyncio.wait_for(event.wait(), timeout=max(deadline - time.monotonic(), 0))
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await asyncio.sleep(min(poll_interval, max(deadline - time.monotonic(), 0)))
+                poll_interval = min(poll_interval * 2, MAX_POLL_INTERVAL)
+
+    async def _run_first(self, scope: Scope, receive: Receive, send: Send, body: bytes, store, key: str, fingerprint: str, claim):
+        done = _inflight[key] = asyncio.Event()
+        status = None
+        response_headers = []
+        chunks = []
+        complete = False
+
+        async def capture(message: Message):
+            nonlocal status, response_headers, complete
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                response_headers = [
+                    [name.decode("latin-1"), value.decode("latin-1")] for name, value in message.get("headers", [])
+                ]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+                complete = not message.get("more_body", False)
+            await send(message)
+
+        try:
+            await self.app(scope, _body_receive(body, receive), capture)
+        finally:
+            try:
+                if complete and status is not None and 200 <= status < 300:
+                    await store.complete(key, fingerprint, status, response_headers, b"".join(chunks))
+                else:
+                    await store.release(key, claim)
+            except Exception as e:
+                print(f"Idempotency Store Error: {e}")
+            finally:
+                _inflight.pop(key, None)
+                done.set()
@@ -1,4 +1,7 @@
 
+import time
+STARTED_AT = time.perf_counter() # Worker boot timing, see bootstrap.startup_stats
+
 from datetime import datetime
 from dotenv import load_dotenv
 import os
@@ -7,26 +10,26 @@ import os
 load_dotenv()
 print(f"DEBUG: STARTUP MAIN.PY. STRIPE_KEY_LEN={len(os.getenv('STRIPE_SECRET_KEY', ''))}")
 
-from fastapi import FastAPI, HTTPException, Depends, Header
+from fastapi import FastAPI, HTTPException, Depends, Header, Query
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import insert, update
 from contextlib import asynccontextmanager
 from pydantic import BaseModel
 from typing import List, Dict, Optional
-import csv
 import asyncio
 import random
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.responses import Response
+from starlette.responses import Response, StreamingResponse
 
 # Local Imports
-from database import engine, Base, get_db, AsyncSessionLocal
+from database import engine, read_engine, get_db, get_read_db, AsyncSessionLocal, ReadSessionLocal, dispose_engines, get_pool_stats
 import models
-from domain import orders, catalog, cart, payments
-from cache import init_redis, close_redis, cache_response, invalidate_cache
-from middleware import LogSanitizerMiddleware, ChaosMiddleware, HeaderMiddleware
+from domain import orders, catalog, cart, payments, inventory, reports, webhooks, product_io
+from cache import init_redis, close_redis, cache_response, invalidate_cache, get_cache_stats
+from middleware import install_middleware
+from idempotency import IdempotencyMiddleware
+import bootstrap
+import metrics
 
 # --- LIFESPAN (Startup/Shutdown) ---
 @asynccontextmanager
@@ -34,56 +37,33 @@ async def lifespan(app: FastAPI):
     # 0. Init Redis
     await init_redis()
 
-    # 1. Initialize Tables
-    print("DEBUG: Creating Tables...")
+    # 1. Tables and seed data, only when the schema version or products are missing
     try:
-        async with engine.begin() as conn:
-            await conn.run_sync(Base.metadata.create_all)
-
-        # 2. Seed Data if Empty
-        async with AsyncSessionLocal() as session:
-            result = await session.execute(select(models.Product))
-            existing_product = result.scalars().first()
-
-            if not existing_product:
-                print("Database empty. Seeding from inventory.csv...")
-                file_path = os.path.join(os.path.dirname(__file__), "inventory.csv")
-                try:
-                    products_to_add = []
-                    with open(file_path, mode='r') as csvfile:
-                        reader = csv.DictReader(csvfile)
-                        for row in reader:
-                            products_to_add.append({
-                                "id": int(row['id']),
-                                "name": row['name'],
-                                "price": int(row['price']),
-                                "category": row['category'],
-                                "stock": int(row['stock']),
-                                "image_url": row.get('image_url'),
-                                "btu": int(row['btu']) if row.get('btu') else None,
-                                "voltage": row.get('voltage'),
-                                "coverage": row.get('coverage'),
-                                "performance_specs": row.get('performance_specs'),
-                                "key_spec": row.get('key_spec'),
-                                "noise_level": row.get('noise_level'),
-                                "dehumidification": row.get('dehumidification')
-                            })
-
-                    if products_to_add:
-                        await session.execute(insert(models.Product), products_to_add)
-                        await session.commit()
-                        print(f"Seeded {len(products_to_add)} products.")
-                except FileNotFoundError:
-                    print("Warning: inventory.csv not found. Skipping seed.")
+        bootstrap.startup_stats["schema"] = await bootstrap.ensure_schema(engine, AsyncSessionLocal)
     except Exception as e:
         print(f"WARNING: Database connection failed: {e}")
         print("Running in NO-DB Mode. Only Mock Endpoints will work.")
 
-    print("DEBUG: Startup Complete.")
+    # 2. Release expired stock holds in the background
+    inventory.start_hold_sweeper(AsyncSessionLocal)
+
+    # 3. Drain the webhook inbox
+    webhooks.start_webhook_workers(AsyncSessionLocal, process_stripe_event)
+
+    # 4. Email senders (persistent SMTP connections)
+    email_service.start_email_workers()
+
+    bootstrap.record_startup("startup")
+    print(f"DEBUG: Startup Complete in {bootstrap.startup_stats['startup_seconds']}s (imports {bootstrap.startup_stats['import_seconds']}s).")
     yield
     # Shutdown
+    await webhooks.stop_webhook_workers()
+    await email_service.stop_email_workers()
+    pdf_service.shutdown_pdf_pool()
+    await inventory.stop_hold_sweeper()
+    await payments.payments_client.close()
     await close_redis()
-    await engine.dispose()
+    await dispose_engines()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -91,6 +71,11 @@ app = FastAPI(lifespan=lifespan)
 allowed_origins_raw = os.getenv("ALLOWED_ORIGINS", "*")
 origins = allowed_origins_raw.split(",") if allowed_origins_raw != "*" else ["*"]
 
+# Innermost: replays stored responses for retried Idempotency-Key requests
+app.add_middleware(IdempotencyMiddleware)
+install_middleware(app)
+# Outside every layer that answers early (304s, chaos), so those responses
+# carry the CORS headers too
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -98,10 +83,14 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Outside the other middleware, so 304s and chaos responses are timed too
+app.add_middleware(metrics.MetricsMiddleware, root=app)
+# Outermost, so the first request is timed end to end
+app.add_middleware(bootstrap.FirstRequestTimer)
 
-app.add_middleware(LogSanitizerMiddleware)
-app.add_middleware(ChaosMiddleware)
-app.add_middleware(HeaderMiddleware)
+metrics.instrument_engine(engine, "primary")
+if read_engine is not engine:
+    metrics.instrument_engine(read_engine, "replica")
 
 # --- ROUTES ---
 
@@ -109,6 +98,50 @@ app.add_middleware(HeaderMiddleware)
 async def health_check():
     return {"status": "ok"}
 
+@app.get("/api/v1/health/cache")
+async def cache_health():
+    return get_cache_stats()
+
+@app.get("/api/v1/health/db")
+async def db_health():
+    return get_pool_stats()
+
+@app.get("/api/v1/health/payments")
+async def payments_health():
+    return payments.payments_client.get_stats()
+
+@app.get("/api/v1/health/email")
+async def email_health():
+    return email_service.get_email_stats()
+
+@app.get("/api/v1/health/startup")
+async def startup_health():
+    return bootstrap.startup_stats
+
+@app.get("/api/v1/health/webhooks")
+async def webhooks_health(db: AsyncSession = Depends(get_db)):
+    return await webhooks.get_queue_stats(db)
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus text format, for this worker (see metrics.py)."""
+    try:
+        async with ReadSessionLocal() as db:
+            webhook_stats = await webhooks.get_queue_stats(db)
+    except Exception as e:
+        print(f"WARNING: Webhook queue stats unavailable: {e}")
+        webhook_stats = None
+    body = metrics.render(
+        cache=get_cache_stats(),
+        pools=get_pool_stats(),
+        email=email_service.get_email_stats(),
+        webhooks=webhook_stats,
+        payments=payments.payments_client.get_stats(),
+        pdf=pdf_service.get_pdf_stats(),
+        startup=bootstrap.startup_stats,
+    )
+    return Response(body, media_type="text/plain; version=0.0.4; charset=utf-8")
+
 # --- MODELS (Pydantic) ---
 class ProductSchema(BaseModel):
     id: int
@@ -128,6 +161,11 @@ class ProductSchema(BaseModel):
     class Config:
         from_attributes = True
 
+class ProductSearchResult(BaseModel):
+    items: List[ProductSchema]
+    total: int
+    facets: Dict[str, Dict[str, int]]
+
 class WarrantySpec(BaseModel):
     parts: str
     compressor: str
@@ -229,6 +267,30 @@ class OrderSchema(BaseModel):
 class OrderUpdateSchema(BaseModel):
     status: str
 
+class ProductSalesSchema(BaseModel):
+    product_id: int
+    name: Optional[str] = None
+    units_sold: int
+    revenue: int
+    orders: int
+
+class StockReconciliationSchema(BaseModel):
+    product_id: int
+    name: Optional[str] = None
+    available: Optional[int] = None
+    held: int
+    sold: int
+
+class WebhookEventSchema(BaseModel):
+    id: str
+    type: Optional[str] = None
+    status: str
+    attempts: int
+    last_error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    class Config:
+        from_attributes = True
+
 # --- API ENDPOINTS ---
 
 @app.post("/api/v1/orders")
@@ -246,6 +308,16 @@ async def create_payment_intent(
     idempotency_key: Optional[str] = Header(None)
 ):
     print(f"DEBUG: create_payment_intent hit. Email={request.customer_email}")
+    # 0. Retry of an attempt that already has its order and intent. Only a
+    # cached intent costs the order lookup; first attempts go straight on.
+    cached_intent = await payments.get_cached_intent(idempotency_key, request.client_total_cents) if idempotency_key else None
+    if cached_intent:
+        existing = await orders.find_checkout_order(db, idempotency_key)
+        if existing and existing.status not in orders.CHECKOUT_RETRY_STATUSES:
+            raise HTTPException(status_code=409, detail=f"Invalid State Transition from {existing.status}")
+        if existing and existing.total_cents == request.client_total_cents:
+            return cached_intent
+
     # 1. Total
     server_total_cents = await cart.calculate_cart_total(request.items, db)
 
@@ -253,49 +325,35 @@ async def create_payment_intent(
     if server_total_cents != request.client_total_cents:
         raise HTTPException(status_code=400, detail="Price mismatch detected. Please refresh cart.")
 
-    # 3. Order Init
-    existing_order = None
-    if idempotency_key:
-        result = await db.execute(select(models.Order).where(models.Order.idempotency_key == idempotency_key))
-        existing_order = result.scalars().first()
-
-    if existing_order:
-        if existing_order.status == models.OrderStatus.PAID:
-            pass
-        elif existing_order.status != models.OrderStatus.AWAIT_PAYMENT:
-            raise HTTPException(status_code=409, detail=f"Invalid State Transition from {existing_order.status}")
-
-        if request.customer_email and existing_order.customer_email != request.customer_email:
-             existing_order.customer_email = request.customer_email
-             await db.commit()
-    else:
-        from uuid import uuid4
-        import json
-        items_serialized = json.dumps([i.dict() for i in request.items])
-        new_order = models.Order(
-            id=str(uuid4()),
-            status=models.OrderStatus.AWAIT_PAYMENT,
-            total_cents=server_total_cents,
-            idempotency_key=idempotency_key,
-            customer_email=request.customer_email,
-            items_json=items_serialized
-        )
-        db.add(new_order)
-        await db.commit()
-
-    # 4. Stripe Intent
-    result = await payments.create_payment_intent_service(server_total_cents, request.currency, idempotency_key)
-
-    # 5. Update Order
-    if not existing_order or not existing_order.stripe_pid:
-        stmt = (
-            models.update(models.Order)
-            .where(models.Order.idempotency_key == idempotency_key)
-            .values(stripe_pid=result['id'])
-        )
-        await db.execute(stmt)
-        await db.commit()
+    # 3. Stripe Intent first, so a provider outage never leaves stock on hold
+    try:
+        result = await payments.create_payment_intent_service(server_total_cents, request.currency, idempotency_key)
+    except payments.PaymentsUnavailable:
+        raise HTTPException(status_code=503, detail="Payments are temporarily unavailable. Please try again shortly.")
+    except payments.PaymentsError as e:
+        raise HTTPException(status_code=502, detail=f"Payment provider rejected the request: {e}")
+
+    # 4. Order Init: one upsert on the idempotency key, which also fills in a
+    # missing stripe_pid and returns the state to check; stock is held for new
+    # orders. A shortfall here leaves the intent unconfirmed, so it is never charged.
+    from uuid import uuid4
+    order, created = await orders.upsert_checkout_order(db, {
+        "id": str(uuid4()),
+        "status": models.OrderStatus.AWAIT_PAYMENT,
+        "total_cents": server_total_cents,
+        "idempotency_key": idempotency_key,
+        "customer_email": request.customer_email,
+        "stripe_pid": result["id"],
+        "reserved_until": inventory.hold_expiry(models.OrderStatus.AWAIT_PAYMENT),
+    }, request.items)
+
+    if not created and order.status not in orders.CHECKOUT_RETRY_STATUSES:
+        await db.rollback()
+        raise HTTPException(status_code=409, detail=f"Invalid State Transition from {order.status}")
+    await db.commit()
 
+    if idempotency_key:
+        await payments.cache_intent(idempotency_key, result, server_total_cents)
     return result
 
 # --- WEBHOOKS ---
@@ -303,6 +361,10 @@ from fastapi import Request, BackgroundTasks
 from services import email as email_service
 
 async def process_stripe_event(event: dict):
+    """
+    Handles one inbox event (see domain/webhooks.py). Raising schedules a
+    retry with backoff, so failures are not swallowed here.
+    """
     if event['type'] == 'payment_intent.succeeded':
         intent = event['data']['object']
         stripe_pid = intent['id']
@@ -312,35 +374,54 @@ async def process_stripe_event(event: dict):
         print(f"Processing Payment Success: {stripe_pid}")
 
         async with AsyncSessionLocal() as session:
-            try:
-                result = await session.execute(
-                    select(models.Order).where(models.Order.stripe_pid == stripe_pid)
+            # Row lock: the hold sweeper must not cancel it mid-transition
+            result = await session.execute(
+                select(models.Order).where(models.Order.stripe_pid == stripe_pid).with_for_update()
+            )
+            order = result.scalars().first()
+
+            if not order:
+                # Usually create-intent hasn't stored the PID yet; retried later
+                raise LookupError(f"Order not found for PID: {stripe_pid}")
+
+            if order.status == models.OrderStatus.PAID:
+                # A retry or a second event for the same intent: the email
+                # went out with the transition, so sending again would duplicate it
+                print(f"Order {order.id} already PAID; skipping confirmation.")
+                return
+
+            hold_expired = order.status == models.OrderStatus.CANCELLED
+            order.status = models.OrderStatus.PAID
+            order.reserved_until = None
+            await session.commit()
+            print(f"Order {order.id} marked as PAID.")
+            if hold_expired:
+                await reclaim_stock(session, order)
+
+            target_email = order.customer_email or receipt_email
+            if target_email:
+                print(f"Dispatching email to {target_email}...")
+                await email_service.send_order_confirmation(
+                    target_email,
+                    order.id,
+                    order.total_cents
                 )
-                order = result.scalars().first()
-
-                if order:
-                    if order.status != models.OrderStatus.PAID:
-                        order.status = models.OrderStatus.PAID
-                        await session.commit()
-                        print(f"Order {order.id} marked as PAID.")
-
-                    target_email = order.customer_email or receipt_email
-                    if target_email:
-                        print(f"Dispatching email to {target_email}...")
-                        await email_service.send_order_confirmation(
-                            target_email,
-                            order.id,
-                            order.total_cents
-                        )
-                    else:
-                        print("No email found for order confirmation.")
-                else:
-                    print(f"Order not found for PID: {stripe_pid}")
-            except Exception as e:
-                print(f"Webhook Processing Error: {e}")
+            else:
+                print("No email found for order confirmation.")
+
+async def reclaim_stock(session: AsyncSession, order: models.Order):
+    """Paid after the hold expired: take the units again if they're still there."""
+    try:
+        await inventory.reserve_stock(session, inventory.order_lines(order))
+        await session.commit()
+    except HTTPException as e:
+        print(f"WARNING: Order {order.id} paid after its stock hold expired and could not be re-reserved: {e.detail}")
 
 @app.post("/api/webhooks/stripe")
-async def stripe_webhook(request: Request, background_tasks: BackgroundTasks):
+async def stripe_webhook(request: Request, db: AsyncSession = Depends(get_db)):
+    # Only used to verify signatures; loaded with the first webhook, not at startup
+    import stripe
+
     payload = await request.body()
     sig_header = request.headers.get("Stripe-Signature")
     webhook_secret = os.getenv("STRIPE_WEBHOOK_SECRET")
@@ -354,7 +435,8 @@ async def stripe_webhook(request: Request, background_tasks: BackgroundTasks):
     except stripe.error.SignatureVerificationError:
         raise HTTPException(status_code=400, detail="Invalid signature")
 
-    background_tasks.add_task(process_stripe_event, event)
+    # Durable and deduplicated by event id; the webhook workers process it
+    await webhooks.enqueue_event(db, {"id": event["id"], "type": event["type"]}, payload.decode("utf-8"))
     return {"status": "success"}
 
 # --- DEBUG ENDPOINTS (MOCK FLOW) ---
@@ -378,10 +460,10 @@ async def simulate_payment(request: SimulatePaymentRequest, background_tasks: Ba
     import uuid
     order_id = str(uuid.uuid4())
 
-    # 2. Generate PDF
+    # 2. Generate PDF (in the process pool, off the event loop)
     # Convert CartItems to dicts for simple PDF generator if needed, or pass as is if PDF supports it.
     # We kept PDF simple.
-    pdf_bytes = pdf_service.generate_receipt_pdf(
+    pdf_bytes = await pdf_service.render_receipt(
         order_id,
         [item.dict() for item in request.items],
         request.total_cents,
@@ -404,24 +486,105 @@ async def simulate_payment(request: SimulatePaymentRequest, background_tasks: Ba
 # --- ADMIN ROUTES ---
 
 @app.get("/api/v1/admin/orders", response_model=List[OrderSchema])
-async def get_admin_orders(db: AsyncSession = Depends(get_db)):
+async def get_admin_orders(db: AsyncSession = Depends(get_read_db)):
     result = await db.execute(select(models.Order).order_by(models.Order.created_at.desc()))
     return result.scalars().all()
 
+@app.get("/api/v1/admin/orders/{order_id}/receipt")
+async def get_order_receipt(order_id: str, db: AsyncSession = Depends(get_read_db)):
+    order = await db.get(models.Order, order_id)
+    if not order:
+        raise HTTPException(status_code=404, detail="Order not found")
+    items = await orders.receipt_items(db, order)
+    pdf_bytes = await pdf_service.render_receipt(
+        order.id, items, order.total_cents or 0, order.created_at, order.customer_email or ""
+    )
+    return Response(
+        content=pdf_bytes,
+        media_type="application/pdf",
+        headers={"Content-Disposition": f'attachment; filename="Receipt_{order.id[-8:].upper()}.pdf"'},
+    )
+
 @app.put("/api/v1/admin/orders/{order_id}", response_model=OrderSchema)
 async def update_order(order_id: str, order_data: OrderUpdateSchema, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(models.Order).where(models.Order.id == order_id))
+    result = await db.execute(select(models.Order).where(models.Order.id == order_id).with_for_update())
     order = result.scalars().first()
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
+    # Cancelling an order that still holds stock puts the units back
+    if order.status in inventory.HOLD_STATUSES and order_data.status == models.OrderStatus.CANCELLED:
+        await inventory.release_stock(db, inventory.order_lines(order))
+    if order_data.status not in inventory.HOLD_STATUSES:
+        order.reserved_until = None
     order.status = order_data.status
     await db.commit()
     await db.refresh(order)
     return order
 
+@app.get("/api/v1/admin/reports/sales", response_model=List[ProductSalesSchema])
+async def get_sales_report(
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_read_db)
+):
+    return await reports.sales_by_product_service(db, since, until)
+
+@app.get("/api/v1/admin/reports/stock", response_model=List[StockReconciliationSchema])
+async def get_stock_report(db: AsyncSession = Depends(get_read_db)):
+    return await reports.stock_reconciliation_service(db)
+
+@app.get("/api/v1/admin/webhooks/dead", response_model=List[WebhookEventSchema])
+async def get_dead_webhooks(db: AsyncSession = Depends(get_db)):
+    return await webhooks.list_dead_events(db)
+
+@app.post("/api/v1/admin/webhooks/{event_id}/retry")
+async def retry_webhook(event_id: str, db: AsyncSession = Depends(get_db)):
+    if not await webhooks.requeue_event(db, event_id):
+        raise HTTPException(status_code=404, detail="Dead-lettered event not found")
+    return {"status": "queued", "id": event_id}
+
+@app.get("/api/v1/admin/exports/receipts")
+async def export_receipts(since: datetime, until: datetime):
+    """Every sold order's receipt created in [since, until), streamed as a ZIP."""
+    if until <= since:
+        raise HTTPException(status_code=400, detail="until must be after since")
+    filename = f"receipts_{since:%Y%m%d}-{until:%Y%m%d}.zip"
+    return StreamingResponse(
+        reports.receipts_zip(ReadSessionLocal, since, until),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+@app.get("/api/v1/admin/products/export")
+async def export_products(format: str = Query("csv", pattern="^(csv|ndjson)$")):
+    """The whole catalog, streamed a page at a time."""
+    return StreamingResponse(
+        product_io.export_products(ReadSessionLocal, format),
+        media_type=product_io.FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="products.{format}"'},
+    )
+
+@app.post("/api/v1/admin/products/import")
+async def import_products(
+    request: Request,
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    dry_run: bool = False,
+):
+    """
+    Upserts products from a CSV or NDJSON body (columns as in inventory.csv;
+    only `id` is required for existing products). Parsed as it arrives and
+    written in chunks; returns what was created, updated and rejected.
+    """
+    try:
+        return await product_io.import_products(
+            AsyncSessionLocal, product_io.records(request.stream(), format), dry_run=dry_run
+        )
+    except product_io.RecordError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.get("/api/v1/admin/leads", response_model=List[LeadSchema])
-async def get_admin_leads(db: AsyncSession = Depends(get_db)):
+async def get_admin_leads(db: AsyncSession = Depends(get_read_db)):
     result = await db.execute(select(models.Lead).order_by(models.Lead.created_at.desc()))
     return result.scalars().all()
 
@@ -454,18 +617,53 @@ async def create_lead(lead: LeadCreateSchema, db: AsyncSession = Depends(get_db)
 # --- PRODUCT ROUTES ---
 
 @app.get("/api/v1/products", response_model=List[ProductSchema])
-@cache_response(ttl=60, key_prefix="products")
+@cache_response(
+    ttl=60,
+    stale_ttl=30,
+    key_prefix="products",
+    normalize={"q": str.lower},
+    l1=True,
+    response_model=List[ProductSchema],
+)
 async def get_products(
     q: Optional[str] = None,
-    category: Optional[str] = None,
+    category: Optional[List[str]] = Query(None),
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    btu_band: Optional[List[str]] = Query(None),
+    voltage: Optional[List[str]] = Query(None),
+    price_band: Optional[List[str]] = Query(None),
+    db: AsyncSession = Depends(get_read_db)
+):
+    return await catalog.get_products_service(
+        db, q, category, min_price, max_price, btu_band, voltage, price_band
+    )
+
+@app.get("/api/v1/products/search", response_model=ProductSearchResult)
+@cache_response(
+    ttl=60,
+    stale_ttl=30,
+    key_prefix="products",
+    normalize={"q": str.lower},
+    l1=True,
+    response_model=ProductSearchResult,
+)
+async def search_products(
+    q: Optional[str] = None,
+    category: Optional[List[str]] = Query(None),
+    btu_band: Optional[List[str]] = Query(None),
+    voltage: Optional[List[str]] = Query(None),
+    price_band: Optional[List[str]] = Query(None),
     min_price: Optional[float] = None,
     max_price: Optional[float] = None,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
-    return await catalog.get_products_service(db, q, category, min_price, max_price)
+    return await catalog.search_products_service(
+        db, q, category, btu_band, voltage, price_band, min_price, max_price
+    )
 
 @app.get("/api/v1/products/{product_id}", response_model=ProductSchema)
-async def get_product(product_id: int, db: AsyncSession = Depends(get_db)):
+async def get_product(product_id: int, db: AsyncSession = Depends(get_read_db)):
     query = select(models.Product).where(models.Product.id == product_id)
     result = await db.execute(query)
     product = result.scalar_one_or_none()
@@ -476,7 +674,7 @@ async def get_product(product_id: int, db: AsyncSession = Depends(get_db)):
 @app.post("/api/v1/products", response_model=ProductSchema)
 async def create_product(product: ProductCreateSchema, db: AsyncSession = Depends(get_db)):
     result = await catalog.create_product_service(db, product.dict())
-    await invalidate_cache("products:*")
+    await invalidate_cache("products")
     return result
 
 @app.put("/api/v1/products/{product_id}", response_model=ProductSchema)
@@ -484,7 +682,7 @@ async def update_product(product_id: int, product: ProductUpdateSchema, db: Asyn
     updated_product = await catalog.update_product_service(db, product_id, product.dict(exclude_unset=True))
     if not updated_product:
         raise HTTPException(status_code=404, detail="Product not found")
-    await invalidate_cache("products:*")
+    await invalidate_cache("products")
     return updated_product
 
 @app.delete("/api/v1/products/{product_id}")
@@ -492,7 +690,7 @@ async def delete_product(product_id: int, db: AsyncSession = Depends(get_db)):
     success = await catalog.delete_product_service(db, product_id)
     if not success:
         raise HTTPException(status_code=404, detail="Product not found")
-    await invalidate_cache("products:*")
+    await invalidate_cache("products")
     return {"status": "success", "message": "Product deleted"}
 
 @app.get("/api/v1/warranties", response_model=WarrantyMatrix)
@@ -510,3 +708,6 @@ async def get_warranties():
         },
         company_workmanship="1 Year on all installs"
     )
+
+# Everything above, including the route modules imported along the way
+bootstrap.record_startup("import", started_at=STARTED_AT)
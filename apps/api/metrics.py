@@ -0,0 +1,258 @@
+from contextvars import ContextVar
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import event
+from starlette.routing import Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+import math
+import time
+import weakref
+
+# In-process metrics for GET /metrics, in the Prometheus text format. Like the
+# other stats in this codebase they live in this worker's memory: with several
+# uvicorn workers each one is scraped (and counted) separately.
+#
+# Recorded as things happen: request latency per route template, SQL
+# statements and the SQL time of each request, and the wait for a pooled
+# connection. Everything else (cache, email, webhooks, payments, PDFs,
+# startup) is read from the existing stats dicts at scrape time.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 10.0)
+POOL_WAIT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0, 30.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+Labels = Tuple[str, ...]
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_labels(self.labels, labels)} {_number(value)}")
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Iterable[str] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = buckets
+        # labels -> [count per bucket (the last is +Inf), sum]
+        self.values: Dict[Labels, list] = {}
+
+    def observe(self, value: float, *labels: str):
+        series = self.values.get(labels)
+        if series is None:
+            series = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][i] += 1
+                break
+        else:
+            series[0][-1] += 1
+        series[1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = "+Inf" if bound == math.inf else _number(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.labels + ('le',), labels + (le,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labels, labels)} {cumulative}")
+        return lines
+
+def _number(value) -> str:
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: Labels, values: Labels) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+http_requests = Counter("http_requests_total", "Requests by route template and status.", ("method", "route", "status"))
+http_latency = Histogram("http_request_duration_seconds", "Request latency by route template, until the response is sent.", ("method", "route"))
+db_statements = Histogram("db_statement_duration_seconds", "Duration of each SQL statement.", ("engine", "operation"))
+db_request_queries = Histogram("db_request_queries", "SQL statements run by one request.", ("method", "route"), QUERY_COUNT_BUCKETS)
+db_request_seconds = Histogram("db_request_query_seconds", "Time one request spent in SQL statements.", ("method", "route"))
+db_pool_wait = Histogram("db_pool_checkout_seconds", "Wait for a pooled connection (includes connecting and pre-ping).", ("engine",), POOL_WAIT_BUCKETS)
+
+# [statements, seconds] for the current request; None outside a request
+_request_sql: ContextVar[Optional[list]] = ContextVar("request_sql", default=None)
+
+# --- SQLAlchemy hooks ---
+
+_instrumented = weakref.WeakSet()
+
+def instrument_engine(engine, name: str):
+    """Times statements and pool checkouts of an AsyncEngine (see database.py)."""
+    sync_engine = engine.sync_engine
+    if sync_engine in _instrumented:
+        return
+    _instrumented.add(sync_engine)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["metrics_started"].pop()
+        words = statement.split(None, 1)
+        db_statements.observe(elapsed, name, words[0].upper() if words else "")
+        totals = _request_sql.get()
+        if totals is not None:
+            totals[0] += 1
+            totals[1] += elapsed
+
+    # Engine.connect() checks out through raw_connection(); the pool itself
+    # has no event for "started waiting", and is replaced by dispose()
+    raw_connection = sync_engine.raw_connection
+
+    def timed_raw_connection():
+        started = time.perf_counter()
+        try:
+            return raw_connection()
+        finally:
+            db_pool_wait.observe(time.perf_counter() - started, name)
+
+    sync_engine.raw_connection = timed_raw_connection
+
+# --- Requests ---
+
+def route_template(app, scope: Scope) -> str:
+    """
+    The matched route's path template ("/api/v1/products/{product_id}"), so
+    labels stay bounded. Requests answered before routing (304s, chaos) are
+    matched here; anything else is "unmatched".
+    """
+    route = scope.get("route")
+    if route is not None:
+        return getattr(route, "path", "unmatched")
+    router = getattr(app, "router", None)
+    for candidate in getattr(router, "routes", ()):
+        match, _ = candidate.matches(scope)
+        if match == Match.FULL:
+            return getattr(candidate, "path", "unmatched")
+    return "unmatched"
+
+class MetricsMiddleware:
+    """Latency, status and SQL totals per request. Pure ASGI, added outermost."""
+    def __init__(self, app: ASGIApp, root=None):
+        self.app = app
+        self.root = root # The FastAPI app, for route templates of unrouted requests
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        totals = [0, 0.0]
+        token = _request_sql.set(totals)
+        status = "500"
+
+        async def send_with_status(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _request_sql.reset(token)
+            method = scope["method"]
+            route = route_template(self.root, scope)
+            http_requests.inc(method, route, status)
+            http_latency.observe(time.perf_counter() - started, method, route)
+            db_request_queries.observe(totals[0], method, route)
+            db_request_seconds.observe(totals[1], method, route)
+
+# --- Exposition ---
+
+def _gauges(name: str, help: str, values: Dict[str, float], label: str) -> List[str]:
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} gauge"]
+    for key, value in sorted(values.items()):
+        lines.append(f"{name}{_labels((label,), (key,))} {_number(value)}")
+    return lines
+
+def _gauge(name: str, help: str, value) -> List[str]:
+    return [f"# HELP {name} {help}", f"# TYPE {name} gauge", f"{name} {_number(value)}"]
+
+def _counter(name: str, help: str, value) -> List[str]:
+    return [f"# HELP {name} {help}", f"# TYPE {name} counter", f"{name} {_number(value)}"]
+
+def _counters(name: str, help: str, values: Dict[str, float], label: str) -> List[str]:
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} counter"]
+    for key, value in sorted(values.items()):
+        lines.append(f"{name}{_labels((label,), (key,))} {_number(value)}")
+    return lines
+
+def _numeric(stats: dict, keys: Iterable[str]) -> Dict[str, float]:
+    return {key: stats[key] for key in keys if isinstance(stats.get(key), (int, float))}
+
+def render(
+    cache: dict, pools: dict, email: dict, webhooks: Optional[dict],
+    payments: dict, pdf: dict, startup: dict,
+) -> str:
+    """
+    The Prometheus exposition: the recorded histograms, then the stats the
+    health endpoints report, as counters (monotonic) and gauges.
+    """
+    lines: List[str] = []
+    for metric in (http_requests, http_latency, db_statements, db_request_queries, db_request_seconds, db_pool_wait):
+        lines += metric.render()
+
+    for key, help in (("size", "Pool size."), ("checkedout", "Connections in use."), ("overflow", "Connections beyond the pool size."), ("checkedin", "Idle pooled connections.")):
+        lines += _gauges(f"db_pool_{key}", help, {name: pool[key] for name, pool in pools["pools"].items() if key in pool}, "engine")
+    lines += _counters("db_sessions_total", "Sessions opened per route template.",
+                       {route: counts["sessions"] for route, counts in pools["routes"].items()}, "route")
+    lines += _counters("db_checkouts_total", "Connections checked out of the pool, per route template.",
+                       {route: counts["checkouts"] for route, counts in pools["routes"].items()}, "route")
+
+    lines += _counters("cache_events_total", "Response cache lookups and errors by outcome.",
+                       _numeric(cache, ("hits", "stale_hits", "misses", "errors", "bypassed", "coalesced", "refreshes")), "event")
+    lines += _counter("cache_l1_hits_total", "Hits served from the in-process cache (included in hits).", cache["l1_hits"])
+    lines += _gauge("cache_hit_ratio", "Hits (fresh or stale) over all lookups since start.", cache["hit_ratio"])
+    lines += _gauge("cache_l1_entries", "Entries in the in-process cache.", cache["l1_entries"])
+
+    lines += _counters("email_messages_total", "Messages by outcome.", _numeric(email, ("queued", "sent", "failed", "retried")), "outcome")
+    lines += _gauge("email_queue_depth", "Batches waiting for a sender.", email["queue_depth"])
+    lines += _gauge("email_queue_max_depth", "Deepest the queue has been since start.", email["max_queue_depth"])
+    lines += _gauge("email_senders", "Sender tasks (one SMTP connection each).", email["workers"])
+    lines += _counter("email_connections_opened_total", "SMTP sessions opened.", email["connections_opened"])
+
+    if webhooks is not None:
+        lines += _gauges("webhook_inbox_events", "Inbox rows by status (shared by all workers).", webhooks["queue"], "status")
+        lines += _gauge("webhook_workers", "Webhook worker tasks in this process.", webhooks["workers"])
+        lines += _counters("webhook_events_total", "Webhook events by outcome in this process.",
+                           _numeric(webhooks, ("enqueued", "duplicates", "processed", "retried", "dead")), "outcome")
+
+    lines += _counters("payments_calls_total", "Payments API calls by outcome.",
+                       _numeric(payments, ("calls", "failures", "rejected", "fast_failed")), "outcome")
+    lines += _gauges("payments_breaker_state", "1 for the circuit breaker's current state.",
+                     {state: int(payments["breaker"] == state) for state in ("closed", "open", "half-open")}, "state")
+
+    lines += _counters("pdf_receipts_total", "Receipts by outcome.", _numeric(pdf, ("rendered", "cache_hits", "failed")), "outcome")
+    lines += _gauge("pdf_cached_receipts", "Receipts in the render cache.", pdf["cached"])
+
+    lines += _gauges("startup_seconds", "Worker boot timings, in seconds since main.py started importing.",
+                     {key.removesuffix("_seconds"): value for key, value in _numeric(startup, ("import_seconds", "startup_seconds", "first_request_seconds")).items()}, "phase")
+    return "\n".join(lines) + "\n"
@@ -2,55 +2,187 @@ import os
 import random
 import asyncio
 import re
+import time
+import hashlib
 import logging
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.responses import Response
-from starlette.requests import Request
+from typing import Dict, Optional, Tuple
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from cache import get_catalog_version
 
 # Configure basic logger
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("api")
 
-SENSITIVE_PATTERNS = [
-    (r'(email=)([^&]+)', r'\1[REDACTED]'),
-    (r'(password=)([^&]+)', r'\1[REDACTED]'),
-    (r'(token=)([^&]+)', r'\1[REDACTED]'),
-    (r'(phone=)([^&]+)', r'\1[REDACTED]'),
-    (r'(card_number=)([^&]+)', r'\1[REDACTED]'),
-    (r'(cvc=)([^&]+)', r'\1[REDACTED]'),
-]
+# Pure-ASGI middleware: no per-request task or stream wrapping (unlike
+# BaseHTTPMiddleware). Configuration is read once in install_middleware.
+
+SENSITIVE_KEYS = ["email", "password", "token", "phone", "card_number", "cvc"]
+# One pass over the query string instead of one re.sub per key
+SENSITIVE_PATTERN = re.compile(
+    r"((?:" + "|".join(SENSITIVE_KEYS) + r")=)([^&]+)", re.IGNORECASE
+)
 
-class LogSanitizerMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        # 1. Log Request (Sanitized)
-        raw_query = request.url.query
-        sanitized_query = raw_query
-        for pattern, replacement in SENSITIVE_PATTERNS:
-            sanitized_query = re.sub(pattern, replacement, sanitized_query, flags=re.IGNORECASE)
+def sanitize_query(query: str) -> str:
+    return SENSITIVE_PATTERN.sub(r"\1[REDACTED]", query) if query else query
 
-        # Note: We don't read body here to avoid consuming stream.
-        # For full body sanitization, we'd need a more complex wrapper.
-        # This covers URL params which are often leaked.
+class LogSanitizerMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
 
-        logger.info(f"{request.method} {request.url.path}?{sanitized_query}")
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] == "http" and logger.isEnabledFor(logging.INFO):
+            # Note: We don't read body here to avoid consuming stream.
+            # This covers URL params which are often leaked.
+            query = sanitize_query(scope["query_string"].decode("latin-1"))
+            logger.info("%s %s?%s", scope["method"], scope["path"], query)
+        await self.app(scope, receive, send)
 
-        response = await call_next(request)
-        return response
+class ChaosMiddleware:
+    """Only installed when CHAOS_MODE=true, so normal runs pay nothing for it."""
+    def __init__(self, app: ASGIApp, failure_rate: float = 0.1, latency: float = 0.5):
+        self.app = app
+        self.failure_rate = failure_rate
+        self.latency = latency
 
-class ChaosMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request, call_next):
-        if os.getenv("CHAOS_MODE", "false").lower() == "true":
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] == "http":
             # 10% chance of 500 Error
-            if random.random() < 0.1:
-                return Response("Chaos Monkey Strike!", status_code=500)
+            if random.random() < self.failure_rate:
+                await _send_response(send, 500, [(b"content-type", b"text/plain; charset=utf-8")], b"Chaos Monkey Strike!")
+                return
             # 500ms Latency
-            await asyncio.sleep(0.5)
-        response = await call_next(request)
-        return response
-
-class HeaderMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request, call_next):
-        response = await call_next(request)
-        # Stale-While-Revalidate Policy
-        response.headers["Cache-Control"] = "s-maxage=60, stale-while-revalidate=30"
-        return response
+            await asyncio.sleep(self.latency)
+        await self.app(scope, receive, send)
+
+# Per-route HTTP cache policies: (methods, path pattern, Cache-Control, ETag source).
+# First match wins. The policy covers 200 responses (and their 304s); anything
+# else, such as a 404 for a deleted product, gets ERROR_CACHE_CONTROL so a CDN
+# doesn't keep it. ETag sources:
+# - "catalog": a weak ETag derived from the catalog version, so a matching
+#   If-None-Match is answered with 304 before the route (and its DB work)
+#   runs. Weak because it isn't derived from the body: stock changes with
+#   every checkout without bumping the version.
+# - "body": hash of the response body, remembered per URL until restart
+#   (for static responses such as the warranty matrix).
+CATALOG_CACHE_CONTROL = "public, max-age=0, s-maxage=60, stale-while-revalidate=30"
+CACHE_POLICIES = [
+    ({"GET", "HEAD"}, re.compile(r"^/api/v1/products(/search)?$"), CATALOG_CACHE_CONTROL, "catalog"),
+    ({"GET", "HEAD"}, re.compile(r"^/api/v1/products/\d+$"), CATALOG_CACHE_CONTROL, "catalog"),
+    ({"GET", "HEAD"}, re.compile(r"^/api/v1/warranties$"), "public, max-age=3600, s-maxage=86400", "body"),
+    ({"GET", "HEAD"}, re.compile(r"^/api/v1/admin/"), "private, no-store", None),
+]
+DEFAULT_CACHE_CONTROL = "no-store"
+ERROR_CACHE_CONTROL = "no-store"
+
+# Catalog ETags also roll over every window, bounding how long a revalidated
+# response can hide changes that don't bump the version (e.g. stock levels)
+# to the staleness s-maxage already allows the CDN.
+CATALOG_ETAG_WINDOW = 60
+
+_body_etags: Dict[str, str] = {}
+
+def match_cache_policy(method: str, path: str) -> Tuple[str, Optional[str]]:
+    for methods, pattern, cache_control, etag_source in CACHE_POLICIES:
+        if method in methods and pattern.match(path):
+            return cache_control, etag_source
+    return DEFAULT_CACHE_CONTROL, None
+
+def make_etag(*parts, weak: bool = False) -> str:
+    digest = hashlib.sha1("|".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+    return f'{"W/" if weak else ""}"{digest[:24]}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Weak comparison, as RFC 9110 specifies for If-None-Match. `*` never
+    matches: these 304s are sent before the route has confirmed that the
+    resource exists, so only a tag from an earlier 200 counts.
+    """
+    if not if_none_match:
+        return False
+    candidates = (tag.strip() for tag in if_none_match.split(","))
+    return any(tag.removeprefix("W/") == etag.removeprefix("W/") for tag in candidates)
+
+async def _send_response(send: Send, status: int, headers: list, body: bytes = b""):
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+class HeaderMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        cache_control, etag_source = match_cache_policy(scope["method"], scope["path"])
+        url = f"{scope['path']}?{scope['query_string'].decode('latin-1')}"
+
+        etag = None
+        if etag_source == "catalog":
+            version = await get_catalog_version()
+            if version is not None:
+                window = int(time.time() // CATALOG_ETAG_WINDOW)
+                etag = make_etag("catalog", version, window, url, weak=True)
+        elif etag_source == "body":
+            etag = _body_etags.get(url)
+
+        if etag and etag_matches(Headers(scope=scope).get("if-none-match"), etag):
+            await _send_response(send, 304, [
+                (b"etag", etag.encode("latin-1")),
+                (b"cache-control", cache_control.encode("latin-1")),
+            ])
+            return
+
+        if etag_source == "body" and etag is None:
+            await self._send_with_body_etag(scope, receive, send, url, cache_control)
+            return
+
+        async def send_with_headers(message: Message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                if etag and message["status"] == 200:
+                    headers["ETag"] = etag
+                headers["Cache-Control"] = cache_control if message["status"] == 200 else ERROR_CACHE_CONTROL
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
+
+    async def _send_with_body_etag(self, scope: Scope, receive: Receive, send: Send, url: str, cache_control: str):
+        """Buffer a (small, static) response once to hash its body into an ETag."""
+        start: Optional[Message] = None
+        chunks = []
+
+        async def buffer(message: Message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+            chunks.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+
+            body = b"".join(chunks)
+            headers = MutableHeaders(scope=start)
+            if start["status"] == 200:
+                etag = _body_etags[url] = make_etag("body", hashlib.sha1(body).hexdigest())
+                headers["ETag"] = etag
+            headers["Cache-Control"] = cache_control if start["status"] == 200 else ERROR_CACHE_CONTROL
+            await send(start)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, buffer)
+
+def install_middleware(app):
+    """
+    Compose the request pipeline (outermost first): cache headers, chaos,
+    sanitized access log. Chaos is only added when CHAOS_MODE=true at startup.
+    """
+    app.add_middleware(LogSanitizerMiddleware)
+    if os.getenv("CHAOS_MODE", "false").lower() == "true":
+        app.add_middleware(ChaosMiddleware)
+    app.add_middleware(HeaderMiddleware)
@@ -0,0 +1,249 @@
+from sqlalchemy import inspect, insert, select, exists, text
+from sqlalchemy.exc import DBAPIError
+from typing import Awaitable, Callable, List, NamedTuple, Optional
+import asyncio
+import json
+import os
+from database import Base
+import models
+from domain.catalog import SEARCH_DOCUMENT_SQL
+
+# Ordered schema migrations, recorded in schema_version. Run with migrate.py
+# (the API container does before uvicorn starts), or by bootstrap.ensure_schema
+# when a worker finds the database behind.
+#
+# Every operation is idempotent and holds its locks briefly, so a migration
+# that failed halfway is simply run again, and live traffic keeps flowing:
+# - DDL runs in short transactions with lock_timeout, retried if it can't
+#   get its lock quickly (instead of queueing every query behind it)
+# - Postgres indexes are built with CREATE INDEX CONCURRENTLY, outside a
+#   transaction; an invalid leftover from a failed build is dropped first
+# - Backfills go in batches, one transaction each
+
+# pg_advisory_lock key: one runner at a time across workers and deploys
+SCHEMA_LOCK_KEY = 0x41484143
+LOCK_POLL_SECONDS = 2
+DDL_LOCK_TIMEOUT = os.getenv("MIGRATION_LOCK_TIMEOUT", "5s")
+DDL_ATTEMPTS = int(os.getenv("MIGRATION_DDL_ATTEMPTS", "5"))
+BACKFILL_BATCH = 500
+
+class Migrator:
+    """The operations a migration can use, against either Postgres or SQLite."""
+    def __init__(self, engine, log: Callable[[str], None] = print):
+        self.engine = engine
+        self.log = log
+        self.postgres = engine.dialect.name == "postgresql"
+
+    async def ddl(self, sql: str, postgres_only: bool = False):
+        """One statement in its own transaction, retried on lock timeout."""
+        if postgres_only and not self.postgres:
+            return
+        for attempt in range(1, DDL_ATTEMPTS + 1):
+            try:
+                async with self.engine.begin() as conn:
+                    if self.postgres:
+                        await conn.execute(text(f"SET LOCAL lock_timeout = '{DDL_LOCK_TIMEOUT}'"))
+                    await conn.execute(text(sql))
+                return
+            except DBAPIError as e:
+                if not _is_lock_timeout(e) or attempt == DDL_ATTEMPTS:
+                    raise
+                self.log(f"  lock busy, retrying ({attempt}/{DDL_ATTEMPTS - 1})...")
+                await asyncio.sleep(attempt)
+
+    async def columns(self, table: str) -> List[str]:
+        async with self.engine.connect() as conn:
+            return await conn.run_sync(lambda sync: [c["name"] for c in inspect(sync).get_columns(table)])
+
+    async def add_column(self, table: str, column: str, definition: str):
+        # Nullable, or with a constant default: a catalog-only change on Postgres 11+, no rewrite
+        if column not in await self.columns(table):
+            self.log(f"  adding {table}.{column}")
+            await self.ddl(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+    async def create_index(self, name: str, table: str, definition: str, using: str = None, postgres_only: bool = False):
+        """CREATE INDEX CONCURRENTLY on Postgres: writes continue while it builds."""
+        using_sql = f" USING {using}" if using else ""
+        if not self.postgres:
+            if not postgres_only:
+                async with self.engine.begin() as conn:
+                    await conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table}{using_sql} ({definition})"))
+            return
+        async with self.engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            valid = (await conn.execute(text(
+                "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name"
+            ), {"name": name})).scalar()
+            if valid:
+                return
+            if valid is False:
+                self.log(f"  dropping invalid index {name} from an interrupted build")
+                await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+            self.log(f"  building index {name} concurrently")
+            await conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table}{using_sql} ({definition})"))
+
+def _is_lock_timeout(error: DBAPIError) -> bool:
+    return getattr(error.orig, "sqlstate", None) == "55P03" or "lock timeout" in str(error)
+
+# --- Migrations ---
+
+async def baseline(m: Migrator):
+    """Creates missing tables as models.py defines them (a new database gets everything here)."""
+    async with m.engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+async def legacy_columns(m: Migrator):
+    """Formerly migrate_v2.py, migrate_email.py and migrate_level2.py."""
+    await m.add_column("products", "image_url", "VARCHAR")
+    await m.add_column("orders", "customer_email", "VARCHAR")
+    await m.add_column("orders", "items_json", "VARCHAR")
+    await m.add_column("leads", "status", "VARCHAR DEFAULT 'NEW'")
+
+async def stock_holds(m: Migrator):
+    """Formerly migrate_reservations.py."""
+    await m.add_column("orders", "reserved_until", "TIMESTAMP")
+    await m.create_index("ix_orders_reserved_until", "orders", "reserved_until")
+    # NOT VALID: only new writes are checked, so no scan under the lock
+    await m.ddl("""
+        DO $$ BEGIN
+            ALTER TABLE products ADD CONSTRAINT ck_products_stock_nonnegative CHECK (stock >= 0) NOT VALID;
+        EXCEPTION WHEN duplicate_object THEN NULL;
+        END $$
+    """, postgres_only=True)
+
+async def search_indexes(m: Migrator):
+    """
+    Formerly migrate_search.py. The expressions must match domain.catalog.SEARCH_DOCUMENT_SQL.
+    Where pg_trgm can't be installed (no privilege), search falls back to
+    unindexed substring matches until it is installed and the index created.
+    """
+    try:
+        await m.ddl("CREATE EXTENSION IF NOT EXISTS pg_trgm", postgres_only=True)
+        trigram = True
+    except DBAPIError as e:
+        m.log(f"  pg_trgm unavailable, skipping its index: {e.orig}")
+        trigram = False
+    if trigram:
+        await m.create_index("ix_products_search_trgm", "products", f"({SEARCH_DOCUMENT_SQL}) gin_trgm_ops", using="gin", postgres_only=True)
+    await m.create_index("ix_products_search_tsv", "products", f"to_tsvector('simple', {SEARCH_DOCUMENT_SQL})", using="gin", postgres_only=True)
+
+def order_item_rows(order_id: str, items_json: str) -> list:
+    rows = []
+    for item in json.loads(items_json):
+        rows.append({
+            "order_id": order_id,
+            "product_id": int(item["product_id"]),
+            "name": item.get("name"),
+            "category": item.get("category"),
+            "quantity": int(item.get("quantity", 1)),
+            "unit_price": None, # items_json never recorded the checkout price
+        })
+    return rows
+
+async def backfill_order_items(m: Migrator):
+    """
+    Formerly backfill_order_items.py: fills order_items from orders.items_json
+    for orders written before line items were persisted, in batches.
+    """
+    async with m.engine.begin() as conn:
+        await conn.run_sync(models.OrderItem.__table__.create, checkfirst=True)
+
+    order = models.Order
+    item = models.OrderItem
+    last_id, orders_done, items_done = "", 0, 0
+    while True:
+        async with m.engine.begin() as conn:
+            pending = (await conn.execute(
+                select(order.id, order.items_json)
+                .where(
+                    order.id > last_id,
+                    order.items_json.is_not(None),
+                    ~exists().where(item.order_id == order.id),
+                )
+                .order_by(order.id)
+                .limit(BACKFILL_BATCH)
+            )).all()
+            if not pending:
+                break
+
+            rows = []
+            for order_id, items_json in pending:
+                try:
+                    rows.extend(order_item_rows(order_id, items_json))
+                except (ValueError, KeyError, TypeError) as e:
+                    m.log(f"  skipping order {order_id}: unreadable items_json ({e})")
+            if rows:
+                await conn.execute(insert(item), rows)
+
+        last_id = pending[-1].id
+        orders_done += len(pending)
+        items_done += len(rows)
+        m.log(f"  backfilled {orders_done} orders ({items_done} items)")
+
+async def lookup_indexes(m: Migrator):
+    """Webhook lookups by stripe_pid, admin listings by date and status, customer lookups."""
+    await m.create_index("ix_orders_stripe_pid", "orders", "stripe_pid")
+    await m.create_index("ix_orders_created_at", "orders", "created_at")
+    await m.create_index("ix_orders_status_created_at", "orders", "status, created_at")
+    await m.create_index("ix_orders_customer_email", "orders", "customer_email")
+    await m.create_index("ix_leads_created_at", "leads", "created_at")
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    apply: Callable[[Migrator], Awaitable[None]]
+
+# Append only; never renumber or edit one that has shipped
+MIGRATIONS = [
+    Migration(1, "baseline", baseline),
+    Migration(2, "legacy_columns", legacy_columns),
+    Migration(3, "stock_holds", stock_holds),
+    Migration(4, "search_indexes", search_indexes),
+    Migration(5, "backfill_order_items", backfill_order_items),
+    Migration(6, "lookup_indexes", lookup_indexes),
+]
+LATEST_VERSION = MIGRATIONS[-1].version
+
+# --- Runner ---
+
+async def applied_versions(engine) -> set:
+    async with engine.connect() as conn:
+        has_table = await conn.run_sync(lambda sync: inspect(sync).has_table(models.SchemaVersion.__tablename__))
+        if not has_table:
+            return set()
+        return set((await conn.execute(select(models.SchemaVersion.version))).scalars())
+
+async def pending_migrations(engine) -> List[Migration]:
+    applied = await applied_versions(engine)
+    return [migration for migration in MIGRATIONS if migration.version not in applied]
+
+async def run_migrations(engine, target: Optional[int] = None, log: Callable[[str], None] = print) -> List[int]:
+    """
+    Applies pending migrations in order, up to `target` (default: all), and
+    records each one as it completes. Only one runner works at a time; the
+    others wait, then find nothing left to do. Returns the versions applied.
+    """
+    migrator = Migrator(engine, log)
+    async with engine.connect() as lock_conn:
+        if migrator.postgres:
+            # Session-level lock on an autocommit connection, polled rather
+            # than waited on: a backend blocked in pg_advisory_lock holds a
+            # snapshot, and CREATE INDEX CONCURRENTLY would wait for it forever
+            lock_conn = await lock_conn.execution_options(isolation_level="AUTOCOMMIT")
+            while not (await lock_conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": SCHEMA_LOCK_KEY})).scalar():
+                log("Waiting for another migration runner...")
+                await asyncio.sleep(LOCK_POLL_SECONDS)
+        try:
+            done = []
+            for migration in await pending_migrations(engine):
+                if target is not None and migration.version > target:
+                    break
+                log(f"Migration {migration.version} ({migration.name})...")
+                await migration.apply(migrator)
+                async with engine.begin() as conn:
+                    await conn.execute(insert(models.SchemaVersion).values(version=migration.version))
+                done.append(migration.version)
+            return done
+        finally:
+            if migrator.postgres:
+                await lock_conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": SCHEMA_LOCK_KEY})
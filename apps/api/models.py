@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Enum
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Enum, Index, LargeBinary, Text
 from sqlalchemy.orm import relationship
 import enum
 from database import Base
@@ -13,6 +13,12 @@ class OrderStatus(str, enum.Enum):
     DELIVERED = "DELIVERED"
     CANCELLED = "CANCELLED"
 
+class WebhookStatus(str, enum.Enum):
+    PENDING = "PENDING"
+    PROCESSING = "PROCESSING"
+    DONE = "DONE"
+    DEAD = "DEAD" # Gave up after WEBHOOK_MAX_ATTEMPTS; see last_error
+
 class LeadStatus(str, enum.Enum):
     NEW = "NEW"
     CONTACTED = "CONTACTED"
@@ -52,16 +58,66 @@ class Lead(Base):
     urgency = Column(String)
     notes = Column(String, nullable=True)
     status = Column(String, default=LeadStatus.NEW)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
 
 class Order(Base):
     __tablename__ = "orders"
+    # Admin listings and exports filter by status within a date range
+    __table_args__ = (Index("ix_orders_status_created_at", "status", "created_at"),)
 
     id = Column(String, primary_key=True, index=True) # UUID or Order #
     status = Column(String, default=OrderStatus.AWAIT_PAYMENT)
     total_cents = Column(Integer)
-    stripe_pid = Column(String, nullable=True)
-    customer_email = Column(String, nullable=True) # [NEW]
+    stripe_pid = Column(String, nullable=True, index=True) # Looked up by every payment webhook
+    customer_email = Column(String, nullable=True, index=True) # [NEW]
     items_json = Column(String, nullable=True) # Snapshots of products
     idempotency_key = Column(String, unique=True, index=True, nullable=True)
+    reserved_until = Column(DateTime, nullable=True, index=True) # Stock hold expiry (LOCK_STOCK / AWAIT_PAYMENT)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+class OrderItem(Base):
+    __tablename__ = "order_items"
+    # (product_id, order_id): per-product sales/holds are index range scans
+    __table_args__ = (Index("ix_order_items_product_order", "product_id", "order_id"),)
+
+    id = Column(Integer, primary_key=True)
+    order_id = Column(String, ForeignKey("orders.id", ondelete="CASCADE"), index=True, nullable=False)
+    product_id = Column(Integer, nullable=False) # No FK: sales history outlives deleted products
+    name = Column(String)
+    category = Column(String, nullable=True)
+    quantity = Column(Integer, nullable=False)
+    unit_price = Column(Integer, nullable=True) # Dollars at checkout; NULL for backfilled orders
+
+class IdempotencyRecord(Base):
+    """Fallback store for idempotency.py when Redis is unavailable."""
+    __tablename__ = "idempotency_keys"
+
+    key = Column(String, primary_key=True) # sha256 of method, path and Idempotency-Key
+    fingerprint = Column(String, nullable=False) # sha256 of the request itself
+    status_code = Column(Integer, nullable=True) # NULL while the first request is in flight
+    headers = Column(String, nullable=True) # JSON [[name, value], ...]
+    body = Column(LargeBinary, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+class WebhookEvent(Base):
+    """Durable inbox for provider webhooks, deduplicated by event id."""
+    __tablename__ = "webhook_events"
+    __table_args__ = (Index("ix_webhook_events_due", "status", "next_attempt_at"),)
+
+    id = Column(String, primary_key=True) # Provider event id (evt_...)
+    type = Column(String)
+    payload = Column(Text, nullable=False)
+    status = Column(String, default=WebhookStatus.PENDING, nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    locked_until = Column(DateTime, nullable=True) # Lease of the worker processing it
+    last_error = Column(String, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+    processed_at = Column(DateTime, nullable=True)
+
+class SchemaVersion(Base):
+    """Migrations applied to this database (see migrations.py)."""
+    __tablename__ = "schema_version"
+
+    version = Column(Integer, primary_key=True, autoincrement=False)
+    applied_at = Column(DateTime, default=datetime.utcnow)
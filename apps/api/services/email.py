@@ -1,53 +1,230 @@
-import smtplib
 import os
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+import random
 import logging
 from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, List, NamedTuple, Optional
 import asyncio
 
+# smtplib and email.mime are imported by the sender threads on first use,
+# not when the API starts
+if TYPE_CHECKING:
+    import smtplib
+
 # Gmail SMTP Config (since user provided Gmail credentials)
-SMTP_SERVER = "smtp.gmail.com"
-SMTP_PORT = 465 # SSL
+# (docker-compose passes these through, empty when unset on the host)
+SMTP_SERVER = os.getenv("SMTP_SERVER") or "smtp.gmail.com"
+SMTP_PORT = int(os.getenv("SMTP_PORT") or "465")
+SMTP_SSL = os.getenv("SMTP_SSL", "true").lower() in ("1", "true", "yes")
 SMTP_USER = os.getenv("SMTP_USER", "noreply@affordablehome-ac.com")
 SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT_SECONDS", "30"))
+# Without a password mail is only logged, unless SMTP_SERVER is set explicitly
+# (a local sink for load tests takes unauthenticated mail).
+MOCK_DELIVERY = not SMTP_PASSWORD and not os.getenv("SMTP_SERVER")
 
-logger = logging.getLogger("uvicorn.error")
+# Delivery queue: senders per API worker (one SMTP connection each), batches
+# waiting before send_order_confirmation blocks, and messages per session turn.
+EMAIL_WORKERS = int(os.getenv("EMAIL_WORKERS", "2"))
+EMAIL_QUEUE_SIZE = int(os.getenv("EMAIL_QUEUE_SIZE", "1000"))
+EMAIL_BATCH_SIZE = int(os.getenv("EMAIL_BATCH_SIZE", "50"))
+EMAIL_MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", "5"))
+EMAIL_RETRY_SECONDS = float(os.getenv("EMAIL_RETRY_SECONDS", "1"))
+# Connections idle this long are closed before the server drops them
+EMAIL_IDLE_SECONDS = float(os.getenv("EMAIL_IDLE_SECONDS", "60"))
+EMAIL_DRAIN_SECONDS = 10.0
 
-executor = ThreadPoolExecutor(max_workers=3)
+OWNER_EMAIL = "airperfection.itai@gmail.com"
+MOCK_CUSTOMER_EMAIL = "nativehawaiian808@gmail.com"
 
-from email.mime.application import MIMEApplication
+logger = logging.getLogger("uvicorn.error")
 
-def _send_sync(to_email: str, subject: str, html_content: str, attachment: dict = None):
-    if not SMTP_PASSWORD:
-        logger.warning(f"SMTP_PASSWORD not set. Mock email to {to_email}")
-        return
+class OutgoingEmail(NamedTuple):
+    to: str
+    subject: str
+    html: str
+    attachment: Optional[dict] = None
+
+def _render(email: OutgoingEmail) -> str:
+    from email.mime.text import MIMEText
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.application import MIMEApplication
 
     msg = MIMEMultipart()
     msg["From"] = f"Affordable Home A/C <{SMTP_USER}>"
-    msg["To"] = to_email
-    msg["Subject"] = subject
-    msg.attach(MIMEText(html_content, "html"))
+    msg["To"] = email.to
+    msg["Subject"] = email.subject
+    msg.attach(MIMEText(email.html, "html"))
 
-    if attachment:
-         part = MIMEApplication(attachment['content'], Name=attachment['filename'])
-         part['Content-Disposition'] = f'attachment; filename="{attachment["filename"]}"'
+    if email.attachment:
+         part = MIMEApplication(email.attachment['content'], Name=email.attachment['filename'])
+         part['Content-Disposition'] = f'attachment; filename="{email.attachment["filename"]}"'
          msg.attach(part)
+    return msg.as_string()
+
+def _is_permanent(error: Exception) -> bool:
+    """Rejected by the server (5xx) for this message; resending won't help."""
+    import smtplib
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+
+class SMTPConnection:
+    """
+    One authenticated SMTP session, opened on first use and kept for the
+    next batch. Only ever used from its sender's single thread.
+    """
+    def __init__(self):
+        self._smtp: Optional["smtplib.SMTP"] = None
+        self.opened = 0
+
+    def _session(self) -> "smtplib.SMTP":
+        if self._smtp is None:
+            import smtplib
+            print(f"DEBUG: Connecting to SMTP {SMTP_SERVER}:{SMTP_PORT}...")
+            smtp_class = smtplib.SMTP_SSL if SMTP_SSL else smtplib.SMTP
+            smtp = smtp_class(SMTP_SERVER, SMTP_PORT, timeout=SMTP_TIMEOUT)
+            try:
+                if SMTP_PASSWORD:
+                    smtp.login(SMTP_USER, SMTP_PASSWORD)
+            except Exception:
+                smtp.close()
+                raise
+            self._smtp = smtp
+            self.opened += 1
+        return self._smtp
+
+    def send_batch(self, emails: List[OutgoingEmail]):
+        """
+        Sends in order over the open session. Returns (sent, rejected, unsent,
+        error): if the connection fails midway, `unsent` is the rest of the
+        batch for the caller to retry on a fresh connection.
+        """
+        sent = rejected = 0
+        for i, email in enumerate(emails):
+            if MOCK_DELIVERY:
+                logger.warning(f"SMTP_PASSWORD not set. Mock email to {email.to}")
+                sent += 1
+                continue
+            try:
+                self._session().sendmail(SMTP_USER, email.to, _render(email))
+            except Exception as e:
+                if _is_permanent(e):
+                    logger.error(f"Failed to send email to {email.to}: {e}")
+                    rejected += 1
+                    continue
+                self.close()
+                return sent, rejected, emails[i:], e
+            sent += 1
+            logger.info(f"Email sent to {email.to}")
+        return sent, rejected, [], None
+
+    def close(self):
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except Exception:
+            self._smtp.close()
+        self._smtp = None
+
+email_stats = {"queued": 0, "sent": 0, "failed": 0, "retried": 0, "max_queue_depth": 0}
+
+_queue: Optional[asyncio.Queue] = None
+_senders: List[tuple] = []
 
+def retry_delay(attempt: int) -> float:
+    return random.uniform(0, min(EMAIL_RETRY_SECONDS * 2 ** (attempt - 1), 60.0))
+
+async def _deliver(connection: SMTPConnection, executor: ThreadPoolExecutor, emails: List[OutgoingEmail]):
+    loop = asyncio.get_running_loop()
+    pending = emails
+    for attempt in range(1, EMAIL_MAX_ATTEMPTS + 1):
+        sent, rejected, pending, error = await loop.run_in_executor(executor, connection.send_batch, pending)
+        email_stats["sent"] += sent
+        email_stats["failed"] += rejected
+        if not pending:
+            return
+        print(f"DEBUG: SMTP Failed (attempt {attempt}): {error}")
+        if attempt < EMAIL_MAX_ATTEMPTS:
+            email_stats["retried"] += 1
+            await asyncio.sleep(retry_delay(attempt))
+    email_stats["failed"] += len(pending)
+    for email in pending:
+        logger.error(f"Failed to send email to {email.to}: {error}")
+
+async def _work(connection: SMTPConnection, executor: ThreadPoolExecutor):
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            batch = await asyncio.wait_for(_queue.get(), timeout=EMAIL_IDLE_SECONDS)
+        except asyncio.TimeoutError:
+            await loop.run_in_executor(executor, connection.close)
+            continue
+        # Whatever else is already waiting shares the session
+        batches = [batch]
+        emails = list(batch)
+        while len(emails) < EMAIL_BATCH_SIZE and not _queue.empty():
+            batches.append(_queue.get_nowait())
+            emails.extend(batches[-1])
+        try:
+            await _deliver(connection, executor, emails)
+        except Exception as e:
+            email_stats["failed"] += len(emails)
+            print(f"Email Worker Error: {e}")
+        finally:
+            for _ in batches:
+                _queue.task_done()
+
+def start_email_workers(workers: int = EMAIL_WORKERS):
+    global _queue
+    if _senders:
+        return
+    _queue = asyncio.Queue(maxsize=EMAIL_QUEUE_SIZE)
+    for _ in range(workers):
+        connection = SMTPConnection()
+        executor = ThreadPoolExecutor(max_workers=1)
+        _senders.append((connection, executor, asyncio.create_task(_work(connection, executor))))
+
+async def stop_email_workers(timeout: float = EMAIL_DRAIN_SECONDS):
+    """Gives queued mail `timeout` seconds to go out, then closes the connections."""
+    if not _senders:
+        return
     try:
-        print(f"DEBUG: Connecting to SMTP {SMTP_SERVER}...")
-        with smtplib.SMTP_SSL(SMTP_SERVER, SMTP_PORT) as server:
-            server.login(SMTP_USER, SMTP_PASSWORD)
-            server.sendmail(SMTP_USER, to_email, msg.as_string())
-        print(f"DEBUG: Email sent successfully to {to_email}")
-        logger.info(f"Email sent to {to_email}")
-    except Exception as e:
-        print(f"DEBUG: SMTP Failed: {e}")
-        logger.error(f"Failed to send email to {to_email}: {e}")
+        await asyncio.wait_for(_queue.join(), timeout=timeout)
+    except asyncio.TimeoutError:
+        print(f"WARNING: Email still sending at shutdown ({_queue.qsize()} batches queued).")
+    loop = asyncio.get_running_loop()
+    for connection, executor, task in _senders:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await loop.run_in_executor(executor, connection.close)
+        executor.shutdown(wait=False)
+    _senders.clear()
+
+async def enqueue(emails: List[OutgoingEmail]):
+    """
+    Queues messages to go out together over one session. Waits while the
+    queue is full, so an order rush slows its producers instead of piling up.
+    """
+    if not _senders:
+        start_email_workers()
+    await _queue.put(list(emails))
+    email_stats["queued"] += len(emails)
+    email_stats["max_queue_depth"] = max(email_stats["max_queue_depth"], _queue.qsize())
+
+def get_email_stats() -> dict:
+    return {
+        **email_stats,
+        "queue_depth": _queue.qsize() if _queue is not None else 0,
+        "queue_size": EMAIL_QUEUE_SIZE,
+        "workers": len(_senders),
+        "connections_opened": sum(connection.opened for connection, _, _ in _senders),
+        "mock": MOCK_DELIVERY,
+    }
 
 async def send_order_confirmation(to_email: str, order_id: str, total_cents: int, pdf_bytes: bytes = None):
     """
-    Sends order confirmation email asynchronously (Thread Pool).
+    Queues the order confirmation email (see enqueue).
     sends to:
     1. Customer (to_email)
     2. Owner (airperfection.itai@gmail.com)
@@ -87,13 +264,9 @@ async def send_order_confirmation(to_email: str, order_id: str, total_cents: int
             "content": pdf_bytes
         }
 
-    loop = asyncio.get_event_loop()
-
-    # 1. Send to Customer
-    await loop.run_in_executor(executor, _send_sync, to_email, subject, html, attachment)
-
-    # 2. Send to Owner
-    await loop.run_in_executor(executor, _send_sync, "airperfection.itai@gmail.com", f"[NEW ORDER] {subject}", html, attachment)
-
-    # 3. Send to Mock Customer
-    await loop.run_in_executor(executor, _send_sync, "nativehawaiian808@gmail.com", f"[MOCK COPY] {subject}", html, attachment)
+    # Customer, owner and mock copy go out in one SMTP session
+    await enqueue([
+        OutgoingEmail(to_email, subject, html, attachment),
+        OutgoingEmail(OWNER_EMAIL, f"[NEW ORDER] {subject}", html, attachment),
+        OutgoingEmail(MOCK_CUSTOMER_EMAIL, f"[MOCK COPY] {subject}", html, attachment),
+    ])
@@ -1,96 +1,114 @@
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
-from reportlab.lib import colors
-from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-import io
+from concurrent.futures import ProcessPoolExecutor
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+import multiprocessing
+import hashlib
+import asyncio
+import json
+import os
 from datetime import datetime
 
-def generate_receipt_pdf(order_id: str, items: list, total_cents: int, date: datetime, customer_email: str) -> bytes:
-    buffer = io.BytesIO()
-    c = canvas.Canvas(buffer, pagesize=letter)
-    width, height = letter
-
-    # --- Header ---
-    c.setFillColor(colors.HexColor("#0f172a")) # Dark Blue
-    c.rect(0, height - 1.5*inch, width, 1.5*inch, fill=True, stroke=False)
+# Rendering is CPU-bound, so it runs in a process pool off the event loop.
+# PDF_WORKERS processes per API worker; renders beyond that wait their turn.
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "2"))
+# Rendered receipts kept per API worker, by (order_id, content hash)
+PDF_CACHE_MAX_ENTRIES = int(os.getenv("PDF_CACHE_MAX_ENTRIES", "256"))
 
-    c.setFillColor(colors.white)
-    c.setFont("Helvetica-Bold", 24)
-    c.drawString(0.5*inch, height - 0.6*inch, "AFFORDABLE HOME A/C")
+def _item_row(item) -> list:
+    # Items are dicts or objects (CartItem); `unit_price` is dollars, as stored
+    # on order_items, and missing for cart items and backfilled orders.
+    name = item.get('name') if isinstance(item, dict) else item.name
+    qty = item.get('quantity', 1) if isinstance(item, dict) else item.quantity
+    unit_price = item.get('unit_price') if isinstance(item, dict) else getattr(item, 'unit_price', None)
+    if unit_price is None:
+        return [name, str(qty), "$ - ", "$ - "]
+    return [name, str(qty), f"${unit_price:,.2f}", f"${unit_price * qty:,.2f}"]
 
-    c.setFont("Helvetica", 10)
-    c.drawString(0.5*inch, height - 0.9*inch, "94-1388 Moaniani St #202")
-    c.drawString(0.5*inch, height - 1.05*inch, "Waipahu, HI 96797")
-    c.drawString(0.5*inch, height - 1.2*inch, "Phone: (808) 555-0123")
+def generate_receipt_pdf(order_id: str, items: list, total_cents: int, date: datetime, customer_email: str) -> bytes:
+    """The receipt as PDF bytes (see receipt_layout.build_receipt)."""
+    # reportlab is a slow import the API process itself never needs; only
+    # the pool processes load it, on their first render
+    from services import receipt_layout
+    rows = [_item_row(item) for item in items]
+    return receipt_layout.build_receipt(order_id, rows, total_cents, date, customer_email)
 
-    c.setFont("Helvetica-Bold", 16)
-    c.drawRightString(width - 0.5*inch, height - 0.6*inch, "RECEIPT")
-    c.setFont("Helvetica", 10)
-    c.drawRightString(width - 0.5*inch, height - 0.8*inch, f"Date: {date.strftime('%Y-%m-%d')}")
-    c.drawRightString(width - 0.5*inch, height - 0.95*inch, f"Order #: {order_id[-8:].upper()}")
+# --- Process pool and cache (API side) ---
 
-    # --- Customer Info ---
-    c.setFillColor(colors.black)
-    c.setFont("Helvetica-Bold", 12)
-    c.drawString(0.5*inch, height - 2*inch, "Bill To:")
-    c.setFont("Helvetica", 10)
-    c.drawString(0.5*inch, height - 2.2*inch, customer_email)
+_pool: Optional[ProcessPoolExecutor] = None
+_slots: Optional[asyncio.Semaphore] = None
+_cache: "OrderedDict[Tuple[str, str], bytes]" = OrderedDict()
+_rendering: Dict[Tuple[str, str], asyncio.Future] = {}
 
-    # --- Table Data ---
-    data = [["Item", "Qty", "Price", "Total"]]
-    for item in items:
-        # Check if item is dict or object (depending on how it's passed)
-        name = item.get('name') if isinstance(item, dict) else item.name
-        qty = item.get('quantity', 1) if isinstance(item, dict) else item.quantity
-        price_cents = item.get('price', 0) if isinstance(item, dict) else item.price # Assuming price is passed or looked up?
-        # Wait, simple cart items might not have price. We should ideally pass fully hydrated items.
-        # For mock flow, we might need to trust what's passed or fetch.
-        # Let's assume passed items have 'name' and we can guess price or pass it.
-        # FIX: The endpoint will likely pass CartItems which effectively have ID.
-        # We'll just display Name and mock price if missing, or use Total / items count for rough.
-        # Better: Pass full details.
+pdf_stats = {"rendered": 0, "cache_hits": 0, "failed": 0}
 
-        # Determine price (Unit price = Total / Qty if single item? No.)
-        # Let's just put "-" if unknown or handle in caller.
-        unit_price = "$ - "
-        line_total = "$ - "
+def _as_dict(item) -> dict:
+    if isinstance(item, dict):
+        return item
+    return item.model_dump() if hasattr(item, "model_dump") else dict(vars(item))
 
-        data.append([name, str(qty), unit_price, line_total])
+def content_hash(items: list, total_cents: int, date: datetime, customer_email: str) -> str:
+    """Everything printed on the receipt besides the order id."""
+    content = json.dumps([items, total_cents, date.isoformat(), customer_email], sort_keys=True, default=str)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
 
-    data.append(["", "", "", ""])
-    data.append(["", "", "Total Paid:", f"${total_cents/100:.2f}"])
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool, _slots
+    if _pool is None:
+        # spawn: forking a process that runs an event loop and threads is unsafe
+        _pool = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        _slots = asyncio.Semaphore(PDF_WORKERS)
+    return _pool
 
-    # --- Table Styling ---
-    table = Table(data, colWidths=[4*inch, 0.5*inch, 1.25*inch, 1.25*inch])
-    style = TableStyle([
-        ('BACKGROUND', (0,0), (-1,0), colors.HexColor("#f1f5f9")),
-        ('TEXTCOLOR', (0,0), (-1,0), colors.HexColor("#0f172a")),
-        ('ALIGN', (0,0), (-1,-1), 'LEFT'),
-        ('ALIGN', (1,0), (-1,-1), 'CENTER'), # Qty center
-        ('ALIGN', (2,0), (-1,-1), 'RIGHT'), # Prices right
-        ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0,0), (-1,0), 10),
-        ('BOTTOMPADDING', (0,0), (-1,0), 12),
-        ('BACKGROUND', (0,-1), (-1,-1), colors.HexColor("#06b6d4")), # Total Row
-        ('TEXTCOLOR', (0,-1), (-1,-1), colors.white),
-        ('FONTNAME', (0,-1), (-1,-1), 'Helvetica-Bold'),
-    ])
-    table.setStyle(style)
+async def render_receipt(order_id: str, items: list, total_cents: int, date: datetime, customer_email: str, cache: bool = True) -> bytes:
+    """
+    generate_receipt_pdf in the process pool. The same receipt rendered again
+    (resend, re-download) comes from the cache, and concurrent requests for
+    one receipt share a single render. Bulk exports pass cache=False so they
+    don't evict everything else.
+    """
+    items = [_as_dict(item) for item in items]
+    key = (order_id, content_hash(items, total_cents, date, customer_email))
+    if key in _cache:
+        _cache.move_to_end(key)
+        pdf_stats["cache_hits"] += 1
+        return _cache[key]
+    if key in _rendering:
+        pdf_stats["cache_hits"] += 1
+        return await asyncio.shield(_rendering[key])
 
-    # Draw Table
-    table.wrapOn(c, width, height)
-    table.drawOn(c, 0.5*inch, height - 4*inch)
+    future = _rendering[key] = asyncio.get_running_loop().create_future()
+    try:
+        pool = _get_pool()
+        async with _slots:
+            pdf_bytes = await asyncio.get_running_loop().run_in_executor(
+                pool, generate_receipt_pdf, order_id, items, total_cents, date, customer_email
+            )
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        pdf_stats["failed"] += 1
+        future.set_exception(e)
+        # Waiters get the error; don't warn about it if there are none
+        future.exception()
+        raise
+    finally:
+        _rendering.pop(key, None)
 
-    # --- Footer ---
-    c.setFillColor(colors.HexColor("#64748b"))
-    c.setFont("Helvetica", 9)
-    c.drawCentredString(width/2, 1*inch, "Thank you for your business!")
-    c.drawCentredString(width/2, 0.85*inch, "If you have any questions, please contact us at support@affordablehome-ac.com")
+    pdf_stats["rendered"] += 1
+    future.set_result(pdf_bytes)
+    if cache:
+        _cache[key] = pdf_bytes
+        while len(_cache) > PDF_CACHE_MAX_ENTRIES:
+            _cache.popitem(last=False)
+    return pdf_bytes
 
-    c.showPage()
-    c.save()
+def get_pdf_stats() -> dict:
+    return {**pdf_stats, "cached": len(_cache), "workers": PDF_WORKERS, "pool_started": _pool is not None}
 
-    buffer.seek(0)
-    return buffer.read()
+def shutdown_pdf_pool():
+    global _pool, _slots
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+    _pool = None
+    _slots = None
@@ -0,0 +1,110 @@
+"""
+Receipt layout (reportlab). Imported on first render - in the pool
+processes, not by the API at startup - see services/pdf.py.
+"""
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfgen import canvas
+from xml.sax.saxutils import escape
+from reportlab.lib import colors
+from reportlab.lib.units import inch
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from datetime import datetime
+import io
+
+# --- Static layout, built once per process ---
+BRAND_DARK = colors.HexColor("#0f172a") # Dark Blue
+HEADER_ROW_BG = colors.HexColor("#f1f5f9")
+TOTAL_ROW_BG = colors.HexColor("#06b6d4")
+FOOTER_GREY = colors.HexColor("#64748b")
+COL_WIDTHS = [4*inch, 0.5*inch, 1.25*inch, 1.25*inch]
+# Header band on every page is 1.5in; the footer text sits at 0.85-1in
+TOP_MARGIN = 1.9*inch
+BOTTOM_MARGIN = 1.3*inch
+
+ITEMS_STYLE = TableStyle([
+    ('BACKGROUND', (0,0), (-1,0), HEADER_ROW_BG),
+    ('TEXTCOLOR', (0,0), (-1,0), BRAND_DARK),
+    ('ALIGN', (0,0), (-1,-1), 'LEFT'),
+    ('ALIGN', (1,0), (-1,-1), 'CENTER'), # Qty center
+    ('ALIGN', (2,0), (-1,-1), 'RIGHT'), # Prices right
+    ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0,0), (-1,0), 10),
+    ('BOTTOMPADDING', (0,0), (-1,0), 12),
+])
+# Its own table so the items table can split across pages
+TOTAL_STYLE = TableStyle([
+    ('ALIGN', (2,0), (-1,-1), 'RIGHT'),
+    ('BACKGROUND', (0,0), (-1,-1), TOTAL_ROW_BG),
+    ('TEXTCOLOR', (0,0), (-1,-1), colors.white),
+    ('FONTNAME', (0,0), (-1,-1), 'Helvetica-Bold'),
+])
+
+_styles = getSampleStyleSheet()
+BILL_TO_TITLE = ParagraphStyle("BillToTitle", parent=_styles["Normal"], fontName="Helvetica-Bold", fontSize=12, leading=16)
+BILL_TO = ParagraphStyle("BillTo", parent=_styles["Normal"], fontName="Helvetica", fontSize=10, leading=12)
+
+def _draw_header(c: canvas.Canvas, width: float, height: float, order_id: str, date: datetime):
+    c.setFillColor(BRAND_DARK)
+    c.rect(0, height - 1.5*inch, width, 1.5*inch, fill=True, stroke=False)
+
+    c.setFillColor(colors.white)
+    c.setFont("Helvetica-Bold", 24)
+    c.drawString(0.5*inch, height - 0.6*inch, "AFFORDABLE HOME A/C")
+
+    c.setFont("Helvetica", 10)
+    c.drawString(0.5*inch, height - 0.9*inch, "94-1388 Moaniani St #202")
+    c.drawString(0.5*inch, height - 1.05*inch, "Waipahu, HI 96797")
+    c.drawString(0.5*inch, height - 1.2*inch, "Phone: (808) 555-0123")
+
+    c.setFont("Helvetica-Bold", 16)
+    c.drawRightString(width - 0.5*inch, height - 0.6*inch, "RECEIPT")
+    c.setFont("Helvetica", 10)
+    c.drawRightString(width - 0.5*inch, height - 0.8*inch, f"Date: {date.strftime('%Y-%m-%d')}")
+    c.drawRightString(width - 0.5*inch, height - 0.95*inch, f"Order #: {order_id[-8:].upper()}")
+
+def _draw_footer(c: canvas.Canvas, width: float, page: int):
+    c.setFillColor(FOOTER_GREY)
+    c.setFont("Helvetica", 9)
+    c.drawCentredString(width/2, 1*inch, "Thank you for your business!")
+    c.drawCentredString(width/2, 0.85*inch, "If you have any questions, please contact us at support@affordablehome-ac.com")
+    if page > 1:
+        c.drawRightString(width - 0.5*inch, 0.6*inch, f"Page {page}")
+
+def build_receipt(order_id: str, rows: list, total_cents: int, date: datetime, customer_email: str) -> bytes:
+    """
+    One or more letter pages: header and footer on every page, and the items
+    table (`rows` from pdf._item_row) continues, with its heading row
+    repeated, onto as many as it needs.
+    """
+    buffer = io.BytesIO()
+    width, height = letter
+
+    def decorate(c: canvas.Canvas, doc):
+        c.saveState()
+        _draw_header(c, width, height, order_id, date)
+        _draw_footer(c, width, doc.page)
+        c.restoreState()
+
+    doc = SimpleDocTemplate(
+        buffer, pagesize=letter,
+        leftMargin=0.5*inch, rightMargin=0.5*inch,
+        topMargin=TOP_MARGIN, bottomMargin=BOTTOM_MARGIN,
+        title=f"Receipt {order_id[-8:].upper()}",
+    )
+
+    data = [["Item", "Qty", "Price", "Total"]]
+    data.extend(rows)
+    data.append(["", "", "", ""])
+
+    story = [
+        # --- Customer Info ---
+        Paragraph("Bill To:", BILL_TO_TITLE),
+        Paragraph(escape(customer_email or ""), BILL_TO),
+        Spacer(1, 0.4*inch),
+        # --- Items ---
+        Table(data, colWidths=COL_WIDTHS, style=ITEMS_STYLE, repeatRows=1, hAlign="LEFT"),
+        Table([["", "", "Total Paid:", f"${total_cents/100:.2f}"]], colWidths=COL_WIDTHS, style=TOTAL_STYLE, hAlign="LEFT"),
+    ]
+    doc.build(story, onFirstPage=decorate, onLaterPages=decorate)
+    return buffer.getvalue()
@@ -0,0 +1,58 @@
+import asyncio
+import os
+import pytest
+
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite://")
+
+@pytest.fixture
+def run_with_db(tmp_path):
+    """
+    Runs `test(session_factory)` against a fresh SQLite file with two
+    products: 1 "Hot Unit" ($499, 50 in stock), 2 "Cold Unit" ($899, 3).
+    """
+    pytest.importorskip("aiosqlite")
+    from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+    from sqlalchemy.orm import sessionmaker
+    from database import Base
+    import models
+
+    def run(test):
+        async def runner():
+            engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'test.db'}")
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+            session_factory = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+            async with session_factory() as session:
+                session.add_all([
+                    models.Product(id=1, name="Hot Unit", price=499, category="WINDOW_AC", stock=50),
+                    models.Product(id=2, name="Cold Unit", price=899, category="SPLIT_AIR", stock=3),
+                ])
+                await session.commit()
+            try:
+                await test(session_factory)
+            finally:
+                await engine.dispose()
+        asyncio.run(runner())
+    return run
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    """cache.redis_client backed by fakeredis, with the in-process cache state reset."""
+    fakeredis = pytest.importorskip("fakeredis")
+    import cache
+    client = fakeredis.FakeAsyncRedis(decode_responses=True)
+    monkeypatch.setattr(cache, "redis_client", client)
+    monkeypatch.setattr(cache, "_listener_ready", False)
+    cache._generations.clear()
+    cache.local_cache.clear()
+    yield client
+    cache._generations.clear()
+    cache.local_cache.clear()
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Wall clock (time.time) the test moves forward by hand; fakeredis expiries follow it."""
+    import time
+    now = [time.time()]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    return now
@@ -0,0 +1,57 @@
+import asyncio
+import pytest
+
+pytest.importorskip("aiosqlite")
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+import bootstrap
+import models
+from database import Base
+
+SEED = "id,name,price,category,stock\n1,Hot Unit,499,WINDOW_AC,50\n2,Cold Unit,899,SPLIT_AIR,3\n"
+
+def test_schema_is_created_once_and_seeded_when_empty(tmp_path):
+    seed_file = tmp_path / "inventory.csv"
+    seed_file.write_text(SEED)
+
+    async def run():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'boot.db'}")
+        session_factory = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+        try:
+            assert await bootstrap.check_schema(engine) is None
+            assert await bootstrap.ensure_schema(engine, session_factory, str(seed_file)) == "created"
+            assert await bootstrap.check_schema(engine) == (bootstrap.SCHEMA_VERSION, True)
+
+            # Restarts: one query, no reseed
+            assert await bootstrap.ensure_schema(engine, session_factory, str(seed_file)) == "current"
+            async with session_factory() as db:
+                assert await db.scalar(select(func.count()).select_from(models.Product)) == 2
+                await db.execute(delete(models.Product))
+                await db.commit()
+
+            # Products gone: seeded again without touching the schema
+            assert await bootstrap.ensure_schema(engine, session_factory, str(seed_file)) == "current"
+            assert await bootstrap.check_schema(engine) == (bootstrap.SCHEMA_VERSION, True)
+        finally:
+            await engine.dispose()
+
+    asyncio.run(run())
+
+def test_database_behind_is_migrated(tmp_path):
+    async def run():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'boot.db'}")
+        session_factory = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+        try:
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+                await conn.execute(models.SchemaVersion.__table__.insert().values(version=1))
+                await conn.execute(models.Product.__table__.insert().values(id=1, name="Hot Unit", price=499, category="WINDOW_AC", stock=50))
+            assert await bootstrap.ensure_schema(engine, session_factory, str(tmp_path / "missing.csv")) == "upgraded"
+            assert await bootstrap.check_schema(engine) == (bootstrap.SCHEMA_VERSION, True)
+        finally:
+            await engine.dispose()
+
+    asyncio.run(run())
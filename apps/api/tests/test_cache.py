@@ -0,0 +1,165 @@
+import asyncio
+import time
+import httpx
+from typing import List, Optional
+from fastapi import Depends, FastAPI
+from fastapi.responses import Response
+from pydantic import BaseModel
+import cache
+from cache import LocalCache, build_cache_key, cache_response
+
+def fake_db():
+    return object()
+
+@cache_response(ttl=60, key_prefix="products", normalize={"q": str.lower})
+async def get_products(
+    q: Optional[str] = None,
+    category: Optional[str] = None,
+    min_price: Optional[float] = None,
+    db=Depends(fake_db)
+):
+    return []
+
+def test_cache_key_ignores_injected_session():
+    key_a = get_products.make_cache_key((), {"q": "LG", "db": object()})
+    key_b = get_products.make_cache_key((), {"q": "lg", "db": object()})
+    assert key_a == key_b == "products:g0:get_products:q=lg"
+
+def test_cache_key_is_order_and_format_insensitive():
+    key_a = get_products.make_cache_key((), {"category": "WINDOW_AC", "min_price": 500.0})
+    key_b = get_products.make_cache_key((), {"min_price": 500, "category": "WINDOW_AC", "q": ""})
+    assert key_a == key_b
+
+def test_long_cache_keys_are_hashed():
+    key = build_cache_key("products", "get_products", {"q": "x" * 500})
+    assert key.startswith("products:g0:get_products:sha1=")
+
+def test_generation_is_part_of_the_key():
+    old = get_products.make_cache_key((), {"q": "lg"}, generation=1)
+    new = get_products.make_cache_key((), {"q": "lg"}, generation=2)
+    assert old != new
+    assert new.startswith("products:g2:")
+
+def test_local_cache_evicts_least_recently_used():
+    l1 = LocalCache(max_entries=2)
+    l1.set("products:g0:a", {"data": 1}, time.time() + 60)
+    l1.set("products:g0:b", {"data": 2}, time.time() + 60)
+    l1.get("products:g0:a")
+    l1.set("products:g0:c", {"data": 3}, time.time() + 60)
+    assert l1.get("products:g0:b") is None
+    assert l1.get("products:g0:a") == {"data": 1}
+
+def test_local_cache_drops_namespace_and_expired_entries():
+    l1 = LocalCache(max_entries=10)
+    l1.set("products:g0:a", {"data": 1}, time.time() + 60)
+    l1.set("leads:g0:a", {"data": 2}, time.time() + 60)
+    l1.set("leads:g0:b", {"data": 3}, time.time() - 1)
+    l1.drop_namespace("products")
+    assert l1.get("products:g0:a") is None
+    assert l1.get("leads:g0:a") == {"data": 2}
+    assert l1.get("leads:g0:b") is None
+
+def test_failed_invalidation_is_counted(monkeypatch):
+    class BrokenRedis:
+        async def incr(self, key):
+            raise ConnectionError("redis down")
+
+    monkeypatch.setattr(cache, "redis_client", BrokenRedis())
+    errors = cache.cache_stats["errors"]
+    asyncio.run(cache.invalidate_cache("products"))
+    assert cache.cache_stats["errors"] == errors + 1
+
+def make_counted(**options):
+    """A cached route that counts its computations and returns the count."""
+    calls = []
+
+    @cache_response(key_prefix="counted", **options)
+    async def counted(q: Optional[str] = None):
+        calls.append(q)
+        await asyncio.sleep(0.05)
+        return {"computed": len(calls)}
+
+    return counted, calls
+
+def test_concurrent_misses_share_one_computation(fake_redis):
+    counted, calls = make_counted(ttl=60)
+
+    async def test():
+        return await asyncio.gather(*(counted(q="x") for _ in range(10)))
+
+    results = asyncio.run(test())
+    assert len(calls) == 1
+    assert results == [{"computed": 1}] * 10
+
+def test_stale_entry_is_served_while_one_refresh_runs(fake_redis, clock):
+    counted, calls = make_counted(ttl=10, stale_ttl=30)
+
+    async def test():
+        assert await counted(q="x") == {"computed": 1}
+        clock[0] += 11  # past the soft TTL, inside the stale window
+        stale = await asyncio.gather(*(counted(q="x") for _ in range(5)))
+        assert stale == [{"computed": 1}] * 5
+        assert len(cache._background_tasks) == 1
+        await asyncio.gather(*cache._background_tasks)
+        assert await counted(q="x") == {"computed": 2}
+
+    asyncio.run(test())
+    assert len(calls) == 2
+
+def test_hard_ttl_expiry_is_a_miss(fake_redis, clock):
+    counted, calls = make_counted(ttl=10, stale_ttl=30)
+
+    async def test():
+        await counted(q="x")
+        clock[0] += 41  # past ttl + stale_ttl: Redis has dropped the entry
+        misses = cache.cache_stats["misses"]
+        assert await counted(q="x") == {"computed": 2}
+        assert cache.cache_stats["misses"] == misses + 1
+        assert not cache._background_tasks
+
+    asyncio.run(test())
+
+class Unit(BaseModel):
+    id: int
+    name: str
+    price: int
+    btu: Optional[int] = None
+
+class UnitRow:
+    """ORM-like row, with a column the response model leaves out."""
+    def __init__(self, id, name, price, btu=None):
+        self.id, self.name, self.price, self.btu = id, name, price, btu
+        self.cost = price // 2
+
+def test_pre_encoded_hit_matches_the_uncached_response(monkeypatch, fake_redis):
+    app = FastAPI()
+
+    @app.get("/units", response_model=List[Unit])
+    @cache_response(ttl=60, key_prefix="units", response_model=List[Unit])
+    async def units(q: Optional[str] = None):
+        return [UnitRow(1, "Hot Unit", 499, 12000), UnitRow(2, "Cold Unit", 899)]
+
+    async def fetch():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get("/units")
+
+    async def test():
+        miss = await fetch()
+        stored = await fake_redis.get(units.make_cache_key((), {}))
+        hit = await fetch()
+        hit_result = await units()
+        monkeypatch.setattr(cache, "redis_client", None)
+        return miss, stored, hit, hit_result, await fetch()
+
+    hits = cache.cache_stats["hits"]
+    miss, stored, hit, hit_result, uncached = asyncio.run(test())
+    assert cache.cache_stats["hits"] == hits + 2
+
+    assert isinstance(hit_result, Response)
+    assert hit_result.media_type == "application/json"
+    assert hit_result.body == stored.partition("\n")[2].encode()
+    assert hit.content == hit_result.body
+    assert hit.headers["content-type"] == "application/json"
+    assert hit.json() == miss.json() == uncached.json()
+    assert "cost" not in hit.text
@@ -0,0 +1,117 @@
+import httpx
+import pytest
+
+pytest.importorskip("aiosqlite")
+
+from sqlalchemy.future import select
+import main
+import models
+from database import get_db
+from domain import payments
+
+def intent_request(quantity=2):
+    return {
+        "items": [{"product_id": 1, "category": "WINDOW_AC", "name": "Hot Unit", "quantity": quantity}],
+        "client_total_cents": 499 * 100 * quantity,
+        "customer_email": "buyer@example.com",
+    }
+
+@pytest.fixture
+def checkout(run_with_db):
+    """Runs `test(client, session_factory)` with create-intent on a fresh database."""
+    def run(test):
+        async def with_client(session_factory):
+            async def override_db():
+                async with session_factory() as session:
+                    yield session
+            main.app.dependency_overrides[get_db] = override_db
+            try:
+                transport = httpx.ASGITransport(app=main.app)
+                async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                    await test(client, session_factory)
+            finally:
+                main.app.dependency_overrides.clear()
+        run_with_db(with_client)
+    return run
+
+def test_provider_outage_holds_no_stock(checkout, monkeypatch):
+    async def unavailable(amount, currency="usd", idempotency_key=None):
+        raise payments.PaymentsUnavailable("down")
+    monkeypatch.setattr(payments, "create_payment_intent_service", unavailable)
+
+    async def test(client, session_factory):
+        for _ in range(3):
+            response = await client.post("/api/v1/payments/create-intent", json=intent_request())
+            assert response.status_code == 503
+        async with session_factory() as session:
+            assert (await session.get(models.Product, 1)).stock == 50
+            assert (await session.execute(select(models.Order))).first() is None
+
+    checkout(test)
+
+def test_intent_is_stored_with_the_hold(checkout, monkeypatch):
+    async def created(amount, currency="usd", idempotency_key=None):
+        return {"clientSecret": "pi_1_secret", "id": "pi_1"}
+    monkeypatch.setattr(payments, "create_payment_intent_service", created)
+
+    async def test(client, session_factory):
+        response = await client.post("/api/v1/payments/create-intent", json=intent_request(), headers={"Idempotency-Key": "k1"})
+        assert response.json() == {"clientSecret": "pi_1_secret", "id": "pi_1"}
+        async with session_factory() as session:
+            assert (await session.get(models.Product, 1)).stock == 48
+            order = (await session.execute(select(models.Order))).scalar_one()
+            assert (order.status, order.stripe_pid) == (models.OrderStatus.AWAIT_PAYMENT, "pi_1")
+
+    checkout(test)
+
+def test_cached_intent_is_only_replayed_for_an_open_order(checkout, monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    import cache
+    monkeypatch.setattr(cache, "redis_client", fakeredis.FakeAsyncRedis(decode_responses=True))
+    calls = []
+
+    async def created(amount, currency="usd", idempotency_key=None):
+        calls.append(amount)
+        return {"clientSecret": "pi_1_secret", "id": "pi_1"}
+    monkeypatch.setattr(payments, "create_payment_intent_service", created)
+
+    async def test(client, session_factory):
+        headers = {"Idempotency-Key": "k1"}
+        for _ in range(2):
+            response = await client.post("/api/v1/payments/create-intent", json=intent_request(), headers=headers)
+            assert response.json()["id"] == "pi_1"
+        assert len(calls) == 1
+
+        async with session_factory() as session:
+            order = (await session.execute(select(models.Order))).scalar_one()
+            order.status = models.OrderStatus.CANCELLED
+            await session.commit()
+        response = await client.post("/api/v1/payments/create-intent", json=intent_request(), headers=headers)
+        assert response.status_code == 409
+        assert len(calls) == 1
+
+    checkout(test)
+
+def test_retried_payment_event_sends_one_confirmation(checkout, monkeypatch):
+    async def created(amount, currency="usd", idempotency_key=None):
+        return {"clientSecret": "pi_1_secret", "id": "pi_1"}
+    monkeypatch.setattr(payments, "create_payment_intent_service", created)
+    sent = []
+    async def send_order_confirmation(to_email, order_id, total_cents):
+        sent.append(order_id)
+    monkeypatch.setattr(main.email_service, "send_order_confirmation", send_order_confirmation)
+
+    async def test(client, session_factory):
+        monkeypatch.setattr(main, "AsyncSessionLocal", session_factory)
+        await client.post("/api/v1/payments/create-intent", json=intent_request())
+        event = {"id": "evt_1", "type": "payment_intent.succeeded",
+                 "data": {"object": {"id": "pi_1", "amount_received": 99800}}}
+        # Redelivered after a partial success, e.g. the inbox row failed to update
+        await main.process_stripe_event(event)
+        await main.process_stripe_event(event)
+        async with session_factory() as session:
+            order = (await session.execute(select(models.Order))).scalars().one()
+        assert order.status == models.OrderStatus.PAID
+        assert sent == [order.id]
+
+    checkout(test)
@@ -0,0 +1,92 @@
+import pytest
+
+pytest.importorskip("aiosqlite")
+
+from database import engine_options
+
+def test_sqlite_profile_has_no_pool_sizing(monkeypatch):
+    monkeypatch.delenv("DB_ECHO", raising=False)
+    options = engine_options("sqlite+aiosqlite:///app.db")
+    assert options["echo"] is False
+    assert "pool_size" not in options
+
+def test_asyncpg_profile_from_env(monkeypatch):
+    monkeypatch.setenv("DB_POOL_SIZE", "20")
+    monkeypatch.setenv("DB_MAX_OVERFLOW", "0")
+    monkeypatch.setenv("DB_STATEMENT_CACHE_SIZE", "0")
+    options = engine_options("postgresql+asyncpg://user:password@db:5432/ahac_db")
+    assert (options["pool_size"], options["max_overflow"]) == (20, 0)
+    assert options["pool_pre_ping"] is True
+    assert options["connect_args"] == {"prepared_statement_cache_size": 0}
+
+def test_sessions_only_check_out_on_first_query():
+    from fastapi import Depends, FastAPI
+    from fastapi.testclient import TestClient
+    from sqlalchemy import text
+    from sqlalchemy.ext.asyncio import AsyncSession
+    import database
+
+    app = FastAPI()
+
+    @app.get("/unused/{item_id}")
+    async def unused(item_id: int, db: AsyncSession = Depends(database.get_db)):
+        return {"id": item_id}
+
+    @app.get("/used")
+    async def used(db: AsyncSession = Depends(database.get_read_db)):
+        return {"one": (await db.execute(text("SELECT 1"))).scalar()}
+
+    @app.post("/twice")
+    async def twice(db: AsyncSession = Depends(database.get_db)):
+        # The connection goes back to the pool on commit
+        await db.execute(text("SELECT 1"))
+        await db.commit()
+        await db.execute(text("SELECT 1"))
+        return {}
+
+    database.session_counts.clear()
+    database.checkout_counts.clear()
+    with TestClient(app) as client:
+        client.get("/unused/1")
+        client.get("/unused/not-a-number")  # 422 before the route runs
+        client.get("/used")
+        client.post("/twice")
+
+    routes = database.get_pool_stats()["routes"]
+    assert routes["GET /unused/{item_id}"] == {"sessions": 2, "checkouts": 0}
+    assert routes["GET /used"] == {"sessions": 1, "checkouts": 1}
+    assert routes["POST /twice"] == {"sessions": 1, "checkouts": 2}
+
+def test_reads_use_the_primary_right_after_an_invalidation(fake_redis, monkeypatch):
+    import asyncio
+    import contextlib
+    import cache
+    import database
+
+    used = []
+
+    def session_factory(name):
+        @contextlib.asynccontextmanager
+        async def open_session(info=None):
+            used.append(name)
+            yield None
+        return open_session
+
+    monkeypatch.setattr(database, "AsyncSessionLocal", session_factory("primary"))
+    monkeypatch.setattr(database, "ReadSessionLocal", session_factory("replica"))
+    monkeypatch.setattr(database, "_primary_reads_until", 0.0)
+
+    async def read():
+        async for _ in database.get_read_db():
+            pass
+
+    async def test():
+        await read()
+        # The miss after this must not cache a lagging replica's old rows
+        await cache.invalidate_cache("products")
+        await read()
+        monkeypatch.setattr(database, "_primary_reads_until", 0.0) # Window over
+        await read()
+
+    asyncio.run(test())
+    assert used == ["replica", "primary", "replica"]
@@ -0,0 +1,62 @@
+import asyncio
+import pytest
+
+from benchmarks.smtp_sink import SMTPSink
+from services import email as email_service
+
+@pytest.fixture
+def smtp_sink(monkeypatch):
+    """Points the email service at a local sink; yields a runner for `test(sink)`."""
+    monkeypatch.setattr(email_service, "SMTP_SERVER", "127.0.0.1")
+    monkeypatch.setattr(email_service, "SMTP_SSL", False)
+    monkeypatch.setattr(email_service, "SMTP_PASSWORD", "secret")
+    monkeypatch.setattr(email_service, "MOCK_DELIVERY", False)
+    monkeypatch.setattr(email_service, "retry_delay", lambda attempt: 0)
+    monkeypatch.setattr(email_service, "email_stats", dict.fromkeys(email_service.email_stats, 0))
+
+    def run(test, **sink_options):
+        async def runner():
+            sink = await SMTPSink(**sink_options).start()
+            monkeypatch.setattr(email_service, "SMTP_PORT", sink.port)
+            email_service.start_email_workers(workers=1)
+            try:
+                await test(sink)
+            finally:
+                await email_service.stop_email_workers()
+                await sink.stop()
+        asyncio.run(runner())
+    return run
+
+def test_confirmation_copies_share_one_session(smtp_sink):
+    async def test(sink):
+        for order_id in ("ORD-00000001", "ORD-00000002"):
+            await email_service.send_order_confirmation("a@example.com", order_id, 49900)
+        await email_service._queue.join()
+        assert len(sink.messages) == 6
+        assert sink.connections == 1
+        assert email_service.get_email_stats()["sent"] == 6
+
+    smtp_sink(test)
+
+def test_dropped_connection_resends_the_rest_of_the_batch(smtp_sink):
+    async def test(sink):
+        await email_service.send_order_confirmation("a@example.com", "ORD-00000001", 49900)
+        await email_service._queue.join()
+        assert [m["to"] for m in sink.messages] == [
+            ["a@example.com"], [email_service.OWNER_EMAIL], [email_service.MOCK_CUSTOMER_EMAIL]
+        ]
+        assert sink.connections == 2
+        stats = email_service.get_email_stats()
+        assert (stats["sent"], stats["retried"], stats["failed"]) == (3, 1, 0)
+
+    smtp_sink(test, disconnect_every=2)
+
+def test_rejected_recipient_is_not_retried(smtp_sink):
+    async def test(sink):
+        await email_service.send_order_confirmation("reject@example.com", "ORD-00000001", 49900)
+        await email_service._queue.join()
+        assert len(sink.messages) == 2
+        stats = email_service.get_email_stats()
+        assert (stats["sent"], stats["retried"], stats["failed"]) == (2, 0, 1)
+
+    smtp_sink(test)
@@ -0,0 +1,26 @@
+from domain.facets import band_of, facet_search, BTU_BANDS
+
+PRODUCTS = [
+    {"id": 1, "category": "WINDOW_AC", "btu": 6000, "voltage": "115V", "price": 540},
+    {"id": 2, "category": "WINDOW_AC", "btu": 12000, "voltage": "115V", "price": 700},
+    {"id": 3, "category": "PTAC", "btu": 12000, "voltage": "230V", "price": 1100},
+    {"id": 4, "category": "PTAC", "btu": 18000, "voltage": "230V", "price": 1200},
+]
+
+def test_band_of_uses_half_open_ranges():
+    assert band_of(7999, BTU_BANDS) == "under-8000"
+    assert band_of(8000, BTU_BANDS) == "8000-11999"
+    assert band_of(None, BTU_BANDS) is None
+
+def test_facet_search_ors_within_and_ands_across_facets():
+    items, _ = facet_search(PRODUCTS, {"category": ["PTAC", "WINDOW_AC"], "btu_band": ["12000-17999"]})
+    assert [p["id"] for p in items] == [2, 3]
+
+def test_facet_counts_ignore_their_own_selection():
+    items, counts = facet_search(PRODUCTS, {"category": ["PTAC"]})
+    assert [p["id"] for p in items] == [3, 4]
+    # category counts still show what selecting WINDOW_AC would add
+    assert counts["category"] == {"PTAC": 2, "WINDOW_AC": 2}
+    # other facets count only within the selection
+    assert counts["voltage"] == {"115V": 0, "230V": 2}
+    assert counts["btu_band"]["12000-17999"] == 1
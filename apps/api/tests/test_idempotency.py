@@ -0,0 +1,116 @@
+import asyncio
+import pytest
+
+pytest.importorskip("aiosqlite")
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa") # fakeredis runs the claim-release Lua script with it
+
+import httpx
+from fastapi import FastAPI, HTTPException
+import cache
+import idempotency
+from idempotency import IdempotencyMiddleware
+
+def make_app(calls):
+    app = FastAPI()
+
+    @app.post("/things")
+    async def create_thing(payload: dict):
+        calls.append(payload)
+        await asyncio.sleep(0.05)
+        if payload.get("fail"):
+            raise HTTPException(status_code=400, detail="nope")
+        return {"id": len(calls)}
+
+    app.add_middleware(IdempotencyMiddleware)
+    return app
+
+def run(test, redis=True):
+    async def runner():
+        cache.redis_client = fakeredis.aioredis.FakeRedis(decode_responses=True) if redis else None
+        calls = []
+        try:
+            transport = httpx.ASGITransport(app=make_app(calls))
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                await test(client, calls)
+        finally:
+            cache.redis_client = None
+    asyncio.run(runner())
+
+def test_concurrent_duplicates_run_once_and_replay():
+    async def test(client, calls):
+        responses = await asyncio.gather(*(
+            client.post("/things", json={"name": "a"}, headers={"Idempotency-Key": "k"}) for _ in range(5)
+        ))
+        assert len(calls) == 1
+        assert {r.json()["id"] for r in responses} == {1}
+        assert sum(r.headers.get("idempotent-replayed") == "true" for r in responses) == 4
+
+    run(test)
+
+def test_key_reused_for_different_request_is_rejected():
+    async def test(client, calls):
+        await client.post("/things", json={"name": "a"}, headers={"Idempotency-Key": "k"})
+        response = await client.post("/things", json={"name": "b"}, headers={"Idempotency-Key": "k"})
+        assert response.status_code == 422
+        assert len(calls) == 1
+
+    run(test)
+
+def test_errors_are_not_stored():
+    async def test(client, calls):
+        for _ in range(2):
+            response = await client.post("/things", json={"fail": True}, headers={"Idempotency-Key": "k"})
+            assert response.status_code == 400
+        assert len(calls) == 2
+
+    run(test)
+
+def test_requests_pass_through_without_a_store(monkeypatch):
+    async def unreachable(*args):
+        raise ConnectionRefusedError("database down")
+    monkeypatch.setattr(idempotency.database_store, "claim", unreachable)
+
+    async def test(client, calls):
+        for _ in range(2):
+            response = await client.post("/things", json={"name": "a"}, headers={"Idempotency-Key": "k"})
+            assert response.status_code == 200
+        assert len(calls) == 2
+        assert calls[0] == {"name": "a"}
+
+    run(test, redis=False)
+
+def test_expired_claim_does_not_release_a_newer_one(fake_redis):
+    store = idempotency.redis_store
+
+    async def test():
+        first = await store.claim("key", "fp")
+        # The first request outlives PENDING_TTL; a retry claims the key again
+        await fake_redis.delete(f"{idempotency.KEY_PREFIX}:key")
+        second = await store.claim("key", "fp")
+        assert first and second and first != second
+
+        await store.release("key", first)
+        assert await store.get("key") is not None
+        await store.release("key", second)
+        assert await store.get("key") is None
+
+    asyncio.run(test())
+
+def test_database_claim_is_released_only_by_its_owner(run_with_db, monkeypatch):
+    store = idempotency.database_store
+
+    async def test(session_factory):
+        monkeypatch.setattr(idempotency, "AsyncSessionLocal", session_factory)
+        first = await store.claim("key", "fp")
+        monkeypatch.setattr(idempotency, "PENDING_TTL", -1) # first claim has expired
+        second = await store.claim("key", "fp")
+        monkeypatch.setattr(idempotency, "PENDING_TTL", 30)
+        assert first and second and first != second
+
+        await store.release("key", first)
+        assert await store.get("key") is not None
+        await store.release("key", second)
+        assert await store.get("key") is None
+
+    run_with_db(test)
@@ -0,0 +1,87 @@
+import asyncio
+import json
+import os
+from datetime import datetime, timedelta
+import pytest
+from fastapi import HTTPException
+
+pytest.importorskip("aiosqlite")
+
+import models
+from domain import inventory
+
+async def stock_of(session_factory, product_id):
+    async with session_factory() as session:
+        return (await session.get(models.Product, product_id)).stock
+
+def test_aggregate_lines_sums_and_sorts():
+    items = [{"product_id": 7, "quantity": 1}, {"product_id": 2, "quantity": 2}, {"product_id": 7, "quantity": 3}]
+    assert list(inventory.aggregate_lines(items).items()) == [(2, 2), (7, 4)]
+
+def test_aggregate_lines_rejects_non_positive_quantity():
+    with pytest.raises(HTTPException):
+        inventory.aggregate_lines([{"product_id": 1, "quantity": 0}])
+
+def test_concurrent_checkouts_never_oversell(run_with_db):
+    async def test(session_factory):
+        async def checkout():
+            async with session_factory() as session:
+                try:
+                    await inventory.reserve_stock(session, {1: 1})
+                    await session.commit()
+                    return True
+                except HTTPException:
+                    return False
+
+        results = await asyncio.gather(*(checkout() for _ in range(200)))
+        assert sum(results) == 50
+        assert await stock_of(session_factory, 1) == 0
+
+    run_with_db(test)
+
+def test_reservation_is_all_or_nothing(run_with_db):
+    async def test(session_factory):
+        async with session_factory() as session:
+            with pytest.raises(HTTPException) as exc:
+                await inventory.reserve_stock(session, {1: 2, 2: 5})
+            assert exc.value.status_code == 400
+            assert "Cold Unit" in exc.value.detail
+        assert await stock_of(session_factory, 1) == 50
+        assert await stock_of(session_factory, 2) == 3
+
+    run_with_db(test)
+
+def test_empty_reservation_touches_nothing(run_with_db):
+    async def test(session_factory):
+        async with session_factory() as session:
+            assert await inventory.reserve_stock(session, {}) == {}
+            await inventory.release_stock(session, {})
+        assert await stock_of(session_factory, 1) == 50
+
+    run_with_db(test)
+
+def test_sweeper_releases_only_expired_holds(run_with_db):
+    async def test(session_factory):
+        now = datetime.utcnow()
+        items = json.dumps([{"product_id": 1, "quantity": 2}])
+        async with session_factory() as session:
+            await inventory.reserve_stock(session, {1: 4})
+            session.add_all([
+                models.Order(id="expired", status=models.OrderStatus.AWAIT_PAYMENT, total_cents=0,
+                             items_json=items, reserved_until=now - timedelta(seconds=1)),
+                models.Order(id="active", status=models.OrderStatus.LOCK_STOCK, total_cents=0,
+                             items_json=items, reserved_until=now + timedelta(hours=1)),
+            ])
+            await session.commit()
+
+        async with session_factory() as session:
+            assert await inventory.release_expired_holds(session, now) == 1
+            assert (await session.get(models.Order, "expired")).status == models.OrderStatus.CANCELLED
+            assert (await session.get(models.Order, "active")).status == models.OrderStatus.LOCK_STOCK
+        assert await stock_of(session_factory, 1) == 48
+
+        async with session_factory() as session:
+            assert await inventory.release_expired_holds(session, now) == 0
+        assert await stock_of(session_factory, 1) == 48
+
+    run_with_db(test)
@@ -0,0 +1,35 @@
+import asyncio
+import json
+import aiohttp
+import stripe
+
+from benchmarks.loadtest import WEBHOOK_SECRET, percentile, sign_webhook
+from benchmarks.stub_payments import StubPayments
+
+def test_percentile_is_nearest_rank():
+    ordered = [float(n) for n in range(1, 101)]
+    assert percentile(ordered, 50) == 50
+    assert percentile(ordered, 99) == 99
+    assert percentile([7.0], 95) == 7
+    assert percentile([], 95) == 0
+
+def test_signed_webhook_passes_stripe_verification():
+    payload = json.dumps({"id": "evt_1", "object": "event", "type": "payment_intent.succeeded", "data": {"object": {}}})
+    event = stripe.Webhook.construct_event(payload, sign_webhook(payload), WEBHOOK_SECRET)
+    assert event["id"] == "evt_1"
+
+def test_stub_payments_replays_idempotency_key():
+    async def test():
+        stub = await StubPayments(latency=0).start()
+        try:
+            async with aiohttp.ClientSession(base_url=stub.base_url) as session:
+                replies = []
+                for key in ("a", "a", "b"):
+                    async with session.post("/v1/payment_intents", data={"amount": "1999"}, headers={"Idempotency-Key": key}) as r:
+                        replies.append(await r.json())
+        finally:
+            await stub.stop()
+        assert replies[0] == replies[1]
+        assert replies[2]["id"] != replies[0]["id"]
+        assert stub.requests == 3
+    asyncio.run(test())
@@ -0,0 +1,51 @@
+import asyncio
+import httpx
+from fastapi import Depends, FastAPI
+from sqlalchemy import text
+
+import metrics
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = metrics.Histogram("demo_seconds", "Demo.", ("route",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.7, 3.0):
+        histogram.observe(value, "/a")
+    lines = histogram.render()
+    assert 'demo_seconds_bucket{route="/a",le="0.1"} 1' in lines
+    assert 'demo_seconds_bucket{route="/a",le="1"} 3' in lines
+    assert 'demo_seconds_bucket{route="/a",le="+Inf"} 4' in lines
+    assert 'demo_seconds_count{route="/a"} 4' in lines
+    assert 'demo_seconds_sum{route="/a"} 4.25' in lines
+
+def test_requests_are_labelled_by_template_with_their_sql(run_with_db, monkeypatch):
+    monkeypatch.setattr(metrics.http_requests, "values", {})
+    monkeypatch.setattr(metrics.db_request_queries, "values", {})
+
+    async def test(session_factory):
+        metrics.instrument_engine(session_factory.kw["bind"], "test")
+
+        async def get_session():
+            async with session_factory() as session:
+                yield session
+
+        app = FastAPI()
+
+        @app.get("/items/{item_id}")
+        async def item(item_id: int, db=Depends(get_session)):
+            await db.execute(text("SELECT 1"))
+            await db.execute(text("SELECT 2"))
+            return {"id": item_id}
+
+        app.add_middleware(metrics.MetricsMiddleware, root=app)
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            assert (await client.get("/items/1")).status_code == 200
+            assert (await client.get("/items/2")).status_code == 200
+            assert (await client.get("/missing")).status_code == 404
+
+        assert metrics.http_requests.values == {
+            ("GET", "/items/{item_id}", "200"): 2,
+            ("GET", "unmatched", "404"): 1,
+        }
+        _, total = metrics.db_request_queries.values[("GET", "/items/{item_id}")]
+        assert total == 4
+
+    run_with_db(test)
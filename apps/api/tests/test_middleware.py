@@ -0,0 +1,224 @@
+import asyncio
+import logging
+import httpx
+import pytest
+from fastapi import FastAPI, HTTPException
+from fastapi.middleware.cors import CORSMiddleware
+from starlette.responses import StreamingResponse
+
+import cache
+from middleware import (
+    CATALOG_CACHE_CONTROL, ChaosMiddleware, HeaderMiddleware, LogSanitizerMiddleware, install_middleware,
+)
+
+def catalog_app():
+    """Routes shaped like the API's, behind HeaderMiddleware, counting their calls."""
+    app = FastAPI()
+    app.state.calls = 0
+
+    @app.get("/api/v1/products")
+    async def products():
+        app.state.calls += 1
+        return [{"id": 1}]
+
+    @app.get("/api/v1/products/{product_id}")
+    async def product(product_id: int):
+        app.state.calls += 1
+        return {"id": product_id}
+
+    @app.get("/api/v1/warranties")
+    async def warranties():
+        return {"years": 5}
+
+    @app.get("/api/v1/admin/orders")
+    async def admin_orders():
+        return []
+
+    @app.get("/api/v1/health")
+    async def health():
+        return {"status": "ok"}
+
+    @app.post("/api/v1/leads")
+    async def leads():
+        return {"id": 1}
+
+    app.add_middleware(HeaderMiddleware)
+    return app
+
+def run_client(app, test):
+    async def runner():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            await test(client)
+    asyncio.run(runner())
+
+def test_catalog_etag_revalidates_without_running_the_route(fake_redis):
+    app = catalog_app()
+
+    async def test(client):
+        first = await client.get("/api/v1/products/1")
+        etag = first.headers["etag"]
+        assert first.status_code == 200
+        assert etag.startswith('W/"') # Not derived from the body
+        assert app.state.calls == 1
+
+        revalidated = await client.get("/api/v1/products/1", headers={"If-None-Match": etag})
+        assert revalidated.status_code == 304
+        assert revalidated.headers["etag"] == etag
+        assert revalidated.headers["cache-control"] == CATALOG_CACHE_CONTROL
+        assert app.state.calls == 1
+
+        other = await client.get("/api/v1/products/2", headers={"If-None-Match": etag})
+        assert other.status_code == 200
+        assert other.headers["etag"] != etag
+
+    run_client(app, test)
+
+def test_wildcard_if_none_match_runs_the_route(fake_redis):
+    app = catalog_app()
+
+    async def test(client):
+        response = await client.get("/api/v1/products/999999", headers={"If-None-Match": "*"})
+        assert response.status_code == 200
+        assert app.state.calls == 1
+
+    run_client(app, test)
+
+def test_invalidation_changes_the_catalog_etag(fake_redis):
+    app = catalog_app()
+
+    async def test(client):
+        etag = (await client.get("/api/v1/products")).headers["etag"]
+        await cache.invalidate_cache("products")
+        response = await client.get("/api/v1/products", headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.headers["etag"] != etag
+        assert app.state.calls == 2
+
+    run_client(app, test)
+
+def test_no_catalog_etag_without_redis(monkeypatch):
+    monkeypatch.setattr(cache, "redis_client", None)
+
+    async def test(client):
+        response = await client.get("/api/v1/products")
+        assert "etag" not in response.headers
+        assert response.headers["cache-control"] == CATALOG_CACHE_CONTROL
+
+    run_client(catalog_app(), test)
+
+@pytest.mark.parametrize("method, path, cache_control", [
+    ("GET", "/api/v1/products", CATALOG_CACHE_CONTROL),
+    ("GET", "/api/v1/products/1", CATALOG_CACHE_CONTROL),
+    ("GET", "/api/v1/warranties", "public, max-age=3600, s-maxage=86400"),
+    ("GET", "/api/v1/admin/orders", "private, no-store"),
+    ("GET", "/api/v1/health", "no-store"),
+    ("POST", "/api/v1/leads", "no-store"),
+])
+def test_cache_control_per_route(monkeypatch, method, path, cache_control):
+    monkeypatch.setattr(cache, "redis_client", None)
+
+    async def test(client):
+        response = await client.request(method, path)
+        assert response.status_code == 200
+        assert response.headers["cache-control"] == cache_control
+
+    run_client(catalog_app(), test)
+
+def test_static_route_etag_comes_from_its_body(monkeypatch):
+    monkeypatch.setattr(cache, "redis_client", None)
+
+    async def test(client):
+        etag = (await client.get("/api/v1/warranties")).headers["etag"]
+        assert not etag.startswith("W/")
+        response = await client.get("/api/v1/warranties", headers={"If-None-Match": f'W/{etag}'})
+        assert response.status_code == 304
+
+    run_client(catalog_app(), test)
+
+def test_cors_wraps_early_304s(fake_redis):
+    import main
+    classes = [m.cls for m in main.app.user_middleware]
+    assert classes.index(CORSMiddleware) < classes.index(HeaderMiddleware)
+
+    app = catalog_app()
+    app.add_middleware(CORSMiddleware, allow_origins=["https://shop.example"])
+
+    async def test(client):
+        origin = {"Origin": "https://shop.example"}
+        etag = (await client.get("/api/v1/products/4", headers=origin)).headers["etag"]
+        response = await client.get("/api/v1/products/4", headers={**origin, "If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.headers["access-control-allow-origin"] == "https://shop.example"
+        assert "Origin" in response.headers["vary"]
+
+    run_client(app, test)
+
+# --- Pure-ASGI pipeline ---
+
+def test_log_sanitizer_redacts_secrets(caplog):
+    app = FastAPI()
+
+    @app.get("/api/v1/orders/lookup")
+    async def lookup():
+        return {}
+
+    app.add_middleware(LogSanitizerMiddleware)
+
+    async def test(client):
+        await client.get("/api/v1/orders/lookup", params={"email": "a@b.com", "Token": "t0k", "page": "2"})
+
+    with caplog.at_level(logging.INFO, logger="api"):
+        run_client(app, test)
+    logged = caplog.text
+    assert "a@b.com" not in logged and "t0k" not in logged
+    assert "email=[REDACTED]" in logged and "Token=[REDACTED]" in logged
+    assert "page=2" in logged
+
+@pytest.mark.parametrize("chaos_mode, installed", [(None, False), ("false", False), ("true", True)])
+def test_chaos_is_installed_only_when_enabled(monkeypatch, chaos_mode, installed):
+    if chaos_mode is None:
+        monkeypatch.delenv("CHAOS_MODE", raising=False)
+    else:
+        monkeypatch.setenv("CHAOS_MODE", chaos_mode)
+    app = FastAPI()
+    install_middleware(app)
+    classes = [m.cls for m in app.user_middleware]
+    assert (ChaosMiddleware in classes) == installed
+    assert HeaderMiddleware in classes and LogSanitizerMiddleware in classes
+
+def test_headers_apply_to_streaming_and_error_responses(monkeypatch):
+    monkeypatch.setattr(cache, "redis_client", None)
+    monkeypatch.delenv("CHAOS_MODE", raising=False)
+    app = FastAPI()
+
+    @app.get("/api/v1/admin/export")
+    async def export():
+        async def rows():
+            for n in range(3):
+                yield f"{n}\n".encode()
+        return StreamingResponse(rows(), media_type="text/csv")
+
+    @app.get("/api/v1/products/{product_id}")
+    async def product(product_id: int):
+        raise HTTPException(status_code=404, detail="Product not found")
+
+    install_middleware(app)
+
+    async def test(client):
+        streamed = await client.get("/api/v1/admin/export")
+        assert streamed.text == "0\n1\n2\n"
+        assert streamed.headers["cache-control"] == "private, no-store"
+
+        # The catalog policy is for 200s: a CDN must not keep the 404
+        missing = await client.get("/api/v1/products/9")
+        assert missing.status_code == 404
+        assert missing.headers["cache-control"] == "no-store"
+        assert "etag" not in missing.headers
+
+        # Not a catalog URL as far as the policy table goes: the default applies
+        invalid = await client.get("/api/v1/products/not-a-number")
+        assert invalid.status_code == 422
+        assert invalid.headers["cache-control"] == "no-store"
+
+    run_client(app, test)
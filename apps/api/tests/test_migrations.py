@@ -0,0 +1,88 @@
+import asyncio
+import json
+import pytest
+
+pytest.importorskip("aiosqlite")
+
+from sqlalchemy import inspect, select, text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+import migrations
+import models
+
+# Tables as the original schema had them, before the ad-hoc migration scripts
+OLD_SCHEMA = [
+    "CREATE TABLE products (id INTEGER PRIMARY KEY, name VARCHAR, price INTEGER, category VARCHAR, stock INTEGER)",
+    "CREATE TABLE orders (id VARCHAR PRIMARY KEY, status VARCHAR, total_cents INTEGER, stripe_pid VARCHAR, created_at DATETIME)",
+    "CREATE TABLE leads (id INTEGER PRIMARY KEY, email VARCHAR, created_at DATETIME)",
+]
+
+def run_on_old_database(tmp_path, test):
+    async def runner():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'old.db'}")
+        async with engine.begin() as conn:
+            for statement in OLD_SCHEMA:
+                await conn.execute(text(statement))
+        try:
+            await test(engine)
+        finally:
+            await engine.dispose()
+    asyncio.run(runner())
+
+async def schema(engine):
+    def read(sync):
+        inspector = inspect(sync)
+        return {
+            table: (
+                {c["name"] for c in inspector.get_columns(table)},
+                {i["name"] for i in inspector.get_indexes(table)},
+            )
+            for table in ("orders", "leads", "products")
+        }
+    async with engine.connect() as conn:
+        return await conn.run_sync(read)
+
+def test_old_database_is_brought_up_to_date_once(tmp_path):
+    async def test(engine):
+        logs = []
+        assert await migrations.run_migrations(engine, target=1, log=logs.append) == [1]
+        async with engine.begin() as conn:
+            await conn.execute(text("ALTER TABLE orders ADD COLUMN items_json VARCHAR"))
+            await conn.execute(text(
+                "INSERT INTO orders (id, status, total_cents, items_json) VALUES (:id, 'PAID', 49900, :items)"
+            ), {"id": "ORD-1", "items": json.dumps([{"product_id": 1, "name": "Hot Unit", "quantity": 2}])})
+
+        assert await migrations.run_migrations(engine, log=logs.append) == [2, 3, 4, 5, 6]
+        tables = await schema(engine)
+        orders_columns, orders_indexes = tables["orders"]
+        assert {"customer_email", "reserved_until", "items_json"} <= orders_columns
+        assert {"ix_orders_stripe_pid", "ix_orders_created_at", "ix_orders_status_created_at",
+                "ix_orders_customer_email", "ix_orders_reserved_until"} <= orders_indexes
+        assert "status" in tables["leads"][0] and "ix_leads_created_at" in tables["leads"][1]
+        assert "image_url" in tables["products"][0]
+
+        async with engine.connect() as conn:
+            lines = (await conn.execute(select(models.OrderItem.order_id, models.OrderItem.quantity))).all()
+            versions = (await conn.execute(select(models.SchemaVersion.version))).scalars().all()
+        assert [tuple(line) for line in lines] == [("ORD-1", 2)]
+        assert sorted(versions) == [m.version for m in migrations.MIGRATIONS]
+
+        # Nothing left to do, and re-running a migration changes nothing
+        assert await migrations.run_migrations(engine, log=logs.append) == []
+        await migrations.backfill_order_items(migrations.Migrator(engine, logs.append))
+        await migrations.lookup_indexes(migrations.Migrator(engine, logs.append))
+        async with engine.connect() as conn:
+            assert len((await conn.execute(select(models.OrderItem.id))).all()) == 1
+
+    run_on_old_database(tmp_path, test)
+
+def test_new_database_gets_the_model_indexes_from_the_baseline(tmp_path):
+    async def runner():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'new.db'}")
+        try:
+            assert await migrations.run_migrations(engine, log=lambda line: None) == [m.version for m in migrations.MIGRATIONS]
+            tables = await schema(engine)
+            assert {"ix_orders_stripe_pid", "ix_orders_status_created_at"} <= tables["orders"][1]
+        finally:
+            await engine.dispose()
+    asyncio.run(runner())
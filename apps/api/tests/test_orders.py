@@ -0,0 +1,121 @@
+import json
+import pytest
+from fastapi import HTTPException
+
+pytest.importorskip("aiosqlite")
+
+from sqlalchemy.future import select
+from pydantic import BaseModel
+from typing import List, Optional
+import models
+from domain import orders, reports
+
+class Item(BaseModel):
+    product_id: int
+    category: str
+    name: str
+    quantity: int = 1
+
+class Order(BaseModel):
+    items: List[Item]
+    customer_email: str
+    shipping_method: str = "PICKUP_AIEA"
+    discount_code: Optional[str] = None
+
+def pickup(*lines, discount_code=None):
+    items = [Item(product_id=p, category="WINDOW_AC", name=f"Unit {p}", quantity=q) for p, q in lines]
+    return Order(items=items, customer_email="buyer@example.com", discount_code=discount_code)
+
+def test_create_order_persists_order_and_items(run_with_db):
+    async def test(session_factory):
+        async with session_factory() as session:
+            result = await orders.create_order_service(pickup((1, 2), (2, 1)), session)
+        assert result["total"] == 2 * 499 + 899
+
+        async with session_factory() as session:
+            order = await session.get(models.Order, result["order_id"])
+            assert order.status == models.OrderStatus.LOCK_STOCK
+            assert order.reserved_until is not None
+            assert len(json.loads(order.items_json)) == 2
+            items = (await session.execute(
+                select(models.OrderItem).where(models.OrderItem.order_id == order.id).order_by(models.OrderItem.product_id)
+            )).scalars().all()
+            assert [(i.product_id, i.quantity, i.unit_price) for i in items] == [(1, 2, 499), (2, 1, 899)]
+
+    run_with_db(test)
+
+def test_empty_cart_creates_an_empty_order(run_with_db):
+    async def test(session_factory):
+        async with session_factory() as session:
+            result = await orders.create_order_service(pickup(), session)
+        assert result["total"] == 0
+        async with session_factory() as session:
+            assert (await session.get(models.Order, result["order_id"])).status == models.OrderStatus.LOCK_STOCK
+
+    run_with_db(test)
+
+def test_failed_order_writes_nothing(run_with_db):
+    async def test(session_factory):
+        async with session_factory() as session:
+            with pytest.raises(HTTPException):
+                await orders.create_order_service(pickup((1, 1), (2, 4)), session)
+        async with session_factory() as session:
+            assert (await session.execute(select(models.Order))).first() is None
+            assert (await session.execute(select(models.OrderItem))).first() is None
+
+    run_with_db(test)
+
+def test_reports_aggregate_order_items(run_with_db):
+    async def test(session_factory):
+        async with session_factory() as session:
+            paid = await orders.create_order_service(pickup((1, 3)), session)
+            await orders.create_order_service(pickup((1, 1), (2, 2)), session)
+            order = await session.get(models.Order, paid["order_id"])
+            order.status = models.OrderStatus.PAID
+            await session.commit()
+
+            sales = await reports.sales_by_product_service(session)
+            assert sales == [{"product_id": 1, "name": "Unit 1", "units_sold": 3, "revenue": 3 * 499, "orders": 1}]
+
+            stock = {row["product_id"]: row for row in await reports.stock_reconciliation_service(session)}
+            assert (stock[1]["available"], stock[1]["held"], stock[1]["sold"]) == (46, 1, 3)
+            assert (stock[2]["available"], stock[2]["held"], stock[2]["sold"]) == (1, 2, 0)
+
+    run_with_db(test)
+
+def test_checkout_upsert_reserves_once_per_idempotency_key(run_with_db):
+    async def test(session_factory):
+        def checkout_order(order_id, email, stripe_pid=None):
+            return {
+                "id": order_id,
+                "status": models.OrderStatus.AWAIT_PAYMENT,
+                "total_cents": 2 * 49900,
+                "idempotency_key": "key-1",
+                "customer_email": email,
+                "stripe_pid": stripe_pid,
+            }
+        items = pickup((1, 2)).items
+
+        async with session_factory() as session:
+            first, created = await orders.upsert_checkout_order(session, checkout_order("first", None), items)
+            await session.commit()
+            assert (first.id, created) == ("first", True)
+
+            retry, created = await orders.upsert_checkout_order(session, checkout_order("retry", "late@example.com", "pi_1"), items)
+            await session.commit()
+            assert (retry.id, created) == ("first", False)
+            assert (retry.status, retry.total_cents, retry.stripe_pid) == (models.OrderStatus.AWAIT_PAYMENT, 2 * 49900, "pi_1")
+
+            # A stored intent id is kept
+            again, _ = await orders.upsert_checkout_order(session, checkout_order("again", None, "pi_2"), items)
+            await session.commit()
+            assert again.stripe_pid == "pi_1"
+
+        async with session_factory() as session:
+            assert (await session.get(models.Product, 1)).stock == 48
+            order = await session.get(models.Order, "first")
+            assert order.customer_email == "late@example.com"
+            count = len((await session.execute(select(models.OrderItem))).all())
+            assert count == 1
+
+    run_with_db(test)
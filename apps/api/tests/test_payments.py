@@ -0,0 +1,107 @@
+import asyncio
+import pytest
+
+aiohttp_web = pytest.importorskip("aiohttp.web")
+
+from domain import payments
+from domain.payments import CircuitBreaker, PaymentsClient, PaymentsError, PaymentsUnavailable
+
+def test_breaker_opens_after_threshold_and_half_opens(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(payments.time, "monotonic", lambda: clock[0])
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10)
+
+    breaker.record_failure()
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(PaymentsUnavailable):
+        breaker.before_call()
+
+    clock[0] += 10
+    breaker.before_call()  # the single trial call
+    with pytest.raises(PaymentsUnavailable):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+def run_against_stub(handler, test):
+    async def runner():
+        app = aiohttp_web.Application()
+        app.router.add_post("/v1/payment_intents", handler)
+        server = aiohttp_web.AppRunner(app)
+        await server.setup()
+        site = aiohttp_web.TCPSite(server, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        client = PaymentsClient(base_url=f"http://127.0.0.1:{port}", max_concurrency=4)
+        try:
+            await test(client)
+        finally:
+            await client.close()
+            await server.cleanup()
+    asyncio.run(runner())
+
+def test_client_posts_form_with_idempotency_key():
+    seen = []
+
+    async def handler(request):
+        seen.append((dict(await request.post()), request.headers.get("Idempotency-Key")))
+        return aiohttp_web.json_response({"id": "pi_1", "client_secret": "pi_1_secret"})
+
+    async def test(client):
+        intent = await client.post("/v1/payment_intents", {"amount": 1500, "currency": "usd"}, idempotency_key="k1")
+        assert intent["id"] == "pi_1"
+
+    run_against_stub(handler, test)
+    assert seen == [({"amount": "1500", "currency": "usd"}, "k1")]
+
+def test_client_rejections_do_not_trip_breaker_but_outages_do():
+    statuses = [400, 400, 503, 503, 503, 503, 503]
+
+    async def handler(request):
+        status = statuses.pop(0)
+        return aiohttp_web.json_response({"error": {"message": f"status {status}"}}, status=status)
+
+    async def test(client):
+        for _ in range(2):
+            with pytest.raises(PaymentsError) as exc:
+                await client.post("/v1/payment_intents", {})
+            assert not isinstance(exc.value, PaymentsUnavailable)
+        for _ in range(payments.BREAKER_FAILURE_THRESHOLD):
+            with pytest.raises(PaymentsUnavailable):
+                await client.post("/v1/payment_intents", {})
+        assert client.breaker.state == "open"
+        with pytest.raises(PaymentsUnavailable):
+            await client.post("/v1/payment_intents", {})
+        assert client.get_stats()["fast_failed"] == 1
+
+    run_against_stub(handler, test)
+
+def test_cancelled_half_open_trial_lets_the_next_call_through():
+    calls = []
+    release = asyncio.Event()
+
+    async def handler(request):
+        calls.append(1)
+        if len(calls) == 1:
+            await release.wait()
+        return aiohttp_web.json_response({"id": "pi_1"})
+
+    async def test(client):
+        client.breaker.failures = client.breaker.failure_threshold
+        client.breaker.opened_at = payments.time.monotonic() - client.breaker.reset_timeout
+        assert client.breaker.state == "half-open"
+
+        trial = asyncio.ensure_future(client.post("/v1/payment_intents", {}))
+        while not calls:
+            await asyncio.sleep(0.01)
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+
+        assert (await client.post("/v1/payment_intents", {}))["id"] == "pi_1"
+        assert client.breaker.state == "closed"
+        release.set()
+
+    run_against_stub(handler, test)
@@ -0,0 +1,81 @@
+import asyncio
+import csv
+import io
+import zipfile
+from datetime import datetime
+import pytest
+
+pytest.importorskip("reportlab")
+
+import models
+from services import pdf as pdf_service
+
+ITEMS = [{"name": "Hot Unit", "quantity": 2, "unit_price": 499}]
+DATE = datetime(2026, 1, 15)
+
+def test_receipt_renders_line_totals():
+    pdf_bytes = pdf_service.generate_receipt_pdf("ORD-00000001", ITEMS, 99800, DATE, "a@example.com")
+    assert pdf_bytes.startswith(b"%PDF")
+    assert pdf_service._item_row(ITEMS[0]) == ["Hot Unit", "2", "$499.00", "$998.00"]
+    assert pdf_service._item_row({"name": "Cold Unit", "quantity": 1})[2:] == ["$ - ", "$ - "]
+
+def test_large_order_continues_onto_more_pages():
+    pypdf = pytest.importorskip("pypdf")
+    items = [{"name": f"Hot Unit {i}", "quantity": 1, "unit_price": 499} for i in range(120)]
+    pdf_bytes = pdf_service.generate_receipt_pdf("ORD-00000001", items, 120 * 49900, DATE, "a@example.com")
+    pages = [page.extract_text() for page in pypdf.PdfReader(io.BytesIO(pdf_bytes)).pages]
+    assert len(pages) > 1
+    assert all("RECEIPT" in page and "Qty" in page for page in pages)
+    assert "Hot Unit 119" in pages[-1] and "Total Paid" in pages[-1]
+    assert not any("Total Paid" in page for page in pages[:-1])
+
+def test_render_receipt_caches_by_order_and_content(monkeypatch):
+    monkeypatch.setattr(pdf_service, "pdf_stats", dict.fromkeys(pdf_service.pdf_stats, 0))
+    monkeypatch.setattr(pdf_service, "_cache", type(pdf_service._cache)())
+
+    async def test():
+        try:
+            first, concurrent = await asyncio.gather(
+                pdf_service.render_receipt("ORD-00000001", ITEMS, 99800, DATE, "a@example.com"),
+                pdf_service.render_receipt("ORD-00000001", ITEMS, 99800, DATE, "a@example.com"),
+            )
+            again = await pdf_service.render_receipt("ORD-00000001", ITEMS, 99800, DATE, "a@example.com")
+            assert first == concurrent == again
+            assert pdf_service.pdf_stats["rendered"] == 1
+            assert pdf_service.pdf_stats["cache_hits"] == 2
+
+            await pdf_service.render_receipt("ORD-00000001", ITEMS, 99800, DATE, "b@example.com")
+            assert pdf_service.pdf_stats["rendered"] == 2
+        finally:
+            pdf_service.shutdown_pdf_pool()
+
+    asyncio.run(test())
+
+def test_receipts_zip_has_sold_orders_in_range(run_with_db, monkeypatch):
+    pytest.importorskip("aiosqlite")
+    from domain import reports
+    monkeypatch.setattr(reports, "EXPORT_PAGE_SIZE", 2)
+
+    async def test(session_factory):
+        async with session_factory() as session:
+            for i, status in enumerate(["PAID", "DELIVERED", "LOCK_STOCK", "PAID", "SHIPPED"]):
+                session.add(models.Order(id=f"ORD-{i}", status=status, total_cents=49900,
+                                         customer_email="a@example.com", created_at=datetime(2026, 1, 10 + i)))
+                session.add(models.OrderItem(order_id=f"ORD-{i}", product_id=1, name="Hot Unit", quantity=1, unit_price=499))
+            session.add(models.Order(id="ORD-feb", status="PAID", total_cents=100, created_at=datetime(2026, 2, 1)))
+            await session.commit()
+
+        try:
+            chunks = [chunk async for chunk in reports.receipts_zip(session_factory, datetime(2026, 1, 1), datetime(2026, 2, 1))]
+        finally:
+            pdf_service.shutdown_pdf_pool()
+        assert len([chunk for chunk in chunks if chunk]) > 1
+
+        archive = zipfile.ZipFile(io.BytesIO(b"".join(chunks)))
+        names = archive.namelist()
+        assert names == ["Receipt_ORD-0.pdf", "Receipt_ORD-1.pdf", "Receipt_ORD-3.pdf", "Receipt_ORD-4.pdf", "manifest.csv"]
+        assert archive.read("Receipt_ORD-0.pdf").startswith(b"%PDF")
+        manifest = list(csv.DictReader(io.StringIO(archive.read("manifest.csv").decode())))
+        assert [(row["order_id"], row["status"], row["total"]) for row in manifest][:2] == [("ORD-0", "PAID", "499.00"), ("ORD-1", "DELIVERED", "499.00")]
+
+    run_with_db(test)
@@ -0,0 +1,119 @@
+import asyncio
+import contextlib
+import csv
+import io
+import json
+import pytest
+
+pytest.importorskip("aiosqlite")
+
+import models
+from domain import inventory, product_io
+
+async def chunks_of(data: bytes, size: int = 7):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+async def collect(feed):
+    return [record async for record in feed]
+
+def test_csv_records_handle_quotes_split_across_chunks():
+    data = (
+        'id,name,price,key_spec\n'
+        '4,"LG Dual Inverter 6,000 BTU",540,"Two\nlines"\n'
+        '21,GE Wall Case,225,Universal 26" Standard\n'
+    ).encode()
+    rows = asyncio.run(collect(product_io.csv_records(chunks_of(data))))
+    assert rows == [
+        {"id": "4", "name": "LG Dual Inverter 6,000 BTU", "price": "540", "key_spec": "Two\nlines"},
+        {"id": "21", "name": "GE Wall Case", "price": "225", "key_spec": 'Universal 26" Standard'},
+    ]
+
+def test_parse_product_types_and_validates():
+    assert product_io.parse_product({"id": "7", "price": "700", "btu": "", "extra": "x"}) == {"id": 7, "price": 700, "btu": None}
+    for bad in ({"price": "1"}, {"id": "1", "stock": "-1"}, {"id": "1", "price": "cheap"}, {"id": 1, "name": ""}):
+        with pytest.raises(product_io.RecordError):
+            product_io.parse_product(bad)
+
+def test_import_writes_only_changes_and_invalidates_once(run_with_db, monkeypatch):
+    invalidations = []
+
+    async def invalidate(namespace):
+        invalidations.append(namespace)
+
+    monkeypatch.setattr(product_io, "invalidate_cache", invalidate)
+
+    async def test(session_factory):
+        feed = "\n".join([
+            json.dumps({"id": 1, "price": 499, "stock": 50}), # unchanged
+            json.dumps({"id": 2, "stock": 10}), # stock only
+            json.dumps({"id": 3, "name": "New Unit", "price": 300, "category": "PTAC", "stock": 5}),
+            json.dumps({"id": 4, "price": 100}), # new, incomplete
+            "not json",
+        ]).encode()
+        stats = await product_io.import_products(
+            session_factory, product_io.ndjson_records(chunks_of(feed)), chunk_size=2
+        )
+        assert {k: stats[k] for k in ("rows", "created", "updated", "unchanged", "invalid")} == {
+            "rows": 5, "created": 1, "updated": 1, "unchanged": 1, "invalid": 2
+        }
+        assert sorted(e["row"] for e in stats["errors"]) == [4, 5]
+        assert invalidations == ["products"]
+
+        async with session_factory() as session:
+            cold = await session.get(models.Product, 2)
+            assert (cold.stock, cold.price, cold.name) == (10, 899, "Cold Unit")
+            assert (await session.get(models.Product, 3)).category == "PTAC"
+            assert await session.get(models.Product, 4) is None
+
+        # Same feed again: nothing to write, no invalidation
+        stats = await product_io.import_products(session_factory, product_io.ndjson_records(chunks_of(feed)))
+        assert (stats["created"], stats["updated"], stats["unchanged"]) == (0, 0, 3)
+        assert invalidations == ["products"]
+
+    run_with_db(test)
+
+def test_price_feed_keeps_stock_reserved_during_the_import(run_with_db, monkeypatch):
+    monkeypatch.setattr(product_io, "invalidate_cache", lambda namespace: asyncio.sleep(0))
+
+    async def test(session_factory):
+        @contextlib.asynccontextmanager
+        async def reserve_after_read():
+            async with session_factory() as db:
+                execute = db.execute
+
+                async def execute_then_reserve(*args, **kwargs):
+                    result = await execute(*args, **kwargs)
+                    if db.execute is execute_then_reserve:
+                        db.execute = execute
+                        # A checkout lands between the diff's read and the upsert
+                        async with session_factory() as checkout:
+                            await inventory.reserve_stock(checkout, {1: 2})
+                            await checkout.commit()
+                    return result
+
+                db.execute = execute_then_reserve
+                yield db
+
+        feed = json.dumps({"id": 1, "price": 450}).encode()
+        stats = await product_io.import_products(reserve_after_read, product_io.ndjson_records(chunks_of(feed)))
+        assert stats["updated"] == 1
+
+        async with session_factory() as session:
+            hot = await session.get(models.Product, 1)
+            assert (hot.price, hot.stock) == (450, 48)
+
+    run_with_db(test)
+
+def test_export_round_trips_through_import(run_with_db, monkeypatch):
+    monkeypatch.setattr(product_io, "EXPORT_PAGE_SIZE", 1)
+
+    async def test(session_factory):
+        exported = "".join([chunk async for chunk in product_io.export_products(session_factory, "csv")])
+        rows = list(csv.DictReader(io.StringIO(exported)))
+        assert [(r["id"], r["name"], r["stock"]) for r in rows] == [("1", "Hot Unit", "50"), ("2", "Cold Unit", "3")]
+
+        stats = await product_io.import_products(session_factory, product_io.csv_records(chunks_of(exported.encode())))
+        assert (stats["unchanged"], stats["invalid"]) == (2, 0)
+
+    run_with_db(test)
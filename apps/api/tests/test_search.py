@@ -0,0 +1,39 @@
+from domain.search import ProductSearchIndex, tokenize
+
+CATALOG = [
+    {"id": 4, "name": "LG Dual Inverter 6,000 BTU (LW6023IVSM)", "key_spec": "Ultra-Quiet Mode", "performance_specs": "44dB Ultra-Quiet Mode"},
+    {"id": 6, "name": "LG Dual Inverter 10,000 BTU (LW1022IVSM)", "key_spec": "2024 ENERGY STAR® Most Efficient", "performance_specs": None},
+    {"id": 17, "name": "GE Performance 8,000 BTU (AJCQ08AWJ)", "key_spec": "Quiet operation", "performance_specs": "Inverter compressor"},
+]
+
+def test_tokenize_joins_thousands():
+    assert tokenize("LG 12,000 BTU") == ["lg", "12000", "btu"]
+
+def test_search_matches_partial_model_numbers():
+    index = ProductSearchIndex(CATALOG)
+    assert [pid for pid, _ in index.search("6023")] == [4]
+    assert [pid for pid, _ in index.search("lw1022")] == [6]
+
+def test_search_ranks_name_above_spec_matches():
+    index = ProductSearchIndex(CATALOG)
+    # "inverter" is in the name of 4 and 6 but only in the specs of 17
+    assert [pid for pid, _ in index.search("inverter")] == [4, 6, 17]
+
+def test_search_requires_every_term():
+    index = ProductSearchIndex(CATALOG)
+    assert [pid for pid, _ in index.search("quiet ge")] == [17]
+    assert index.search("quiet carrier") == []
+
+def test_postgres_ranking_needs_pg_trgm_only_when_installed():
+    from sqlalchemy.dialects import postgresql
+    from sqlalchemy.future import select
+    import models
+    from domain.catalog import _postgres_search
+
+    def sql(trigram):
+        query = _postgres_search(select(models.Product), "inverter", trigram)
+        return str(query.compile(dialect=postgresql.dialect()))
+
+    assert "similarity(" in sql(True)
+    assert "similarity(" not in sql(False)
+    assert "ts_rank(" in sql(False) and "ILIKE" in sql(False)
@@ -0,0 +1,110 @@
+import json
+import pytest
+from datetime import datetime, timedelta
+
+pytest.importorskip("aiosqlite")
+
+from sqlalchemy import update
+import models
+from domain import webhooks
+
+def stripe_event(event_id, type_="payment_intent.succeeded"):
+    event = {"id": event_id, "type": type_, "data": {"object": {"id": "pi_1"}}}
+    return event, json.dumps(event)
+
+async def event_row(session_factory, event_id):
+    async with session_factory() as session:
+        return await session.get(models.WebhookEvent, event_id)
+
+def test_redelivered_event_is_stored_once(run_with_db):
+    async def test(session_factory):
+        event, payload = stripe_event("evt_1")
+        async with session_factory() as session:
+            assert await webhooks.enqueue_event(session, event, payload) is True
+            assert await webhooks.enqueue_event(session, event, payload) is False
+            assert (await webhooks.get_queue_stats(session))["queue"] == {"PENDING": 1}
+
+    run_with_db(test)
+
+def test_handled_event_is_done_and_not_claimed_again(run_with_db):
+    async def test(session_factory):
+        handled = []
+
+        async def handler(event):
+            handled.append(event["id"])
+
+        event, payload = stripe_event("evt_1")
+        async with session_factory() as session:
+            await webhooks.enqueue_event(session, event, payload)
+
+        assert await webhooks.process_next_event(session_factory, handler) is True
+        assert await webhooks.process_next_event(session_factory, handler) is False
+        assert handled == ["evt_1"]
+        row = await event_row(session_factory, "evt_1")
+        assert row.status == models.WebhookStatus.DONE
+        assert row.processed_at is not None
+
+    run_with_db(test)
+
+def test_failing_event_is_retried_then_dead_lettered(run_with_db, monkeypatch):
+    monkeypatch.setattr(webhooks, "MAX_ATTEMPTS", 3)
+    monkeypatch.setattr(webhooks, "backoff_delay", lambda attempts: -1)
+
+    async def test(session_factory):
+        async def handler(event):
+            raise LookupError("Order not found")
+
+        event, payload = stripe_event("evt_1")
+        async with session_factory() as session:
+            await webhooks.enqueue_event(session, event, payload)
+
+        for _ in range(3):
+            assert await webhooks.process_next_event(session_factory, handler) is True
+        assert await webhooks.process_next_event(session_factory, handler) is False
+
+        row = await event_row(session_factory, "evt_1")
+        assert row.status == models.WebhookStatus.DEAD
+        assert row.attempts == 3
+        assert "Order not found" in row.last_error
+
+        async with session_factory() as session:
+            assert [e.id for e in await webhooks.list_dead_events(session)] == ["evt_1"]
+            assert await webhooks.requeue_event(session, "evt_1") is True
+            assert await webhooks.requeue_event(session, "evt_1") is False
+        row = await event_row(session_factory, "evt_1")
+        assert (row.status, row.attempts) == (models.WebhookStatus.PENDING, 0)
+
+    run_with_db(test)
+
+def test_old_done_events_are_purged_and_not_counted(run_with_db, monkeypatch):
+    monkeypatch.setattr(webhooks, "PURGE_BATCH", 2)
+
+    async def test(session_factory):
+        now = datetime.utcnow()
+        async with session_factory() as session:
+            for n in range(5):
+                event, payload = stripe_event(f"evt_old_{n}")
+                await webhooks.enqueue_event(session, event, payload)
+                await webhooks.complete_event(session, event["id"])
+            for event_id in ("evt_recent", "evt_pending"):
+                event, payload = stripe_event(event_id)
+                await webhooks.enqueue_event(session, event, payload)
+            await webhooks.complete_event(session, "evt_recent")
+
+            stats = await webhooks.get_queue_stats(session)
+            assert stats["queue"] == {"PENDING": 1}
+
+            later = now + timedelta(days=webhooks.RETENTION_DAYS, hours=1)
+            await session.execute(
+                update(models.WebhookEvent)
+                .where(models.WebhookEvent.id == "evt_recent")
+                .values(processed_at=later - timedelta(hours=2))
+            )
+            await session.commit()
+            assert await webhooks.purge_done_events(session, now=later) == 5
+
+        assert await event_row(session_factory, "evt_old_0") is None
+        assert (await event_row(session_factory, "evt_recent")).status == models.WebhookStatus.DONE
+        assert (await event_row(session_factory, "evt_pending")).status == models.WebhookStatus.PENDING
+
+    run_with_db(test)